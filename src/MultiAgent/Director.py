@@ -1,11 +1,12 @@
 from operator import add
+import asyncio
 from dotenv import load_dotenv
-from typing import TypedDict, Annotated
+from typing import TypedDict, Annotated, Literal
+from pydantic import BaseModel, Field
 from langchain_core.messages import AnyMessage
 from langgraph.graph import START, END
 from langgraph.graph import StateGraph
 from langchain_core.messages import HumanMessage,AIMessage
-from langgraph.checkpoint.memory import MemorySaver
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,6 +14,9 @@ from config.model_config import get_deepseek_model
 # 导入新的MCP管理模块
 sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcp'))
 from client.mcp_client_manager import get_mcp_manager, initialize_agents, get_domain_agent, get_deeplog_agent
+from fast_router import FastPathRouter
+from checkpointer import create_checkpointer
+from context_window import build_context, render_history
 # 定义日志函数
 def get_stream_writer():
     """简单的流式输出写入器"""
@@ -28,6 +32,8 @@ load_dotenv()
 # 修正：nodes 应该与模型返回的类型一致
 nodes = ["domain", "other"]
 llm = get_deepseek_model()
+# 首轮分类前的规则快速路由，命中时省去一次大模型调用；统计见 fast_router.stats()
+fast_router = FastPathRouter()
 
 # 全局Agent缓存变量 - 保持向后兼容性
 _domain_agent = None
@@ -70,185 +76,321 @@ def initialize_agents():
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add]
     type: str
+    # 本轮用户请求及子任务跟踪：tasks 为需要执行的节点类型，done 为已执行过的节点类型（按执行顺序）
+    request: str
+    tasks: list[str]
+    done: list[str]
 
-def supervisor_node(state: State):
-    writer = get_stream_writer()
-    writer({">>> supervisor_node"})
-    
-    prompt = """
+
+class LoopDecision(BaseModel):
+    """supervisor 循环中的单次决策：是否完成 + 下一步节点"""
+    finished: bool = Field(description="用户请求中的所有任务是否都已经完成")
+    next: Literal["domain", "other"] = Field(description="未完成时下一步要执行的节点；已完成时随意填写")
+    reason: str = Field(description="一句话说明判断依据")
+
+
+# 同一节点在一轮请求中最多执行的次数，防止循环
+MAX_NODE_RUNS = 3
+
+CLASSIFY_PROMPT = """
         你是一个专业的客服助手，负责对用户的问题进行分类，并将任务分给其他Agent执行。
         如果用户的问题是和域名相关的、与日志查询（QPS、带宽历史数据），那就返回domain。
         如果是其他的问题，返回other。
         注意：只返回上述两个单词中的一个，不要返回任何其他的内容。
         """
-    
-    # 修正：正确处理消息内容
+
+
+def _last_user_content(state: State) -> str:
+    """取最后一条消息内容作为用户问题"""
     if state["messages"] and hasattr(state["messages"][-1], 'content'):
-        user_content = state["messages"][-1].content
-    else:
-        user_content = str(state["messages"])
-    
-    print(f"用户问题: {user_content}")
-    
-    messages = [
-        {"role": "system", "content": prompt},
+        return state["messages"][-1].content
+    return str(state["messages"])
+
+
+def _classify_messages(user_content: str) -> list:
+    """构造首次任务分类的消息"""
+    return [
+        {"role": "system", "content": CLASSIFY_PROMPT},
         {"role": "user", "content": user_content}
     ]
-    
-    # 如果已有type属性且不是第一次执行，使用大模型判断是否完成
-    if "type" in state and state["type"] in ["domain", "other"]:
-        # 使用大模型判断任务是否完成
-        completion_prompt = f"""
-        请判断当前对话是否已经完成用户的任务需求。
-        
-        用户原始请求：
-        {state['messages'][0].content if state['messages'] else '无'}
-        
-        当前对话历史：
-        {[msg.content for msg in state['messages']]}
+
+
+LOOP_DECISION_PROMPT = """
+        请判断当前对话是否已经完成用户的任务需求；如果没有完成，决定下一步应该执行哪个处理节点。
         
-        当前任务类型：{state['type']}
+        可用节点：domain（域名、日志查询相关）, other（其他问题）
         
-        请仔细检查用户原始请求中是否包含多个任务要求，然后回答"完成"或"未完成"：
-        - 如果用户的所有任务要求都已经满足，回答"完成"
-        - 如果用户还有未完成的任务要求，回答"未完成"
+        请仔细检查用户原始请求中是否包含多个任务要求：
+        - 如果用户的所有任务要求都已经满足，finished 为 true
+        - 如果用户还有未完成的任务要求，finished 为 false，并在 next 中给出下一个节点
         
         特别注意：用户可能在一个请求中要求多个任务。
         """
-        
-        completion_messages = [
-            {"role": "system", "content": completion_prompt}
-        ]
-        
-        completion_response = llm.invoke(completion_messages)
-        completion_result = completion_response.content.strip()
-        
-        writer({"supervisor_step": f"任务完成状态判断: {completion_result}"})
-        
-        if "完成" in completion_result:
-            writer({"supervisor_step": f"任务已完成，流程结束"})
-            return {"type": END}
-        else:
-            # 判断下一步执行哪个节点
-            next_step_prompt = f"""
-            根据用户原始请求和当前进展，决定下一步应该执行哪个处理节点。
-            
-            用户原始请求：
-            {state['messages'][0].content if state['messages'] else '无'}
-            
-            当前对话历史：
-            {[msg.content for msg in state['messages']]}
-            
-            当前已完成的任务：{state['type']}
-            可用节点：domain, joke, chinese, other
-            
-            请分析用户还有哪些任务没有完成，选择最合适的下一个节点。
-            只返回节点名称（domain/joke/chinese/other）
-            """
-            
-            next_step_messages = [
-                {"role": "system", "content": next_step_prompt}
-            ]
-            
-            next_step_response = llm.invoke(next_step_messages)
-            next_node = next_step_response.content.strip().lower()
-            
-            # 打印信息调试
-            writer({"supervisor_step": f"大模型建议的下一个节点: {next_node}"})
-            
-            # 确保返回的节点在预定义节点中
-            if next_node not in nodes:
-                # 如果建议的节点不在预定义节点中，重新分析用户原始请求
-                original_request = state['messages'][0].content if state['messages'] else user_content
-                writer({"supervisor_step": f"重新分析原始请求: {original_request}"})
-                
-                # 重新分类原始请求
-                reclassify_messages = [
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": original_request}
-                ]
-                reclassify_response = llm.invoke(reclassify_messages)
-                next_node = reclassify_response.content.strip().lower()
-                writer({"supervisor_step": f"重新分类结果: {next_node}"})
-            
-            # 最终验证节点有效性
-            if next_node not in nodes:
-                next_node = "other"  # 默认使用 other
-            
-            writer({"supervisor_step": f"继续执行: {next_node}"})
-            return {"type": next_node}  # 这里应该返回节点名称，不是 END
+
+
+def _loop_decision_messages(state: State) -> list:
+    """
+    构造完成判断与下一步选择合并后的单次决策消息
     
-    # 首次执行，进行任务分类
-    response = llm.invoke(messages)
-    typeRes = response.content.strip().lower()
-    writer({"supervisor_step": f"问题分类结果: {typeRes}"})
+    固定的判断规则作为系统提示词在前（逐字节不变，可命中服务商的前缀缓存），本轮的请求、历史与进度放在其后
+    """
+    decision_input = f"""用户原始请求：
+{_current_request(state)}
+
+当前对话历史：
+{render_history(build_context(state['messages'], "supervisor"))}
+
+已执行过的节点：{state.get('done', [])}"""
+    return [
+        {"role": "system", "content": LOOP_DECISION_PROMPT},
+        {"role": "user", "content": decision_input},
+    ]
+
+
+def _current_request(state: State) -> str:
+    """本轮的用户请求，旧状态中没有 request 字段时取第一条消息"""
+    if state.get("request"):
+        return state["request"]
+    return state['messages'][0].content if state['messages'] else '无'
+
+
+def new_turn_input(content: str) -> dict:
+    """
+    构造新一轮对话的图输入
     
+    同一会话复用 thread_id 时，上一轮的 type/tasks/done 仍保存在 checkpoint 中，
+    这里一并重置，使 supervisor 对新问题重新分类，而不是沿用上一轮的子任务进度
+    """
+    return {
+        "messages": [HumanMessage(content=content)],
+        "type": "",
+        "request": content,
+        "tasks": [],
+        "done": [],
+    }
+
+
+def _track_done(state: State, node_type: str) -> list:
+    """记录节点已执行，供 supervisor 确定性地判断子任务进度"""
+    return list(state.get("done") or []) + [node_type]
+
+
+def _tracked_next(state: State):
+    """
+    根据子任务跟踪结果确定下一步，不调用大模型
+    
+    Returns:
+        下一步节点类型、END，或 None（跟踪信息不足以判断，需要大模型决策）
+    """
+    done = state.get("done") or []
+    pending = [task for task in state.get("tasks") or [] if task not in done]
+    if pending:
+        return pending[0]
+    # other 节点是固定回复，执行后没有可继续的工作
+    if done and done[-1] == "other":
+        return END
+    if done and done.count(done[-1]) >= MAX_NODE_RUNS:
+        print(f"⚠️  节点 '{done[-1]}' 已执行 {MAX_NODE_RUNS} 次，结束流程")
+        return END
+    return None
+
+
+def _loop_decision_result(decision: LoopDecision, writer) -> dict:
+    """将大模型决策转换为状态更新"""
+    writer({"supervisor_step": f"任务完成状态判断: {'完成' if decision.finished else '未完成'}，{decision.reason}"})
+    if decision.finished:
+        writer({"supervisor_step": f"任务已完成，流程结束"})
+        return {"type": END}
+    next_node = decision.next if decision.next in nodes else "other"
+    writer({"supervisor_step": f"继续执行: {next_node}"})
+    return {"type": next_node}
+
+
+def _classification_result(typeRes: str, request: str) -> dict:
+    """校验首次分类结果，不在预定义节点中时使用 other"""
     print(f"模型返回类型: '{typeRes}'")
     print(f"预定义节点: {nodes}")
     
     # 修正：检查类型是否在预定义节点中
     if typeRes in nodes:
         print(f"✅ 类型 '{typeRes}' 在预定义节点中")
-        return {"type": typeRes}
     else:
         print(f"⚠️  类型 '{typeRes}' 不在预定义节点中，使用 'other'")
-        return {"type": "other"}
-def domain_node(state: State):
-    print(">>> domain_node")
+        typeRes = "other"
+    return _first_turn_result(typeRes, request)
+
+
+def _first_turn_result(node_type: str, request: str) -> dict:
+    """首轮分类后初始化子任务跟踪"""
+    return {"type": node_type, "request": request, "tasks": [node_type], "done": []}
+
+
+def supervisor_node(state: State):
     writer = get_stream_writer()
-    writer({"node": "domain_node"})
+    writer({">>> supervisor_node"})
     
-    # 初始化Agents（如果还没有初始化）
-    if not initialize_agents():
-        error_msg = f"MCP服务连接失败: {_initialization_error}。请检查domain-info-service (http://127.0.0.1:10025/sse) 是否正常运行。"
-        writer({"error": error_msg})
-        return {"messages": [AIMessage(content=error_msg)], "type": "domain"}
+    user_content = _last_user_content(state)
+    print(f"用户问题: {user_content}")
+    
+    # 如果已有type属性且不是第一次执行，判断是否完成以及下一步
+    if "type" in state and state["type"] in nodes:
+        # 优先使用确定性的子任务跟踪，无法判断时才调用一次大模型
+        tracked = _tracked_next(state)
+        if tracked is not None:
+            writer({"supervisor_step": f"子任务跟踪结果: {tracked}"})
+            return {"type": tracked}
+        
+        decision = llm.with_structured_output(LoopDecision).invoke(_loop_decision_messages(state))
+        return _loop_decision_result(decision, writer)
+    
+    # 首次执行，先尝试规则快速路由
+    fast_type = fast_router.classify(user_content)
+    if fast_type in nodes:
+        writer({"supervisor_step": f"快速路由分类结果: {fast_type}"})
+        return _first_turn_result(fast_type, user_content)
+    
+    # 置信度不足，回退到大模型进行任务分类
+    response = llm.invoke(_classify_messages(user_content))
+    typeRes = response.content.strip().lower()
+    writer({"supervisor_step": f"问题分类结果: {typeRes}"})
+    return _classification_result(typeRes, user_content)
+
+
+async def asupervisor_node(state: State):
+    """supervisor_node 的异步版本，使用 ainvoke 调用大模型"""
+    writer = get_stream_writer()
+    writer({">>> supervisor_node"})
+    
+    user_content = _last_user_content(state)
+    print(f"用户问题: {user_content}")
+    
+    if "type" in state and state["type"] in nodes:
+        tracked = _tracked_next(state)
+        if tracked is not None:
+            writer({"supervisor_step": f"子任务跟踪结果: {tracked}"})
+            return {"type": tracked}
+        
+        decision = await llm.with_structured_output(LoopDecision).ainvoke(_loop_decision_messages(state))
+        return _loop_decision_result(decision, writer)
     
+    fast_type = fast_router.classify(user_content)
+    if fast_type in nodes:
+        writer({"supervisor_step": f"快速路由分类结果: {fast_type}"})
+        return _first_turn_result(fast_type, user_content)
+    
+    response = await llm.ainvoke(_classify_messages(user_content))
+    typeRes = response.content.strip().lower()
+    writer({"supervisor_step": f"问题分类结果: {typeRes}"})
+    return _classification_result(typeRes, user_content)
+
+
+DOMAIN_SYSTEM_PROMPT = """
+        你是一个专业的域名、日志数据分析领域专家，根据提供的工具完成域名、日志数据检索和分析相关的功能。
+        """
+
+DEEPLOG_SYSTEM_PROMPT = """
+    你是一个专业的语言大师，用于分析中文句子成分，负责中文的语义分析，输出所有的名词、动词、形容词、副词。
+    特别注意：除此之外，不做任何其他的推理工作！
+    """
+
+
+def _domain_prompts(state: State) -> list:
+    """构造 domain agent 的输入消息"""
     # 修正：正确构建消息格式
+    return [
+        {"role": "system", "content": DOMAIN_SYSTEM_PROMPT},
+        {"role": "user", "content": _last_user_content(state)}
+    ]
+
+
+def _deeplog_prompts(state: State) -> list:
+    """构造 deeplog agent 的输入消息"""
     if state["messages"] and hasattr(state["messages"][-1], 'content'):
         user_input = state["messages"][-1].content
+        user_prompt = f"用户请求：{user_input}\n\n请根据以上要求分析中文句子成分。"
     else:
-        user_input = str(state["messages"])
+        user_prompt = "请创作一个有趣的对联，主题不限。"
     
-    system_prompt = """
-        你是一个专业的域名、日志数据分析领域专家，根据提供的工具完成域名、日志数据检索和分析相关的功能。
-        """
-        
-    prompts = [
-        {"role": "system", "content":system_prompt},
-        {"role":"user","content":user_input}
+    return [
+        {"role": "system", "content": DEEPLOG_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
     ]
+
+
+def _agent_result(response, default: str) -> str:
+    """从 agent 返回中提取最后一条消息内容"""
+    # 修正：正确提取响应内容
+    if response and "messages" in response and response["messages"]:
+        last_message = response["messages"][-1]
+        if hasattr(last_message, 'content'):
+            return last_message.content
+        return str(last_message)
+    return default
+
+
+def _agent_error(kind: str, label: str, e: Exception) -> str:
+    """打印 agent 调用异常并返回给用户的错误信息"""
+    print(f"🔍 [DEBUG] {kind} Agent 调用异常: {type(e).__name__}: {str(e)}")
+    import traceback
+    print(f"🔍 [DEBUG] 异常堆栈: {traceback.format_exc()}")
+    return f"{label}过程中出现错误: {str(e)}。这可能是因为MCP服务连接中断或服务重启导致的。"
+
+
+def domain_node(state: State):
+    print(">>> domain_node")
+    writer = get_stream_writer()
+    writer({"node": "domain_node"})
+    
+    # 初始化Agents（如果还没有初始化）
+    if not initialize_agents():
+        error_msg = f"MCP服务连接失败: {_initialization_error}。请检查domain-info-service (http://127.0.0.1:10025/sse) 是否正常运行。"
+        writer({"error": error_msg})
+        return {"messages": [AIMessage(content=error_msg)], "type": "domain", "done": _track_done(state, "domain")}
     
     try:
         writer({"domain_step": "调用域名查询工具..."})
         
         print("🔍 [DEBUG] 调用缓存的 domain Agent...")
         # 使用缓存的domain agent（保持向后兼容性）
-        domain_agent = _domain_agent or get_domain_agent()
-        response = domain_agent.invoke({"messages":prompts})
-        
-        # 修正：正确提取响应内容
-        if response and "messages" in response and response["messages"]:
-            last_message = response["messages"][-1]
-            if hasattr(last_message, 'content'):
-                result_content = last_message.content
-            else:
-                result_content = str(last_message)
-        else:
-            result_content = "域名查询完成"
+        domain_agent = get_domain_agent() or _domain_agent
+        response = domain_agent.invoke({"messages": _domain_prompts(state)})
+        result_content = _agent_result(response, "域名查询完成")
             
         writer({"domain_result": result_content})
         
         # 修正：返回正确的消息格式
-        return {"messages": [AIMessage(content=result_content)], "type": "domain"}
+        return {"messages": [AIMessage(content=result_content)], "type": "domain", "done": _track_done(state, "domain")}
         
     except Exception as e:
-        print(f"🔍 [DEBUG] domain Agent 调用异常: {type(e).__name__}: {str(e)}")
-        import traceback
-        print(f"🔍 [DEBUG] 异常堆栈: {traceback.format_exc()}")
-        error_msg = f"域名查询过程中出现错误: {str(e)}。这可能是因为MCP服务连接中断或服务重启导致的。"
+        error_msg = _agent_error("domain", "域名查询", e)
         writer({"error": error_msg})
-        return {"messages": [AIMessage(content=error_msg)], "type": "domain"}
+        return {"messages": [AIMessage(content=error_msg)], "type": "domain", "done": _track_done(state, "domain")}
+
+
+async def adomain_node(state: State):
+    """domain_node 的异步版本，agent 通过 ainvoke 直接使用异步 MCP 工具"""
+    print(">>> domain_node")
+    writer = get_stream_writer()
+    writer({"node": "domain_node"})
+    
+    # 首次初始化需要与MCP服务握手，放到线程中执行，避免阻塞事件循环
+    if not _agent_initialized and not await asyncio.to_thread(initialize_agents):
+        error_msg = f"MCP服务连接失败: {_initialization_error}。请检查domain-info-service (http://127.0.0.1:10025/sse) 是否正常运行。"
+        writer({"error": error_msg})
+        return {"messages": [AIMessage(content=error_msg)], "type": "domain", "done": _track_done(state, "domain")}
+    
+    try:
+        writer({"domain_step": "调用域名查询工具..."})
+        domain_agent = get_domain_agent() or _domain_agent
+        response = await domain_agent.ainvoke({"messages": _domain_prompts(state)})
+        result_content = _agent_result(response, "域名查询完成")
+        writer({"domain_result": result_content})
+        return {"messages": [AIMessage(content=result_content)], "type": "domain", "done": _track_done(state, "domain")}
+        
+    except Exception as e:
+        error_msg = _agent_error("domain", "域名查询", e)
+        writer({"error": error_msg})
+        return {"messages": [AIMessage(content=error_msg)], "type": "domain", "done": _track_done(state, "domain")}
 
 
 def deeplog_node(state:State):
@@ -260,55 +402,53 @@ def deeplog_node(state:State):
     if not initialize_agents():
         error_msg = f"MCP服务连接失败: {_initialization_error}。请检查deeplog-ck-server (http://127.0.0.1:10026/sse) 是否正常运行。"
         writer({"error": error_msg})
-        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog"}
-    
-    system_prompt="""
-    你是一个专业的语言大师，用于分析中文句子成分，负责中文的语义分析，输出所有的名词、动词、形容词、副词。
-    特别注意：除此之外，不做任何其他的推理工作！
-    """
-    if state["messages"] and hasattr(state["messages"][-1], 'content'):
-        user_input = state["messages"][-1].content
-        user_prompt = f"用户请求：{user_input}\n\n请根据以上要求分析中文句子成分。"
-    else:
-        user_prompt = "请创作一个有趣的对联，主题不限。"
-    
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": user_prompt}
-    ]
+        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog", "done": _track_done(state, "deeplog")}
     
     try:
         writer({"deeplog_step": "调用日志分析工具..."})
         
         print("🔍 [DEBUG] 调用缓存的 deeplog Agent...")
         # 使用缓存的deeplog agent（保持向后兼容性）
-        deeplog_agent = _deeplog_agent or get_deeplog_agent()
-        response = deeplog_agent.invoke({"messages":messages})
-        
-        # 修正：正确提取响应内容
-        if response and "messages" in response and response["messages"]:
-            last_message = response["messages"][-1]
-            if hasattr(last_message, 'content'):
-                result_content = last_message.content
-            else:
-                result_content = str(last_message)
-        else:
-            result_content = "日志分析完成"
+        deeplog_agent = get_deeplog_agent() or _deeplog_agent
+        response = deeplog_agent.invoke({"messages": _deeplog_prompts(state)})
+        result_content = _agent_result(response, "日志分析完成")
             
         writer({"deeplog_result": result_content})
         
         #拿到大模型思考结果后，更新state状态
         #必须要HumanMessage方式返回，不可以直接返回字符串
         #langchain中有不同消息类型：
-        return {"messages": [AIMessage(content=result_content)], "type": "deeplog"}
+        return {"messages": [AIMessage(content=result_content)], "type": "deeplog", "done": _track_done(state, "deeplog")}
+        
+    except Exception as e:
+        error_msg = _agent_error("deeplog", "日志分析", e)
+        writer({"error": error_msg})
+        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog", "done": _track_done(state, "deeplog")}
+
+
+async def adeeplog_node(state: State):
+    """deeplog_node 的异步版本"""
+    print(">>> deeplog_node")
+    writer = get_stream_writer()
+    writer({"node": "deeplog_node"})
+    
+    if not _agent_initialized and not await asyncio.to_thread(initialize_agents):
+        error_msg = f"MCP服务连接失败: {_initialization_error}。请检查deeplog-ck-server (http://127.0.0.1:10026/sse) 是否正常运行。"
+        writer({"error": error_msg})
+        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog", "done": _track_done(state, "deeplog")}
+    
+    try:
+        writer({"deeplog_step": "调用日志分析工具..."})
+        deeplog_agent = get_deeplog_agent() or _deeplog_agent
+        response = await deeplog_agent.ainvoke({"messages": _deeplog_prompts(state)})
+        result_content = _agent_result(response, "日志分析完成")
+        writer({"deeplog_result": result_content})
+        return {"messages": [AIMessage(content=result_content)], "type": "deeplog", "done": _track_done(state, "deeplog")}
         
     except Exception as e:
-        print(f"🔍 [DEBUG] deeplog Agent 调用异常: {type(e).__name__}: {str(e)}")
-        import traceback
-        print(f"🔍 [DEBUG] 异常堆栈: {traceback.format_exc()}")
-        error_msg = f"日志分析过程中出现错误: {str(e)}。这可能是因为MCP服务连接中断或服务重启导致的。"
+        error_msg = _agent_error("deeplog", "日志分析", e)
         writer({"error": error_msg})
-        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog"}
+        return {"messages": [AIMessage(content=error_msg)], "type": "deeplog", "done": _track_done(state, "deeplog")}
 
 
 def other_node(state: State):
@@ -316,7 +456,7 @@ def other_node(state: State):
     writer = get_stream_writer()
     writer({"node": "other_node"})
     other_response = "我主要擅长域名相关问题的处理，您的问题暂时无法回答。"
-    return {"messages": [HumanMessage(content=other_response)], "type": "other"}
+    return {"messages": [HumanMessage(content=other_response)], "type": "other", "done": _track_done(state, "other")}
 
 def routing_func(state: State):
     print(f"路由函数接收到类型: {state['type']}")
@@ -331,30 +471,40 @@ def routing_func(state: State):
         print(f"❌ 未知类型: {state['type']}，路由到 other_node")
         return "other_node"
 
-# 构建图
-builder = StateGraph(State)
-builder.add_node("supervisor_node", supervisor_node)
-builder.add_node("domain_node", domain_node)
-builder.add_node("other_node", other_node)
-
-# 设置流程
-builder.add_edge(START, "supervisor_node")
-
-# 条件路由，langgraph执行引擎
-builder.add_conditional_edges(
-    "supervisor_node",
-    routing_func,
-    {
-        "domain_node": "domain_node",
-        "other_node": "other_node",
-        END: END
-    }
-)
+def build_graph(supervisor, domain, other):
+    """用给定的节点函数构建图，同步与异步两套节点共用同一拓扑"""
+    builder = StateGraph(State)
+    builder.add_node("supervisor_node", supervisor)
+    builder.add_node("domain_node", domain)
+    builder.add_node("other_node", other)
+    
+    # 设置流程
+    builder.add_edge(START, "supervisor_node")
+    
+    # 条件路由，langgraph执行引擎
+    builder.add_conditional_edges(
+        "supervisor_node",
+        routing_func,
+        {
+            "domain_node": "domain_node",
+            "other_node": "other_node",
+            END: END
+        }
+    )
+    
+    # 各个处理节点完成后回到 supervisor_node 进行结果确认
+    builder.add_edge("domain_node", "supervisor_node")
+    builder.add_edge("other_node", "supervisor_node")
+    return builder
+
 
-# 各个处理节点完成后回到 supervisor_node 进行结果确认
-builder.add_edge("domain_node", "supervisor_node")
-builder.add_edge("other_node", "supervisor_node")
+async def aother_node(state: State):
+    return other_node(state)
 
-checkpointer = MemorySaver()
-graph = builder.compile(checkpointer=checkpointer)
 
+# checkpoint 存储由 DIRECTOR_CHECKPOINTER 环境变量选择（bounded / memory / sqlite），同步图与异步图共用
+checkpointer = create_checkpointer()
+# 同步图：graph.invoke / graph.stream
+graph = build_graph(supervisor_node, domain_node, other_node).compile(checkpointer=checkpointer)
+# 异步图：async_graph.ainvoke / async_graph.astream，一个进程内可并发服务多个会话
+async_graph = build_graph(asupervisor_node, adomain_node, aother_node).compile(checkpointer=checkpointer)
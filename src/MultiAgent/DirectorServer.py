@@ -1,22 +1,314 @@
-from Director import graph
-import random
-from langchain_core.messages import HumanMessage,AIMessage
-config = {
-    "configurable": 
-        {
-            "thread_id": random.randint(1,10000)
-        }
-    }
-input_data = {
-        "messages": [HumanMessage(content="帮我查询jd.local域名的信息")]
-    }
-    
-print("开始执行多Agent流程...")
-    
-    # 方式1：使用 invoke
-res = graph.invoke(
-        input_data,
-        config=config,
-        stream_mode="values"
+"""
+Director 多Agent系统的 HTTP/SSE 服务
+面向程序化调用方（自动化脚本等），不经过 Gradio 界面直接调用编译好的 Director 图
+
+接口：
+- POST /invoke                      执行一轮对话，返回最终结果
+- POST /stream                      执行一轮对话，以 SSE 推送路由决策、工具进度、token 与最终结果
+- POST /threads/{thread_id}/resume  在已有线程上继续：带 message 时开始新一轮，不带时从最近的 checkpoint 恢复执行
+- GET  /threads/{thread_id}         查看线程当前状态
+- GET  /health                      并发与容量信息
+
+准入控制：同时执行的请求数超过 DIRECTOR_MAX_CONCURRENCY 时直接返回 429；
+单个请求超过 DIRECTOR_REQUEST_TIMEOUT 秒返回 504（已完成的步骤保存在 checkpoint 中，可通过 resume 继续）
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional
+
+import uvicorn
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langgraph.graph import END
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from Director import async_graph, checkpointer, new_turn_input
+from checkpointer import running
+from config.llm_telemetry import prompt_cache_telemetry
+
+DIRECTOR_HOST = os.getenv("DIRECTOR_HOST", "0.0.0.0")
+DIRECTOR_PORT = int(os.getenv("DIRECTOR_PORT", "8000"))
+# 同时执行的请求数上限，超出时返回 429
+DIRECTOR_MAX_CONCURRENCY = int(os.getenv("DIRECTOR_MAX_CONCURRENCY", "16"))
+# 单个请求的超时时间（秒），超时返回 504
+DIRECTOR_REQUEST_TIMEOUT = float(os.getenv("DIRECTOR_REQUEST_TIMEOUT", "120"))
+
+_slots = asyncio.Semaphore(DIRECTOR_MAX_CONCURRENCY)
+_stats = {"in_flight": 0, "accepted": 0, "rejected": 0, "timeouts": 0, "errors": 0}
+
+
+class Overloaded(Exception):
+    """并发已满，拒绝新请求"""
+
+
+class _Admission:
+    """准入控制：不排队，并发已满时立即拒绝，避免请求在服务端堆积"""
+
+    async def __aenter__(self):
+        if _slots.locked():
+            _stats["rejected"] += 1
+            raise Overloaded()
+        await _slots.acquire()
+        _stats["accepted"] += 1
+        _stats["in_flight"] += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        _stats["in_flight"] -= 1
+        _slots.release()
+        return False
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+async def _read_body(request: Request) -> Dict[str, Any]:
+    """读取 JSON 请求体，为空时返回空字典"""
+    raw = await request.body()
+    if not raw:
+        return {}
+    body = json.loads(raw)
+    if not isinstance(body, dict):
+        raise ValueError("请求体必须是 JSON 对象")
+    return body
+
+
+def _error(status: int, message: str, **extra) -> JSONResponse:
+    return JSONResponse({"error": message, **extra}, status_code=status)
+
+
+def _message_dict(message) -> Dict[str, Any]:
+    return {"type": getattr(message, "type", ""), "content": getattr(message, "content", str(message))}
+
+
+def _final_answer(values: Dict[str, Any]) -> Optional[str]:
+    messages = values.get("messages") or []
+    return messages[-1].content if messages else None
+
+
+async def _thread_exists(thread_id: str) -> bool:
+    snapshot = await async_graph.aget_state(_config(thread_id))
+    return bool(snapshot.values)
+
+
+def _graph_input(body: Dict[str, Any]):
+    """带 message 时开始新一轮；不带时输入为 None，从最近的 checkpoint 继续执行"""
+    message = body.get("message")
+    return new_turn_input(message) if message else None
+
+
+async def _run(thread_id: str, graph_input) -> JSONResponse:
+    """执行图直到结束，超时返回 504"""
+    started = time.perf_counter()
+    try:
+        async with _Admission():
+            with running(checkpointer, thread_id):
+                values = await asyncio.wait_for(
+                    async_graph.ainvoke(graph_input, config=_config(thread_id)),
+                    timeout=DIRECTOR_REQUEST_TIMEOUT,
+                )
+    except Overloaded:
+        return _error(429, "服务繁忙，请稍后重试", thread_id=thread_id)
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        return _error(504, f"请求超过 {DIRECTOR_REQUEST_TIMEOUT} 秒未完成，可通过 resume 继续", thread_id=thread_id)
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"🔍 [DEBUG] Director 执行异常: {type(e).__name__}: {e}")
+        return _error(500, f"系统出错：{e}", thread_id=thread_id)
+    return JSONResponse({
+        "thread_id": thread_id,
+        "answer": _final_answer(values),
+        "done": values.get("done", []),
+        "elapsed": round(time.perf_counter() - started, 3),
+    })
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_events(mode: str, payload) -> list:
+    """将 astream 的一个输出转换为 SSE 事件列表"""
+    events = []
+    if mode == "messages":
+        chunk, metadata = payload
+        # supervisor 的分类/决策输出是内部标签，不推送
+        if metadata.get("langgraph_node") == "supervisor_node":
+            return events
+        if isinstance(chunk, ToolMessage):
+            events.append(_sse("tool_result", {"name": chunk.name}))
+        elif isinstance(chunk, AIMessageChunk):
+            for tool_chunk in chunk.tool_call_chunks or []:
+                if tool_chunk.get("name"):
+                    events.append(_sse("tool_call", {"name": tool_chunk["name"]}))
+            if isinstance(chunk.content, str) and chunk.content:
+                events.append(_sse("token", {"node": metadata.get("langgraph_node"), "content": chunk.content}))
+    elif mode == "updates":
+        for node, update in (payload or {}).items():
+            if not isinstance(update, dict):
+                continue
+            if node == "supervisor_node":
+                if update.get("type"):
+                    events.append(_sse("route", {"next": update["type"], "finished": update["type"] == END}))
+            else:
+                messages = update.get("messages") or []
+                events.append(_sse("answer", {
+                    "node": node,
+                    "content": messages[-1].content if messages else None,
+                }))
+    return events
+
+
+async def _event_stream(thread_id: str, graph_input) -> AsyncIterator[str]:
+    """SSE 事件流；准入与超时在流内处理，以 error 事件通知客户端"""
+    try:
+        async with _Admission():
+            with running(checkpointer, thread_id):
+                deadline = time.monotonic() + DIRECTOR_REQUEST_TIMEOUT
+                yield _sse("start", {"thread_id": thread_id})
+                stream = async_graph.astream(
+                    graph_input,
+                    config=_config(thread_id),
+                    stream_mode=["messages", "updates"],
+                ).__aiter__()
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        try:
+                            mode, payload = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                        except StopAsyncIteration:
+                            break
+                        for event in _stream_events(mode, payload):
+                            yield event
+                finally:
+                    await stream.aclose()
+                yield _sse("done", {"thread_id": thread_id})
+    except Overloaded:
+        yield _sse("error", {"status": 429, "error": "服务繁忙，请稍后重试", "thread_id": thread_id})
+    except asyncio.TimeoutError:
+        _stats["timeouts"] += 1
+        yield _sse("error", {
+            "status": 504,
+            "error": f"请求超过 {DIRECTOR_REQUEST_TIMEOUT} 秒未完成，可通过 resume 继续",
+            "thread_id": thread_id,
+        })
+    except Exception as e:
+        _stats["errors"] += 1
+        print(f"🔍 [DEBUG] Director 流式执行异常: {type(e).__name__}: {e}")
+        yield _sse("error", {"status": 500, "error": f"系统出错：{e}", "thread_id": thread_id})
+
+
+async def invoke(request: Request):
+    """POST /invoke  {"message": "...", "thread_id": 可选}"""
+    try:
+        body = await _read_body(request)
+    except ValueError as e:
+        return _error(400, f"请求体格式错误: {e}")
+    if not body.get("message"):
+        return _error(400, "缺少 message")
+    thread_id = body.get("thread_id") or str(uuid.uuid4())
+    return await _run(thread_id, _graph_input(body))
+
+
+async def stream(request: Request):
+    """POST /stream  {"message": "...", "thread_id": 可选}，返回 text/event-stream"""
+    try:
+        body = await _read_body(request)
+    except ValueError as e:
+        return _error(400, f"请求体格式错误: {e}")
+    if not body.get("message"):
+        return _error(400, "缺少 message")
+    # 并发已满时在建立事件流之前直接拒绝
+    if _slots.locked():
+        _stats["rejected"] += 1
+        return _error(429, "服务繁忙，请稍后重试")
+    thread_id = body.get("thread_id") or str(uuid.uuid4())
+    return StreamingResponse(
+        _event_stream(thread_id, _graph_input(body)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-print("最终结果:", res["messages"][-1].content)
\ No newline at end of file
+
+
+async def resume_thread(request: Request):
+    """
+    POST /threads/{thread_id}/resume  {"message": 可选, "stream": 可选}
+
+    带 message 时在该线程上开始新一轮（保留历史）；不带时从最近的 checkpoint 继续执行未完成的流程
+    """
+    thread_id = request.path_params["thread_id"]
+    try:
+        body = await _read_body(request)
+    except ValueError as e:
+        return _error(400, f"请求体格式错误: {e}")
+    if not await _thread_exists(thread_id):
+        return _error(404, "线程不存在", thread_id=thread_id)
+    graph_input = _graph_input(body)
+    if body.get("stream"):
+        if _slots.locked():
+            _stats["rejected"] += 1
+            return _error(429, "服务繁忙，请稍后重试", thread_id=thread_id)
+        return StreamingResponse(
+            _event_stream(thread_id, graph_input),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return await _run(thread_id, graph_input)
+
+
+async def thread_state(request: Request):
+    """GET /threads/{thread_id}"""
+    thread_id = request.path_params["thread_id"]
+    snapshot = await async_graph.aget_state(_config(thread_id))
+    if not snapshot.values:
+        return _error(404, "线程不存在", thread_id=thread_id)
+    values = snapshot.values
+    return JSONResponse({
+        "thread_id": thread_id,
+        "messages": [_message_dict(m) for m in values.get("messages", [])],
+        "request": values.get("request"),
+        "tasks": values.get("tasks", []),
+        "done": values.get("done", []),
+        # 非空表示流程未结束（例如超时中断），可通过 resume 继续
+        "next": list(snapshot.next),
+    })
+
+
+async def health(request: Request):
+    """GET /health"""
+    return JSONResponse({
+        "status": "ok",
+        "max_concurrency": DIRECTOR_MAX_CONCURRENCY,
+        "timeout": DIRECTOR_REQUEST_TIMEOUT,
+        **_stats,
+        # checkpoint 存储的常驻线程数/字节数（内存存储）或批量提交统计（SQLite）
+        "checkpointer": checkpointer.stats() if hasattr(checkpointer, "stats") else None,
+        # 各节点的服务商前缀缓存命中情况
+        "prompt_cache": prompt_cache_telemetry.stats(),
+    })
+
+
+app = Starlette(routes=[
+    Route("/invoke", invoke, methods=["POST"]),
+    Route("/stream", stream, methods=["POST"]),
+    Route("/threads/{thread_id}/resume", resume_thread, methods=["POST"]),
+    Route("/threads/{thread_id}", thread_state, methods=["GET"]),
+    Route("/health", health, methods=["GET"]),
+])
+
+
+if __name__ == "__main__":
+    print("🚀 启动 Director HTTP/SSE 服务...")
+    print(f"⚙️  并发上限：{DIRECTOR_MAX_CONCURRENCY}，请求超时：{DIRECTOR_REQUEST_TIMEOUT} 秒")
+    print(f"🌐 访问地址：http://{DIRECTOR_HOST}:{DIRECTOR_PORT}")
+    uvicorn.run(app, host=DIRECTOR_HOST, port=DIRECTOR_PORT)
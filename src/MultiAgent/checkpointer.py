@@ -0,0 +1,631 @@
+"""
+checkpoint 存储
+MemorySaver 会把每个线程的完整历史永久保存在进程内存中，重启即丢失；
+这里提供有容量上限（TTL + LRU 淘汰）的内存 checkpointer，以及基于 SQLite 的持久化 checkpointer
+（WAL 模式、批量写入、按 (thread_id, checkpoint_ns, checkpoint_id) 建主键索引），
+并通过 create_checkpointer() 按环境变量选择存储方式
+"""
+
+import asyncio
+import atexit
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+try:
+    from langgraph.checkpoint.base import get_checkpoint_metadata
+except ImportError:  # 旧版本 langgraph 没有该函数，直接使用节点给出的元数据
+    def get_checkpoint_metadata(config: RunnableConfig, metadata: CheckpointMetadata) -> CheckpointMetadata:
+        return metadata
+
+# 存储方式：bounded（默认，有容量上限的内存存储）/ memory / sqlite
+CHECKPOINTER = os.getenv("DIRECTOR_CHECKPOINTER", "bounded")
+# 内存存储的容量上限：最多保留的线程数、总字节数，以及线程空闲多久（秒）后淘汰
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "1000"))
+CHECKPOINT_MAX_BYTES = int(os.getenv("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+CHECKPOINT_IDLE_TTL = float(os.getenv("CHECKPOINT_IDLE_TTL", "3600"))
+# SQLite 数据库文件路径
+CHECKPOINT_DB = os.getenv("DIRECTOR_CHECKPOINT_DB", "director_checkpoints.db")
+# 批量写入：缓冲的写操作达到 CHECKPOINT_BATCH_SIZE 条或等待 CHECKPOINT_FLUSH_MS 毫秒后在一个事务中提交
+CHECKPOINT_BATCH_SIZE = int(os.getenv("CHECKPOINT_BATCH_SIZE", "64"))
+CHECKPOINT_FLUSH_MS = int(os.getenv("CHECKPOINT_FLUSH_MS", "50"))
+# 提交失败后的最长重试间隔（毫秒），从 CHECKPOINT_FLUSH_MS 开始逐次翻倍
+CHECKPOINT_RETRY_MAX_MS = int(os.getenv("CHECKPOINT_RETRY_MAX_MS", "5000"))
+# 同一批写操作连续失败的次数上限，达到后逐条提交，仍失败的写操作移入死信列表
+CHECKPOINT_MAX_ATTEMPTS = int(os.getenv("CHECKPOINT_MAX_ATTEMPTS", "5"))
+# 死信列表保留的写操作条数
+CHECKPOINT_DEAD_LETTER_SIZE = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+) WITHOUT ROWID;
+"""
+
+_INSERT_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+_UPSERT_WRITE = "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_INSERT_WRITE = "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """
+    SQLite 持久化 checkpointer
+
+    - WAL 模式 + synchronous=NORMAL，读写互不阻塞
+    - 写操作先进入缓冲区，由后台线程按批在一个事务中提交；读操作前先提交缓冲区，保证读到最新状态。
+      进程崩溃时最多丢失最近 CHECKPOINT_FLUSH_MS 毫秒内的 checkpoint
+    - checkpoints 表主键为 (thread_id, checkpoint_ns, checkpoint_id)，checkpoint_id 随时间单调递增，
+      取最新 checkpoint、get_state_history 与按 checkpoint_id 回溯（time travel）都走主键索引，不做全表扫描
+    - 异步接口在线程池中执行同步实现，可直接用于 async_graph
+    """
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB,
+        batch_size: int = CHECKPOINT_BATCH_SIZE,
+        flush_interval: float = CHECKPOINT_FLUSH_MS / 1000,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        # 缓冲区：[(sql, 参数行)]，按写入顺序提交
+        self._buffer: List[Tuple[str, tuple]] = []
+        self._db_lock = threading.Lock()
+        self._buffer_cond = threading.Condition()
+        self._closed = False
+        self._stats = {"flushes": 0, "rows": 0, "errors": 0, "dropped": 0}
+        # 连续提交失败次数，成功后清零
+        self._failures = 0
+        # 多次重试仍无法提交的写操作 [(sql, 参数行, 错误)]，只保留最近 CHECKPOINT_DEAD_LETTER_SIZE 条
+        self.dead_letter: List[Tuple[str, tuple, str]] = []
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    # ---------- 批量写入 ----------
+
+    def _enqueue(self, rows: List[Tuple[str, tuple]]):
+        with self._buffer_cond:
+            was_empty = not self._buffer
+            self._buffer.extend(rows)
+            # 缓冲区由空变为非空时唤醒后台线程开始计时，凑满一批时唤醒立即提交
+            if was_empty or len(self._buffer) >= self.batch_size:
+                self._buffer_cond.notify()
+
+    def _flush_loop(self):
+        retry_delay = self.flush_interval
+        while True:
+            with self._buffer_cond:
+                if not self._buffer and not self._closed:
+                    self._buffer_cond.wait()
+                if self._closed and not self._buffer:
+                    return
+                if len(self._buffer) < self.batch_size and not self._closed:
+                    # 等待凑满一批或到达刷新间隔
+                    self._buffer_cond.wait(self.flush_interval)
+            try:
+                self.flush()
+                retry_delay = self.flush_interval
+            except Exception as e:
+                # 失败的写操作已放回缓冲区头部，后台线程不退出，按递增间隔重试；关闭时交给 close 做最后一次提交
+                print(f"🔍 [DEBUG] checkpoint 批量提交失败，{retry_delay:.2f}s 后重试: {type(e).__name__}: {e}")
+                with self._buffer_cond:
+                    if self._closed:
+                        return
+                    self._buffer_cond.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, CHECKPOINT_RETRY_MAX_MS / 1000)
+
+    def flush(self):
+        """
+        将缓冲区中的写操作在一个事务中提交
+
+        失败时回滚并把这批写操作放回缓冲区头部（保持写入顺序）后抛出异常；
+        连续失败 CHECKPOINT_MAX_ATTEMPTS 次后改为逐条提交，仍失败的写操作移入死信列表，不再重试
+        """
+        with self._db_lock:
+            with self._buffer_cond:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                self._conn.execute("BEGIN")
+                for sql, params in batch:
+                    self._conn.execute(sql, params)
+                self._conn.execute("COMMIT")
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                self._stats["errors"] += 1
+                self._failures += 1
+                if self._failures < CHECKPOINT_MAX_ATTEMPTS:
+                    with self._buffer_cond:
+                        self._buffer[:0] = batch
+                    raise
+                self._salvage(batch)
+                self._failures = 0
+                return
+            self._failures = 0
+            self._stats["flushes"] += 1
+            self._stats["rows"] += len(batch)
+
+    def _salvage(self, batch: List[Tuple[str, tuple]]):
+        """逐条提交多次重试失败的批次，每条写操作一个保存点，失败的移入死信列表（调用方持有 _db_lock）"""
+        failed = []
+        try:
+            self._conn.execute("BEGIN")
+            for sql, params in batch:
+                self._conn.execute("SAVEPOINT row")
+                try:
+                    self._conn.execute(sql, params)
+                except Exception as e:
+                    self._conn.execute("ROLLBACK TO row")
+                    failed.append((sql, params, f"{type(e).__name__}: {e}"))
+                self._conn.execute("RELEASE row")
+            self._conn.execute("COMMIT")
+        except Exception as e:
+            # 数据库本身不可用（磁盘满、文件损坏等）：整批放弃
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            failed = [(sql, params, f"{type(e).__name__}: {e}") for sql, params in batch]
+        committed = len(batch) - len(failed)
+        if committed:
+            self._stats["flushes"] += 1
+            self._stats["rows"] += committed
+        if failed:
+            self._stats["dropped"] += len(failed)
+            self.dead_letter = (self.dead_letter + failed)[-CHECKPOINT_DEAD_LETTER_SIZE:]
+            print(f"🔍 [DEBUG] checkpoint 写操作重试 {CHECKPOINT_MAX_ATTEMPTS} 次仍失败，{len(failed)} 条移入死信列表: {failed[0][2]}")
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        """提交缓冲区后执行查询；提交失败时不阻塞读取，直接读已落盘的数据"""
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"🔍 [DEBUG] 读取前 checkpoint 提交失败，读取已落盘的数据: {type(e).__name__}: {e}")
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """提交剩余的写操作并关闭数据库连接"""
+        if self._closed:
+            return
+        with self._buffer_cond:
+            self._closed = True
+            self._buffer_cond.notify()
+        self._flusher.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"🔍 [DEBUG] 关闭时 checkpoint 提交失败，{len(self._buffer)} 条写操作未落盘: {type(e).__name__}: {e}")
+        with self._db_lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回批量提交次数、提交行数、失败次数、移入死信列表的写操作数与平均批大小"""
+        flushes = self._stats["flushes"]
+        return {
+            **self._stats,
+            "pending": len(self._buffer),
+            "avg_batch_size": self._stats["rows"] / flushes if flushes else 0.0,
+        }
+
+    # ---------- 读取 ----------
+
+    def _load_tuple(self, row: tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._query(
+            "SELECT task_id, channel, type, value FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        )
+        return CheckpointTuple(
+            config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint_id,
+            }},
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config={"configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": parent_id,
+            }} if parent_id else None,
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((w_type, value)))
+                for task_id, channel, w_type, value in writes
+            ],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """按 checkpoint_id 精确查找；未指定时取线程最新的 checkpoint（主键倒序取第一条）"""
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if checkpoint_id:
+            rows = self._query(
+                "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+        else:
+            rows = self._query(
+                "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns),
+            )
+        return self._load_tuple(rows[0]) if rows else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """按 checkpoint_id 倒序列出 checkpoint（get_state_history 使用）"""
+        clauses, params = [], []
+        if config is not None:
+            configurable = config["configurable"]
+            clauses.append("thread_id = ?")
+            params.append(configurable["thread_id"])
+            if configurable.get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(configurable["checkpoint_ns"])
+            if get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(get_checkpoint_id(config))
+        if before is not None and get_checkpoint_id(before):
+            clauses.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        sql = "SELECT * FROM checkpoints"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY checkpoint_id DESC"
+        # 有元数据过滤条件时需要先反序列化再过滤，不能在 SQL 中限制条数
+        if limit is not None and not filter:
+            sql += f" LIMIT {int(limit)}"
+
+        count = 0
+        for row in self._query(sql, tuple(params)):
+            checkpoint_tuple = self._load_tuple(row)
+            if filter and not all(checkpoint_tuple.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            count += 1
+            if limit is not None and count >= limit:
+                break
+
+    # ---------- 写入 ----------
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        self._enqueue([(_INSERT_CHECKPOINT, (
+            thread_id,
+            checkpoint_ns,
+            checkpoint["id"],
+            configurable.get("checkpoint_id"),
+            type_,
+            serialized,
+            metadata_type,
+            serialized_metadata,
+        ))])
+        return {"configurable": {
+            "thread_id": thread_id,
+            "checkpoint_ns": checkpoint_ns,
+            "checkpoint_id": checkpoint["id"],
+        }}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        configurable = config["configurable"]
+        # 特殊通道（错误、中断等）的写入覆盖已有记录，普通写入保留首次结果
+        sql = _UPSERT_WRITE if all(channel in WRITES_IDX_MAP for channel, _ in writes) else _INSERT_WRITE
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, serialized = self.serde.dumps_typed(value)
+            rows.append((sql, (
+                configurable["thread_id"],
+                configurable.get("checkpoint_ns", ""),
+                configurable["checkpoint_id"],
+                task_id,
+                WRITES_IDX_MAP.get(channel, idx),
+                channel,
+                type_,
+                serialized,
+                task_path,
+            )))
+        self._enqueue(rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """删除线程的全部 checkpoint 与写入记录"""
+        self.flush()
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("COMMIT")
+
+    # ---------- 异步接口 ----------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        # 只写入缓冲区，不涉及磁盘 IO，直接在事件循环中执行
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+def _payload_bytes(value: Any) -> int:
+    """统计已序列化存储结构中字节串的总长度（MemorySaver 以 (类型, 字节串) 元组保存数据）"""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_payload_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_payload_bytes(item) for item in value.values())
+    return 0
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    有容量上限的内存 checkpointer
+
+    在 MemorySaver 的基础上按线程记录占用字节数与最近访问时间：
+    - 线程空闲超过 idle_ttl 秒后淘汰
+    - 线程数超过 max_threads 或总字节数超过 max_bytes 时，按最近最少使用（LRU）顺序淘汰
+    正在执行的线程（调用方用 running(thread_id) 包住一次图的执行）与当前写入的线程不会被淘汰，
+    因此超限时常驻量可能暂时高于上限。被淘汰线程的下一次请求会从空状态开始。
+    """
+
+    def __init__(
+        self,
+        max_threads: int = CHECKPOINT_MAX_THREADS,
+        max_bytes: int = CHECKPOINT_MAX_BYTES,
+        idle_ttl: float = CHECKPOINT_IDLE_TTL,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # thread_id -> [占用字节数, 最近访问时间]，按访问顺序排列（最近访问的在末尾）
+        self._threads: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._last_sweep = time.monotonic()
+        self._evicted = {"ttl": 0, "lru": 0}
+        # 正在执行的 thread_id -> 执行中的请求数
+        self._running: Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def running(self, thread_id: str):
+        """标记线程正在执行一次图的调用，期间不淘汰该线程（步骤之间的 checkpoint 不会丢失）"""
+        with self._lock:
+            self._running[thread_id] = self._running.get(thread_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._running[thread_id] <= 1:
+                    del self._running[thread_id]
+                else:
+                    self._running[thread_id] -= 1
+
+    def _touch(self, thread_id: str, delta: int = 0):
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            entry = self._threads[thread_id] = [0, 0.0]
+        entry[0] += delta
+        entry[1] = time.monotonic()
+        self._bytes += delta
+        self._threads.move_to_end(thread_id)
+
+    def _drop_thread(self, thread_id: str):
+        """删除线程的全部 checkpoint、写入记录与通道数据"""
+        self.storage.pop(thread_id, None)
+        for key in [k for k in self.writes if k[0] == thread_id]:
+            del self.writes[key]
+        for key in [k for k in self.blobs if k[0] == thread_id]:
+            del self.blobs[key]
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._bytes -= entry[0]
+
+    def _evict(self, keep: str):
+        """淘汰空闲超时的线程，再按 LRU 淘汰直到满足线程数与字节数上限"""
+        now = time.monotonic()
+        # 空闲线程按访问顺序排在前面，扫描频率限制为每 idle_ttl 的 1/10 一次
+        if now - self._last_sweep >= self.idle_ttl / 10:
+            self._last_sweep = now
+            for thread_id, (_, last_access) in list(self._threads.items()):
+                if now - last_access < self.idle_ttl:
+                    break
+                if thread_id != keep and thread_id not in self._running:
+                    self._drop_thread(thread_id)
+                    self._evicted["ttl"] += 1
+        while len(self._threads) > self.max_threads or self._bytes > self.max_bytes:
+            victim = next((t for t in self._threads if t != keep and t not in self._running), None)
+            if victim is None:
+                break
+            self._drop_thread(victim)
+            self._evicted["lru"] += 1
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self._threads:
+                self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            configurable = result["configurable"]
+            thread_id = configurable["thread_id"]
+            checkpoint_ns = configurable.get("checkpoint_ns", "")
+            added = _payload_bytes(self.storage[thread_id][checkpoint_ns].get(configurable["checkpoint_id"]))
+            added += sum(
+                _payload_bytes(self.blobs.get((thread_id, checkpoint_ns, channel, version)))
+                for channel, version in new_versions.items()
+            )
+            self._touch(thread_id, added)
+            self._evict(keep=thread_id)
+            return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        with self._lock:
+            configurable = config["configurable"]
+            thread_id = configurable["thread_id"]
+            key = (thread_id, configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"])
+            before = _payload_bytes(self.writes.get(key, {}))
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(thread_id, _payload_bytes(self.writes.get(key, {})) - before)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._drop_thread(thread_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回常驻线程数、常驻字节数、正在执行的线程数与淘汰次数"""
+        with self._lock:
+            return {
+                "resident_threads": len(self._threads),
+                "running_threads": len(self._running),
+                "resident_bytes": self._bytes,
+                "max_threads": self.max_threads,
+                "max_bytes": self.max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "evicted": dict(self._evicted),
+            }
+
+
+def running(checkpointer: BaseCheckpointSaver, thread_id: str):
+    """在一次图的执行期间保护该线程不被淘汰；不淘汰线程的 checkpointer 上为空操作"""
+    if hasattr(checkpointer, "running"):
+        return checkpointer.running(thread_id)
+    return contextlib.nullcontext()
+
+
+def create_checkpointer(kind: Optional[str] = None) -> BaseCheckpointSaver:
+    """
+    按 DIRECTOR_CHECKPOINTER 环境变量创建 checkpointer
+
+    - bounded（默认）：BoundedMemorySaver，进程内存储，按 CHECKPOINT_MAX_THREADS / CHECKPOINT_MAX_BYTES /
+      CHECKPOINT_IDLE_TTL 淘汰线程
+    - memory：MemorySaver，进程内存储，不淘汰
+    - sqlite：SqliteCheckpointer，数据库路径为 DIRECTOR_CHECKPOINT_DB
+    """
+    kind = (kind or CHECKPOINTER).lower()
+    if kind == "sqlite":
+        print(f"🔍 [DEBUG] 使用 SQLite checkpointer: {CHECKPOINT_DB}")
+        return SqliteCheckpointer(CHECKPOINT_DB)
+    if kind == "memory":
+        return MemorySaver()
+    if kind != "bounded":
+        print(f"⚠️  未知的 checkpointer 类型 '{kind}'，使用 bounded")
+    return BoundedMemorySaver()
@@ -0,0 +1,236 @@
+"""
+上下文窗口管理
+节点调用大模型前按角色的 token 预算裁剪对话历史：
+1. 本地估算 token 数（安装了 tiktoken 时使用 cl100k_base 编码，否则按字符估算）
+2. 去掉过期的路由过程消息（supervisor / validator 的决策理由只保留最近一条）
+3. 始终保留本轮的用户请求（同一会话复用线程时是最近一条用户消息，而不是会话的第一个问题），
+   其余消息从最近的向前保留到预算用完
+4. 超出预算的较早消息折叠为滚动摘要，以一条用户消息放在最前面（不在对话中间插入系统消息）：
+   摘要由大模型在后台线程中生成，生成完成前先使用抽取式摘要（每条消息截断），不阻塞当前节点
+"""
+
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, convert_to_messages
+
+# 各角色的对话历史 token 预算（不含系统提示词）
+ROLE_BUDGETS = {
+    "supervisor": int(os.getenv("CONTEXT_BUDGET_SUPERVISOR", "2000")),
+    "validator": int(os.getenv("CONTEXT_BUDGET_VALIDATOR", "2000")),
+    "expert": int(os.getenv("CONTEXT_BUDGET_EXPERT", "3000")),
+}
+DEFAULT_BUDGET = int(os.getenv("CONTEXT_BUDGET_DEFAULT", "3000"))
+# 路由过程消息的发送者名称
+ROUTING_NAMES = {"supervisor", "validator"}
+# 抽取式摘要中每条消息保留的字符数
+EXCERPT_CHARS = int(os.getenv("CONTEXT_EXCERPT_CHARS", "120"))
+# 是否用大模型在后台生成滚动摘要（关闭时只使用抽取式摘要）
+SUMMARY_ENABLED = os.getenv("CONTEXT_SUMMARY_ENABLED", "1") != "0"
+
+SUMMARY_PROMPT = """
+    请将下面的对话历史压缩为一段简洁的摘要，供后续处理节点参考。
+    必须保留：用户的请求与约束、关键参数（域名、集群、时间段、时间间隔、指标）、已经得到的结论和数据要点。
+    不要保留路由过程和重复内容，不要添加对话中没有的信息。
+"""
+
+_CJK = re.compile(r"[　-〿一-鿿＀-￯]")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # 未安装 tiktoken 或编码文件不可用时按字符估算
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # 中文约每字 0.6 个 token，其他字符约每 4 个字符 1 个 token
+    cjk = len(_CJK.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) / 4) + 1
+
+
+def _content_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # 多段内容（如图文混合）只统计文本部分
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """单条消息的 token 数（含角色等格式开销）"""
+    return count_tokens(_content_text(message)) + 4
+
+
+def _label(message: BaseMessage) -> str:
+    return message.name or message.type
+
+
+def render_history(messages: Sequence[BaseMessage]) -> str:
+    """将消息列表渲染为 角色: 内容 的文本，用于拼接到提示词中"""
+    return "\n".join(f"{_label(m)}: {_content_text(m)}" for m in messages)
+
+
+def drop_routing_chatter(messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    """去掉过期的路由过程消息：supervisor / validator 的决策理由各只保留最近一条"""
+    latest = {}
+    for index, message in enumerate(messages):
+        if message.name in ROUTING_NAMES:
+            latest[message.name] = index
+    return [
+        message for index, message in enumerate(messages)
+        if message.name not in ROUTING_NAMES or latest[message.name] == index
+    ]
+
+
+class RollingSummary:
+    """
+    滚动摘要
+
+    按被折叠消息前缀的指纹缓存摘要；折叠范围扩大时，在最长的已有摘要基础上只补充新增消息。
+    摘要由后台线程生成，调用方拿到的是当前可用的结果：后台任务完成前，新增部分使用抽取式摘要
+    """
+
+    def __init__(self, llm=None, max_workers: int = 2, maxsize: int = 512):
+        self._llm = llm
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="context-summary")
+        self._summaries: Dict[str, str] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+
+    def _get_llm(self):
+        if self._llm is None:
+            from config.model_config import get_deepseek_model
+            self._llm = get_deepseek_model(temperature=0)
+        return self._llm
+
+    @staticmethod
+    def _prefix_keys(messages: Sequence[BaseMessage]) -> List[str]:
+        """每个前缀的指纹：keys[i] 对应 messages[:i + 1]"""
+        digest = hashlib.sha1()
+        keys = []
+        for message in messages:
+            digest.update(f"{_label(message)}\x00{_content_text(message)}\x01".encode("utf-8"))
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    @staticmethod
+    def _excerpt(messages: Sequence[BaseMessage]) -> str:
+        lines = []
+        for message in messages:
+            text = re.sub(r"\s+", " ", _content_text(message)).strip()
+            if len(text) > EXCERPT_CHARS:
+                text = text[:EXCERPT_CHARS] + "…"
+            lines.append(f"- {_label(message)}: {text}")
+        return "\n".join(lines)
+
+    def _summarize(self, key: str, base: Optional[str], messages: List[BaseMessage]):
+        """后台任务：在已有摘要基础上合并新增消息"""
+        try:
+            history = render_history(messages)
+            content = f"已有摘要：\n{base}\n\n新增对话：\n{history}" if base else f"对话历史：\n{history}"
+            response = self._get_llm().invoke([
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": content},
+            ])
+            with self._lock:
+                if len(self._summaries) >= self.maxsize:
+                    self._summaries.pop(next(iter(self._summaries)))
+                self._summaries[key] = response.content.strip()
+        except Exception as e:
+            print(f"🔍 [DEBUG] 滚动摘要生成失败: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def get(self, messages: Sequence[BaseMessage]) -> str:
+        """
+        返回 messages 的摘要（不阻塞）
+
+        在最长的已有摘要基础上拼接新增消息的抽取式摘要，并提交后台任务生成完整摘要供下次使用
+        """
+        if not messages:
+            return ""
+        keys = self._prefix_keys(messages)
+        with self._lock:
+            if keys[-1] in self._summaries:
+                return self._summaries[keys[-1]]
+            base_index, base = -1, None
+            for index in range(len(keys) - 1, -1, -1):
+                if keys[index] in self._summaries:
+                    base_index, base = index, self._summaries[keys[index]]
+                    break
+            submit = SUMMARY_ENABLED and keys[-1] not in self._pending
+            if submit:
+                self._pending.add(keys[-1])
+        rest = list(messages[base_index + 1:])
+        if submit:
+            self._executor.submit(self._summarize, keys[-1], base, rest)
+        excerpt = self._excerpt(rest)
+        return f"{base}\n{excerpt}" if base else excerpt
+
+
+rolling_summary = RollingSummary()
+
+
+def budget_for(role: str) -> int:
+    return ROLE_BUDGETS.get(role, DEFAULT_BUDGET)
+
+
+def turn_start(messages: Sequence[BaseMessage]) -> int:
+    """本轮用户请求的下标：最近一条不带发送者名称的用户消息（专家结果等带 name），没有时为0"""
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index].type == "human" and not messages[index].name:
+            return index
+    return 0
+
+
+def build_context(messages: Sequence[Any], role: str, budget: Optional[int] = None) -> List[BaseMessage]:
+    """
+    按角色的 token 预算裁剪对话历史
+
+    Args:
+        messages: 对话历史（消息对象、字典或 (role, content) 元组）
+        role: 调用方角色（supervisor / validator / expert），决定默认预算
+        budget: 覆盖默认预算
+
+    Returns:
+        裁剪后的消息列表：[(较早消息的摘要), 按时间顺序保留的消息...]，其中始终包含本轮的用户请求
+    """
+    budget = budget if budget is not None else budget_for(role)
+    history = drop_routing_chatter(convert_to_messages(list(messages)))
+    if not history:
+        return []
+    total = sum(message_tokens(m) for m in history)
+    if total <= budget:
+        return history
+
+    pinned = turn_start(history)
+    remaining = budget - message_tokens(history[pinned])
+    kept = {pinned}
+    for index in range(len(history) - 1, -1, -1):
+        if index == pinned:
+            continue
+        cost = message_tokens(history[index])
+        # 至少保留最近一条消息
+        if len(kept) > 1 and cost > remaining:
+            break
+        kept.add(index)
+        remaining -= cost
+    folded = [message for index, message in enumerate(history) if index not in kept]
+    context = []
+    if folded:
+        summary = rolling_summary.get(folded)
+        context.append(HumanMessage(content=f"此前对话摘要（已压缩 {len(folded)} 条消息）：\n{summary}"))
+    print(f"🔍 [DEBUG] 上下文裁剪[{role}]: {total} → 约 {budget - remaining} tokens，折叠 {len(folded)} 条消息")
+    return context + [history[index] for index in sorted(kept)]
@@ -0,0 +1,212 @@
+"""
+路由决策缓存模块
+supervisor / validator 的路由决策是小而重复的分类调用，按对话状态的规范化指纹缓存决策结果，
+可选地用向量相似度匹配“同一类问题”，命中时跳过大模型调用
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# 规范化时替换为占位符的具体取值：时间、IP、域名/主机名、数字
+_MASKS = [
+    (re.compile(r"\d{4}[-/年]\d{1,2}[-/月]\d{1,2}日?(?:\s*\d{1,2}[:：点]\d{1,2}(?:[:：分]\d{1,2}秒?)?)?"), "<time>"),
+    (re.compile(r"\d{1,2}:\d{2}(?::\d{2})?"), "<time>"),
+    (re.compile(r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])"), "<ip>"),
+    (re.compile(r"(?<![a-z0-9.-])(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,}(?![a-z0-9-])"), "<host>"),
+    (re.compile(r"\d+(?:\.\d+)?"), "<num>"),
+]
+
+
+def normalize_text(text: str, mask: bool = False) -> str:
+    """
+    规范化文本：小写、合并空白；mask 为True时把时间、IP、域名、数字替换为占位符
+
+    只依赖问题“形状”的决策（如路由到哪个节点）可以开启 mask，
+    决策内容包含具体参数时（如拆分出的子任务）必须关闭
+    """
+    text = re.sub(r"\s+", " ", str(text).strip().lower())
+    if mask:
+        for pattern, placeholder in _MASKS:
+            text = pattern.sub(placeholder, text)
+    return text
+
+
+def conversation_text(messages: Sequence[Any]) -> str:
+    """将消息列表（消息对象、字典或 (role, content) 元组）拼接为 角色: 内容 的文本"""
+    lines = []
+    for message in messages:
+        if isinstance(message, dict):
+            role, content = message.get("name") or message.get("role"), message.get("content")
+        elif isinstance(message, (tuple, list)) and len(message) == 2:
+            role, content = message
+        else:
+            role = getattr(message, "name", None) or getattr(message, "type", "")
+            content = getattr(message, "content", message)
+        lines.append(f"{role}: {content}")
+    return "\n".join(lines)
+
+
+def make_embedder() -> Optional[Callable[[str], List[float]]]:
+    """
+    按环境变量创建可选的向量化函数，未配置 DECISION_CACHE_EMBED_MODEL 时返回None（只做指纹精确匹配）
+
+    环境变量: DECISION_CACHE_EMBED_MODEL / DECISION_CACHE_EMBED_BASE_URL / DECISION_CACHE_EMBED_API_KEY
+    """
+    model = os.getenv("DECISION_CACHE_EMBED_MODEL")
+    if not model:
+        return None
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:
+        print("🔍 [DEBUG] 未安装 langchain_openai，决策缓存不启用相似度匹配")
+        return None
+    embeddings = OpenAIEmbeddings(
+        model=model,
+        base_url=os.getenv("DECISION_CACHE_EMBED_BASE_URL"),
+        api_key=os.getenv("DECISION_CACHE_EMBED_API_KEY"),
+    )
+    return embeddings.embed_query
+
+
+class DecisionCache:
+    """
+    带 TTL 与 LRU 淘汰的路由决策缓存
+
+    先按规范化文本的指纹精确匹配；配置了向量化函数时，未命中再按余弦相似度查找同一命名空间内
+    最相似的条目，达到阈值即视为命中
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: Optional[float] = None,
+        threshold: Optional[float] = None,
+        embed: Optional[Callable[[str], List[float]]] = None,
+    ):
+        """
+        Args:
+            maxsize: 最大条目数
+            ttl: 条目有效期（秒），默认读取环境变量 DECISION_CACHE_TTL（600）
+            threshold: 相似度阈值，默认读取环境变量 DECISION_CACHE_THRESHOLD（0.95）
+            embed: 可选的向量化函数，输入文本返回向量，例如 make_embedder()
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl if ttl is not None else float(os.getenv("DECISION_CACHE_TTL", "600"))
+        self.threshold = threshold if threshold is not None else float(os.getenv("DECISION_CACHE_THRESHOLD", "0.95"))
+        self.embed = embed
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._last_vector = None
+
+    @staticmethod
+    def fingerprint(namespace: str, text: str) -> str:
+        return f"{namespace}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def _count(self, namespace: str, field: str):
+        counters = self._stats.setdefault(namespace, {"hits": 0, "similar_hits": 0, "misses": 0})
+        counters[field] += 1
+
+    def _vector(self, text: str) -> Optional[np.ndarray]:
+        """文本的单位向量；未命中后紧接着写入同一文本时复用上一次的结果，不重复调用向量化接口"""
+        if self.embed is None:
+            return None
+        last = self._last_vector
+        if last is not None and last[0] == text:
+            return last[1]
+        try:
+            vector = np.asarray(self.embed(text), dtype=np.float64)
+        except Exception as e:
+            print(f"🔍 [DEBUG] 决策缓存向量化失败: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else None
+        self._last_vector = (text, vector)
+        return vector
+
+    def _evict_expired(self, now: float):
+        for key in [k for k, entry in self._entries.items() if entry["expires_at"] <= now]:
+            del self._entries[key]
+
+    def get(self, namespace: str, text: str, similar: bool = True) -> Optional[Any]:
+        """
+        查找缓存的决策
+
+        Args:
+            namespace: 命名空间（区分不同节点的决策）
+            text: 规范化后的对话状态文本
+            similar: 精确未命中时是否按向量相似度查找
+
+        Returns:
+            缓存的决策，未命中时返回None
+        """
+        key = self.fingerprint(namespace, text)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._count(namespace, "hits")
+                return entry["value"]
+            candidates = [
+                (k, e) for k, e in self._entries.items()
+                if e["namespace"] == namespace and e["vector"] is not None
+            ] if similar and self.embed is not None else []
+
+        if candidates:
+            vector = self._vector(text)
+            if vector is not None:
+                matrix = np.vstack([e["vector"] for _, e in candidates])
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    with self._lock:
+                        best_key = candidates[best][0]
+                        if best_key in self._entries:
+                            self._entries.move_to_end(best_key)
+                        self._count(namespace, "similar_hits")
+                    print(f"🔍 [DEBUG] 决策缓存相似命中: {namespace} 相似度 {scores[best]:.3f}")
+                    return candidates[best][1]["value"]
+
+        with self._lock:
+            self._count(namespace, "misses")
+        return None
+
+    def set(self, namespace: str, text: str, value: Any, similar: bool = True):
+        """写入决策，超出容量时淘汰最久未使用的条目；similar 为False时不计算向量（只能精确命中）"""
+        vector = self._vector(text) if similar else None
+        key = self.fingerprint(namespace, text)
+        with self._lock:
+            self._entries[key] = {
+                "namespace": namespace,
+                "value": value,
+                "vector": vector,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回各命名空间的命中率统计"""
+        with self._lock:
+            result = {}
+            for namespace, counters in self._stats.items():
+                total = counters["hits"] + counters["similar_hits"] + counters["misses"]
+                result[namespace] = {
+                    **counters,
+                    "hit_rate": (counters["hits"] + counters["similar_hits"]) / total if total else 0.0,
+                }
+            return {"size": len(self._entries), "maxsize": self.maxsize, "namespaces": result}
@@ -1,11 +1,10 @@
-from typing import Annotated, Sequence, List, Literal 
+from typing import Annotated, Sequence, List, Literal, TypedDict
+from operator import add
 from pydantic import BaseModel, Field 
 from langchain_core.messages import HumanMessage
 
-from langgraph.types import Command 
+from langgraph.types import Command, Send
 from langgraph.graph import StateGraph, START, END, MessagesState
-from langgraph.prebuilt import create_react_agent 
-from IPython.display import Image, display 
 from dotenv import load_dotenv
 
 
@@ -13,93 +12,109 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.model_config import get_deepseek_model
+# 添加mcp目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcp'))
+from client.mcp_client_manager import get_mcp_manager
+from decision_cache import DecisionCache, conversation_text, make_embedder, normalize_text
+from context_window import build_context
 #配置加载
 load_dotenv()
 llm = get_deepseek_model()
-
-def create_sync_tool_wrapper(async_tool):
-    """创建同步工具包装器，将异步 MCP 工具转换为同步工具"""
-    
-    def sync_func(**kwargs):
-        """同步包装函数，使用 asyncio.run 调用异步工具"""
-        try:
-            # 调用异步工具的 coroutine 函数
-            result = asyncio.run(async_tool.coroutine(**kwargs))
-            return result
-        except Exception as e:
-            print(f"🔍 [DEBUG] 同步包装器执行异常: {e}")
-            raise e
-    
-    # 创建新的同步 StructuredTool
-    sync_tool = StructuredTool.from_function(
-        func=sync_func,
-        name=async_tool.name,
-        description=async_tool.description,
-        args_schema=async_tool.args_schema,
-        return_direct=getattr(async_tool, 'return_direct', False)
+# 专家Agent由MCP管理器按 (服务器, 模型, 提示词) 编译一次并复用
+mcp_manager = get_mcp_manager()
+# 路由决策缓存：相同的对话状态直接复用上一次的决策
+decision_cache = DecisionCache(embed=make_embedder())
+
+class SubTask(BaseModel):
+    expert: Literal["domain_expert", "deeplog_expert"] = Field(
+        description="负责该子任务的专家： "
+                    "'当用户需要查询域名信息查询、域名状态检查时选择'domain_expert',"
+                    "当用户需要查询某时间段内监控日志(如:域名在指定时段QPS、出入口带宽,状态码分布)需要额外的事实、数据收集时选择'deeplog_expert',"
+    )
+    task: str = Field(
+        description="交给该专家的子任务描述，需包含完成子任务所需的全部参数（域名、时间段、时间间隔等）。"
+    )
+    facts: List[str] = Field(
+        default_factory=list,
+        description="专家完成该子任务需要知道的事实，每条一句（如用户给出的约束、已完成子任务中与本任务相关的结论）。"
+                    "专家看不到对话历史，只能看到子任务描述和这里列出的事实。"
     )
-    
-    print(f"🔍 [DEBUG] 创建同步工具包装器: {async_tool.name}")
-    return sync_tool
 
-def convert_async_tools_to_sync(async_tools):
-    
-    """将异步工具列表转换为同步工具列表"""
-    sync_tools = []
-    for tool in async_tools:
-        if hasattr(tool, 'coroutine') and tool.coroutine is not None:
-            # 这是一个异步工具，需要包装
-            sync_tool = create_sync_tool_wrapper(tool)
-            sync_tools.append(sync_tool)
-            print(f"🔍 [DEBUG] 转换异步工具: {tool.name} -> 同步工具")
-        else:
-            # 这已经是同步工具，直接使用
-            sync_tools.append(tool)
-            print(f"🔍 [DEBUG] 保持同步工具: {tool.name}")
-    
-    return sync_tools
 
 class Supervisor(BaseModel):
-    next: Literal["domain_expert", "deeplog_expert"] = Field(
-        description="决定在工作流序列中接下来激活哪位专家： "
-                    "'当用户需要查询域名信息查询、域名状态检查时选择'domain_expert',"
-                    "当用户需要查询某时间段内监控日志(如:域名在指定时段QPS、出入口带宽,状态码分布)需要额外的事实、数据收集时选择'deeplog_expert',"
+    subtasks: List[SubTask] = Field(
+        description="将用户请求拆分出的、尚未完成的相互独立的子任务列表，每个子任务只交给一位专家。"
     )
     reason: str = Field(
-        description="路由决策的详细理由，解释选择特定专家的背后逻辑，以及这一选择如何推动任务向完成迈进。"
+        description="拆分与分派决策的详细理由，解释为什么这样拆分子任务、以及每位专家如何推动任务向完成迈进。"
     )
 
-def supervisor_node(state: MessagesState) -> Command[Literal["domain_expert", "deeplog_expert"]]:
+
+class EngineState(MessagesState):
+    # 各专家并行执行的结果，使用 add 合并同一步内多个分支的写入
+    expert_results: Annotated[list, add]
+
+
+class ExpertTask(TypedDict):
+    # 通过 Send 分派给专家节点的输入：只有子任务对象（任务描述 + 所需事实），不带对话历史
+    subtask: dict
+
+
+def _completed_tasks(state: EngineState) -> List[str]:
+    return [result["task"] for result in state.get("expert_results", [])]
+
+
+def supervisor_node(state: EngineState) -> Command[Literal["domain_expert", "deeplog_expert", "validator"]]:
 
     system_prompt = ('''
         **IMPORTANT**: You must respond with a valid JSON object that follows the specified schema.
         
-        您是一个工作流监督者，管理着由三个专业智能体组成的团队：域名信息查询专家、日志检索专家。您的职责是根据任务的当前状态和需求，选择最合适的下一个智能体来协调工作流程。请为每个决策提供清晰、简洁的理由，以确保决策过程的透明度。
+        您是一个工作流监督者，管理着由两个专业智能体组成的团队：域名信息查询专家、日志检索专家。您的职责是一次性将用户请求拆分为相互独立的子任务，并把每个子任务分派给最合适的智能体并行执行。请为决策提供清晰、简洁的理由，以确保决策过程的透明度。
 
         **团队成员**：
-        2. **域名信息查询专家**：专门负责域名元数据信息收集（域名状态、管理者）、事实查找以及收集解决用户请求所需的相关数据。
-        3. **日志检索专家**：专注于历史日志数据的检索（指定时间段的事实数据，为解决问题提供有力的数据支撑）。
+        1. **域名信息查询专家(domain_expert)**：专门负责域名元数据信息收集（域名状态、管理者）、事实查找以及收集解决用户请求所需的相关数据。
+        2. **日志检索专家(deeplog_expert)**：专注于历史日志数据的检索（指定时间段的事实数据，为解决问题提供有力的数据支撑）。
 
         **您的职责**：
-        1. 分析每个用户请求和智能体响应的完整性、准确性和相关性。
-        2. 在每个决策点将任务路由至最合适的智能体。
-        3. 通过智能体分配来保持工作流的顺畅推进。
-        4. 持续该过程，直到用户的请求得到完全且令人满意的解决。
+        1. 分析用户请求中包含的全部意图，拆分为互不依赖、可以同时执行的子任务。
+        2. 每个子任务只分派给一位专家，同一专家可以接收多个子任务。
+        3. 已完成的子任务不要重复分派；只返回尚未完成的子任务。
+        4. 如果所有子任务都已完成，返回空的子任务列表。
+        5. 专家看不到对话历史：子任务描述必须自包含，完成任务需要的其他信息写入 facts。
 
-        您的目标是创建一个高效的工作流，充分利用每个智能体的优势，同时尽量减少不必要的步骤，最终为用户请求提供完整且准确的解决方案。 
+        您的目标是用尽量少的轮次和调用，为用户请求提供完整且准确的解决方案。 
                  
     ''')
     
+    # 对话历史按 supervisor 的 token 预算裁剪，较早的消息折叠为摘要
     messages = [
         {"role": "system", "content": system_prompt},  
-    ] + state["messages"] 
-
-    response = llm.with_structured_output(Supervisor).invoke(messages)
+    ] + build_context(state["messages"], "supervisor")
+    
+    completed = _completed_tasks(state)
+    if completed:
+        messages.append({"role": "user", "content": f"已完成的子任务：{completed}"})
+
+    # 子任务中带有具体参数，只按完整对话精确匹配，不做占位符替换与相似匹配
+    cache_text = normalize_text(conversation_text(messages[1:]))
+    response = decision_cache.get("engine.supervisor", cache_text, similar=False)
+    if response is None:
+        response = llm.with_structured_output(Supervisor).invoke(messages)
+        decision_cache.set("engine.supervisor", cache_text, response, similar=False)
+    else:
+        print("--- Supervisor 命中决策缓存 ---")
 
-    goto = response.next
+    subtasks = [subtask for subtask in response.subtasks if subtask.task not in completed]
     reason = response.reason
 
-    print(f"--- 工作流转移: Supervisor → {goto.upper()} ---")
+    if not subtasks:
+        print("--- 工作流转移: Supervisor → VALIDATOR (无待执行子任务) ---")
+        return Command(
+            update={"messages": [HumanMessage(content=reason, name="supervisor")]},
+            goto="validator",
+        )
+
+    print(f"--- 工作流转移: Supervisor → {[subtask.expert.upper() for subtask in subtasks]} (并行) ---")
     
     return Command(
         update={
@@ -107,10 +122,40 @@ def supervisor_node(state: MessagesState) -> Command[Literal["domain_expert", "d
                 HumanMessage(content=reason, name="supervisor")
             ]
         },
-        goto=goto,  
+        # 每个子任务一个 Send，互不依赖的专家在同一步内并发执行
+        goto=[
+            Send(subtask.expert, {"subtask": subtask.model_dump()})
+            for subtask in subtasks
+        ],
     )
+
+
+def _expert_messages(state: ExpertTask) -> dict:
+    """专家输入：只包含本次分派的子任务和所需事实，输入长度与之前经过多少轮循环无关"""
+    subtask = state["subtask"]
+    content = f"当前需要你完成的子任务：{subtask['task']}"
+    facts = subtask.get("facts") or []
+    if facts:
+        content += "\n\n已知事实：\n" + "\n".join(f"- {fact}" for fact in facts)
+    return {"messages": [HumanMessage(content=content, name="supervisor")]}
+    
     
-def domain_node(state: MessagesState) -> Command[Literal["validator"]]:
+DOMAIN_EXPERT_PROMPT = (
+    "您是一名域名信息查询专家研究方面具备深厚专业能力。您的主要职责包括："
+    "1. 根据用户提供域名信息，查询背景识别关键信息需求"
+    "2. 调用所拥有的工具，从可靠来源收集相关、准确且最新的信息"
+    "3. 以结构化、易于理解的形式整理研究发现"
+    "4. 专注于信息收集工作——不进行分析或实施建议"
+    "CRITICAL: To select and use a tool, your entire response must be a single valid JSON object. Do not include any text before or after the JSON."
+)
+
+DEEPLOG_EXPERT_PROMPT = (
+    "你是一名日志检索专家。专注于指定时间段的日志查询任务（包括查询域名的QPS历史数据、出入口带宽，域名后端实例的请求数）"
+    "CRITICAL: To select and use a tool, your entire response must be a single valid JSON object. Do not include any text before or after the JSON."
+)
+
+
+def domain_node(state: ExpertTask) -> Command[Literal["validator"]]:
 
     """
         domain agent node that gathers information about Metadata related to domain.
@@ -118,31 +163,10 @@ def domain_node(state: MessagesState) -> Command[Literal["validator"]]:
         and returns findings for validation.
     """
     
-    client = MultiServerMCPClient(
-            {
-                "domain-info-service": {
-                    "url": "http://127.0.0.1:10025/sse",
-                    "transport": "sse",
-                }
-            }
-        )
-    print("🔍 [DEBUG] 获取 MCP 工具...")
-    async_tools = asyncio.run(client.get_tools())
-    sync_tools = convert_async_tools_to_sync(async_tools)
-    
-    
-    domain_agent = create_react_agent(
-        llm,  
-        tools=sync_tools,  
-        state_modifier= "您是一名域名信息查询专家研究方面具备深厚专业能力。您的主要职责包括："
-                        "1. 根据用户提供域名信息，查询背景识别关键信息需求"
-                        "2. 调用所拥有的工具，从可靠来源收集相关、准确且最新的信息"
-                        "3. 以结构化、易于理解的形式整理研究发现"
-                        "4. 专注于信息收集工作——不进行分析或实施建议"
-                        "CRITICAL: To select and use a tool, your entire response must be a single valid JSON object. Do not include any text before or after the JSON."
-    )
+    domain_agent = mcp_manager.create_agent("domain-info-server", llm, DOMAIN_EXPERT_PROMPT)
 
-    result = domain_agent.invoke(state)
+    result = domain_agent.invoke(_expert_messages(state))
+    content = result["messages"][-1].content
 
     print(f"--- 工作流转移: Researcher → Validator ---")
 
@@ -150,41 +174,25 @@ def domain_node(state: MessagesState) -> Command[Literal["validator"]]:
         update={
             "messages": [ 
                 HumanMessage(
-                    content=result["messages"][-1].content,  
+                    content=content,  
                     name="domain_expert"  
                 )
-            ]
+            ],
+            "expert_results": [
+                {"expert": "domain_expert", "task": state["subtask"]["task"], "result": content}
+            ],
         },
         goto="validator", 
     )
     
     
-def deeplog_node(state: MessagesState) -> Command[Literal["validator"]]:
-
-    client = MultiServerMCPClient(
-            {
-                "deeplog-ck-server": {
-                    "url": "http://127.0.0.1:10026/sse",
-                    "transport": "sse",
-                }
-            }
-        )
-    print("🔍 [DEBUG] 获取 MCP 工具...")
-    async_tools = asyncio.run(client.get_tools())
-    sync_tools = convert_async_tools_to_sync(async_tools)
-    
-    # 创建具备数学计算与数据分析能力的 ReAct 智能体
-    deeplog_agent = create_react_agent(
-        llm,
-        tools=sync_tools,
-        state_modifier=(
-            "你是一名日志检索专家。专注于指定时间段的日志查询任务（包括查询域名的QPS历史数据、出入口带宽，域名后端实例的请求数）",
-            "CRITICAL: To select and use a tool, your entire response must be a single valid JSON object. Do not include any text before or after the JSON."
-        )
-    )
+def deeplog_node(state: ExpertTask) -> Command[Literal["validator"]]:
+
+    deeplog_agent = mcp_manager.create_agent("deeplog-ck-server", llm, DEEPLOG_EXPERT_PROMPT)
 
-    # 调用智能体处理当前状态并获取结果
-    result = deeplog_agent.invoke(state)
+    # 调用智能体处理分派的子任务并获取结果
+    result = deeplog_agent.invoke(_expert_messages(state))
+    content = result["messages"][-1].content
 
     # 打印工作流切换日志，方便追踪节点流转
     print(f"--- 工作流转到: deeplog → Validator ---")
@@ -193,8 +201,11 @@ def deeplog_node(state: MessagesState) -> Command[Literal["validator"]]:
     return Command(
         update={
             "messages": [
-                HumanMessage(content=result["messages"][-1].content, name="deeplog_expert")
-            ]
+                HumanMessage(content=content, name="deeplog_expert")
+            ],
+            "expert_results": [
+                {"expert": "deeplog_expert", "task": state["subtask"]["task"], "result": content}
+            ],
         },
         goto="validator",
     )
@@ -227,10 +238,19 @@ class Validator(BaseModel):
         description="The reason for the decision."
     )
 
-def validator_node(state: MessagesState) -> Command[Literal["supervisor", "__end__"]]:
+def _merge_results(state: EngineState) -> str:
+    """汇总各专家并行执行的结果"""
+    return "\n\n".join(
+        f"【{result['expert']}】{result['task']}\n{result['result']}"
+        for result in state.get("expert_results", [])
+    )
+
+
+def validator_node(state: EngineState) -> Command[Literal["supervisor", "__end__"]]:
 
+    # 并行分支在同一步内汇入 validator，这里作为 join 节点合并所有专家结果
     user_question = state["messages"][0].content
-    agent_answer = state["messages"][-1].content
+    agent_answer = _merge_results(state) or state["messages"][-1].content
 
     messages = [
         {"role": "system", "content": system_prompt},
@@ -238,29 +258,35 @@ def validator_node(state: MessagesState) -> Command[Literal["supervisor", "__end
         {"role": "assistant", "content": agent_answer},
     ]
 
-    response = llm.with_structured_output(Validator).invoke(messages)
-
-    goto = response.next
-    reason = response.reason
+    # 按占位符替换后的文本相似匹配，只缓存路由标签；理由带有原请求的具体取值，命中时改用通用理由
+    cache_text = normalize_text(conversation_text(messages[1:]), mask=True)
+    goto = decision_cache.get("engine.validator", cache_text)
+    if goto is None:
+        response = llm.with_structured_output(Validator).invoke(messages)
+        decision_cache.set("engine.validator", cache_text, response.next)
+        goto, reason = response.next, response.reason
+    else:
+        print("--- Validator 命中决策缓存 ---")
+        reason = "沿用相似请求的验证决策：任务尚未完成，请继续处理。"
 
     if goto == "FINISH" or goto == END:
         goto = END  
         print(" --- Transitioning to END ---")  
+        update_messages = [HumanMessage(content=agent_answer, name="validator")]
     else:
         print(f"--- Workflow Transition: Validator → Supervisor ---")
+        update_messages = [HumanMessage(content=reason, name="validator")]
  
 
     return Command(
         update={
-            "messages": [
-                HumanMessage(content=reason, name="validator")
-            ]
+            "messages": update_messages
         },
         goto=goto, 
     )
     
 
-graph = StateGraph(MessagesState)
+graph = StateGraph(EngineState)
 
 graph.add_node("supervisor", supervisor_node) 
 graph.add_node("deeplog_expert", deeplog_node)  
@@ -273,19 +299,20 @@ app = graph.compile()
  
 import pprint
 
-inputs = {
-    "messages": [
-        ("user", "帮我查询api.m.jd.com域名的状态是否被注册，并且查询2025年11月20日14:00:00到14:01:00时间段，该域名下状态码的分布情况，按照10秒时间间隔"),
-    ]
-}
-
-for event in app.stream(inputs):
-    for key, value in event.items():
-        if value is None:
-            continue
-        last_message = value.get("messages", [])[-1] if "messages" in value else None
-        if last_message:
-            pprint.pprint(f"Output from node '{key}':")
-            pprint.pprint(last_message, indent=2, width=80, depth=None)
-            print()
+if __name__ == "__main__":
+    inputs = {
+        "messages": [
+            ("user", "帮我查询api.m.jd.com域名的状态是否被注册，并且查询2025年11月20日14:00:00到14:01:00时间段，该域名下状态码的分布情况，按照10秒时间间隔"),
+        ]
+    }
+
+    for event in app.stream(inputs):
+        for key, value in event.items():
+            if value is None:
+                continue
+            last_message = value.get("messages", [])[-1] if "messages" in value else None
+            if last_message:
+                pprint.pprint(f"Output from node '{key}':")
+                pprint.pprint(last_message, indent=2, width=80, depth=None)
+                print()
      
\ No newline at end of file
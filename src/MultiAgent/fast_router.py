@@ -0,0 +1,151 @@
+"""
+规则快速路由模块
+在调用大模型分类之前，用关键词/正则规则（以及可选的本地轻量模型）对明显的请求直接分类，
+置信度不足时返回None，由调用方回退到大模型分类
+"""
+
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class RouteRule:
+    """单条路由规则：所有 patterns 都命中时给出 label，置信度为 confidence"""
+
+    def __init__(self, name: str, label: str, patterns: List[str], confidence: float):
+        self.name = name
+        self.label = label
+        self.patterns = [re.compile(p, re.IGNORECASE) for p in patterns]
+        self.confidence = confidence
+
+    def match(self, text: str) -> bool:
+        return all(p.search(text) for p in self.patterns)
+
+
+# 域名 / ERP 主机名，例如 jd.com、api.m.jd.com、lf-pub-ha1-39.lf.jd.local
+_HOST_PATTERN = r"(?<![a-z0-9.-])(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+(?:com|cn|net|org|local|io)(?![a-z0-9-])"
+# 时间范围，例如 2025-11-05 10:00:00、11月20日、最近30分钟、今天上午
+_TIME_PATTERN = r"(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}月\d{1,2}日|\d{1,2}:\d{2}|最近\s*\d+\s*(秒|分钟|小时|天)|今天|昨天|时间段)"
+# 日志指标关键词
+_METRIC_PATTERN = r"(qps|带宽|状态码|请求数|访问量|耗时|日志|后端实例|(?<![a-z])(?:vip|srv_ip|http_code|bin|bout)(?![a-z]))"
+
+DEFAULT_RULES = [
+    RouteRule("domain_keyword", "domain", [r"域名"], 0.95),
+    RouteRule("host_name", "domain", [_HOST_PATTERN], 0.9),
+    RouteRule("metric_with_time", "domain", [_METRIC_PATTERN, _TIME_PATTERN], 0.9),
+    RouteRule("metric_only", "domain", [_METRIC_PATTERN], 0.7),
+]
+
+
+class TfidfClassifier:
+    """
+    可选的本地 TF-IDF 分类器（依赖 scikit-learn，未安装时不可用）
+
+    用带标签的样本训练，predict 返回 (label, 置信度)
+    """
+
+    def __init__(self, examples: Dict[str, List[str]]):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+
+        texts, labels = [], []
+        for label, samples in examples.items():
+            texts.extend(samples)
+            labels.extend([label] * len(samples))
+
+        # 中文不分词，按字符 n-gram 提取特征
+        self.vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3))
+        self.model = LogisticRegression(max_iter=1000)
+        self.model.fit(self.vectorizer.fit_transform(texts), labels)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        probabilities = self.model.predict_proba(self.vectorizer.transform([text]))[0]
+        best = probabilities.argmax()
+        return self.model.classes_[best], float(probabilities[best])
+
+
+class FastPathRouter:
+    """
+    LLM 分类前的快速路由器
+
+    先匹配规则，再（可选）使用本地模型，取置信度最高的结果；
+    低于阈值时返回None，表示需要回退到大模型
+    """
+
+    def __init__(
+        self,
+        rules: Optional[List[RouteRule]] = None,
+        threshold: Optional[float] = None,
+        model: Optional[Callable[[str], Tuple[str, float]]] = None,
+    ):
+        """
+        Args:
+            rules: 路由规则列表，默认使用 DEFAULT_RULES
+            threshold: 置信度阈值，默认读取环境变量 FAST_ROUTER_THRESHOLD（0.8）
+            model: 可选的本地分类函数，输入文本返回 (label, 置信度)，例如 TfidfClassifier(...).predict
+        """
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.threshold = threshold if threshold is not None else float(os.getenv("FAST_ROUTER_THRESHOLD", "0.8"))
+        self.model = model
+        self._lock = threading.Lock()
+        self._stats = {"total": 0, "hits": 0, "fallbacks": 0}
+        self._rule_hits: Dict[str, int] = {}
+
+    def add_rule(self, rule: RouteRule):
+        """追加一条路由规则"""
+        self.rules.append(rule)
+
+    def score(self, text: str) -> Tuple[Optional[str], float, Optional[str]]:
+        """
+        计算文本的最佳分类
+
+        Returns:
+            (label, 置信度, 命中来源)，没有任何规则或模型命中时为 (None, 0.0, None)
+        """
+        best: Tuple[Optional[str], float, Optional[str]] = (None, 0.0, None)
+        for rule in self.rules:
+            if rule.confidence > best[1] and rule.match(text):
+                best = (rule.label, rule.confidence, rule.name)
+
+        if self.model is not None and best[1] < self.threshold:
+            try:
+                label, confidence = self.model(text)
+                if confidence > best[1]:
+                    best = (label, confidence, "model")
+            except Exception as e:
+                print(f"🔍 [DEBUG] 快速路由本地模型异常: {e}")
+        return best
+
+    def classify(self, text: str) -> Optional[str]:
+        """
+        对文本进行快速分类
+
+        Returns:
+            置信度达到阈值时返回分类标签，否则返回None（调用方应回退到大模型）
+        """
+        label, confidence, source = self.score(text)
+        with self._lock:
+            self._stats["total"] += 1
+            if label is not None and confidence >= self.threshold:
+                self._stats["hits"] += 1
+                self._rule_hits[source] = self._rule_hits.get(source, 0) + 1
+                return label
+            self._stats["fallbacks"] += 1
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        """返回命中率统计：total/hits/fallbacks/hit_rate 以及各规则命中次数"""
+        with self._lock:
+            total = self._stats["total"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / total if total else 0.0,
+                "rule_hits": dict(self._rule_hits),
+            }
+
+    def reset_stats(self):
+        """清空统计"""
+        with self._lock:
+            self._stats = {"total": 0, "hits": 0, "fallbacks": 0}
+            self._rule_hits.clear()
@@ -1,7 +1,9 @@
 import gradio as gr
-import random
-from Director import graph
-from langchain_core.messages import HumanMessage
+import uuid
+from Director import async_graph, checkpointer, new_turn_input
+from checkpointer import running
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langgraph.graph import END
 import os
 import sys
 from datetime import datetime, timedelta
@@ -10,49 +12,120 @@ import json
 # 添加路径以导入模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def chat_with_director(message, history):
+# 同时执行的对话请求数（超出的请求在队列中等待）与队列最大长度
+GRADIO_CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "8"))
+GRADIO_MAX_QUEUE = int(os.getenv("GRADIO_MAX_QUEUE", "64"))
+
+# 流式输出中各节点的进度提示
+NODE_LABELS = {
+    "supervisor_node": "🧭 任务调度",
+    "domain_node": "🌐 域名/日志查询",
+    "other_node": "💬 其他问题",
+}
+
+
+def _supervisor_progress(update: dict) -> str:
+    """将 supervisor 的状态更新转换为一行进度提示"""
+    next_type = update.get("type")
+    if next_type == END:
+        return "🧭 任务已完成"
+    if next_type:
+        return f"🧭 路由到: {next_type}"
+    return ""
+
+
+def _render_stream(progress, answers, current):
+    """拼接进度提示与回答内容，作为聊天框中的一条回复"""
+    parts = []
+    if progress:
+        parts.append("\n".join(f"> {line}" for line in progress))
+    body = "\n\n".join(answers + ([current] if current else []))
+    if body:
+        parts.append(body)
+    return "\n\n".join(parts) if parts else "⏳ 正在处理..."
+
+
+async def chat_with_director(message, history, session_id=None):
     """
-    与Director多Agent系统交互的函数
+    与Director多Agent系统交互的函数（异步生成器，流式输出）
+    
+    使用 async_graph.astream(stream_mode=["messages", "updates"])，在事件循环中并发服务多个会话：
+    - messages：处理节点内大模型生成的 token 逐个推送，工具调用与返回作为进度提示
+    - updates：supervisor 的路由决策作为进度提示，处理节点完成后用其最终结果替换流式内容
     
     Args:
         message: 用户输入的消息
         history: 对话历史
+        session_id: 浏览器会话ID，作为 checkpoint 的 thread_id；为空时本次请求使用独立的新ID
     
-    Returns:
-        回复消息和更新后的历史记录
+    Yields:
+        截至目前的完整回复内容
     """
+    progress = []
+    answers = []
+    current = ""
     try:
-        # 生成随机线程ID
+        # 每个浏览器会话使用自己的线程ID，会话之间的 checkpoint 互不干扰
         config = {
             "configurable": {
-                "thread_id": random.randint(1, 10000)
+                "thread_id": session_id or str(uuid.uuid4())
             }
         }
         
-        # 构建输入数据
-        input_data = {
-            "messages": [HumanMessage(content=message)]
-        }
-        
-        # 调用多Agent系统
-        result = graph.invoke(
-            input_data,
-            config=config,
-            stream_mode="values"
-        )
-        
-        # 提取最终回复
-        if result and "messages" in result and result["messages"]:
-            response = result["messages"][-1].content
-        else:
-            response = "抱歉，系统暂时无法处理您的请求。"
-            
-        return response
+        # 构建输入数据（重置上一轮的子任务跟踪）
+        input_data = new_turn_input(message)
+        
+        # 执行期间该会话的 checkpoint 不会被有界内存存储淘汰
+        with running(checkpointer, config["configurable"]["thread_id"]):
+            async for mode, payload in async_graph.astream(
+                input_data,
+                config=config,
+                stream_mode=["messages", "updates"]
+            ):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    # supervisor 的分类/决策输出是内部标签，不推送给用户
+                    if metadata.get("langgraph_node") == "supervisor_node":
+                        continue
+                    if isinstance(chunk, ToolMessage):
+                        progress.append(f"✅ 工具返回: {chunk.name}")
+                        current = ""
+                    elif isinstance(chunk, AIMessageChunk):
+                        for tool_chunk in chunk.tool_call_chunks or []:
+                            if tool_chunk.get("name"):
+                                progress.append(f"🔧 调用工具: {tool_chunk['name']}")
+                        if isinstance(chunk.content, str) and chunk.content:
+                            current += chunk.content
+                        else:
+                            continue
+                    else:
+                        continue
+                    yield _render_stream(progress, answers, current)
+                
+                elif mode == "updates":
+                    for node, update in (payload or {}).items():
+                        if not isinstance(update, dict):
+                            continue
+                        if node == "supervisor_node":
+                            line = _supervisor_progress(update)
+                            if line:
+                                progress.append(line)
+                        else:
+                            progress.append(f"{NODE_LABELS.get(node, node)} 完成")
+                            # 节点的最终结果为准，替换流式拼接的中间内容
+                            messages = update.get("messages") or []
+                            if messages:
+                                answers.append(messages[-1].content)
+                            current = ""
+                    yield _render_stream(progress, answers, current)
+        
+        if not answers and not current:
+            yield _render_stream(progress, ["抱歉，系统暂时无法处理您的请求。"], "")
         
     except Exception as e:
         error_msg = f"系统出错：{str(e)}"
         print(f"Error: {error_msg}")
-        return error_msg
+        yield _render_stream(progress, answers, error_msg)
 
 def create_gradio_interface():
     """创建Gradio界面"""
@@ -319,6 +392,9 @@ def create_gradio_interface():
             avatar_images=("🧑‍💻", "🤖")
         )
         
+        # 每个浏览器会话独立的线程ID（页面加载时生成）
+        session_id = gr.State(lambda: str(uuid.uuid4()))
+        
         # 输入框
         msg = gr.Textbox(
             label="💭 请输入您的问题",
@@ -418,22 +494,23 @@ def create_gradio_interface():
                 """
             )
         
-        def respond(message, chat_history):
-            """处理用户输入并更新对话历史"""
+        async def respond(message, chat_history, session_id):
+            """处理用户输入并流式更新对话历史"""
             if not message.strip():
-                return "", chat_history
+                yield "", chat_history
+                return
             
-            # 获取系统回复
-            bot_message = chat_with_director(message, chat_history)
+            # 先显示用户消息，再随流式结果逐步更新回复
+            chat_history.append((message, "⏳ 正在处理..."))
+            yield "", chat_history
             
-            # 更新对话历史
-            chat_history.append((message, bot_message))
-            
-            return "", chat_history
+            async for bot_message in chat_with_director(message, chat_history[:-1], session_id):
+                chat_history[-1] = (message, bot_message)
+                yield "", chat_history
         
         def clear_chat():
-            """清空对话历史"""
-            return None, []
+            """清空对话历史，并换用新的会话ID（新的 checkpoint 线程）"""
+            return None, [], str(uuid.uuid4())
         
         # 时间选择功能函数
         def get_current_time():
@@ -566,19 +643,19 @@ def create_gradio_interface():
         # 绑定聊天事件
         submit_btn.click(
             respond,
-            inputs=[msg, chatbot],
+            inputs=[msg, chatbot, session_id],
             outputs=[msg, chatbot]
         )
         
         msg.submit(
             respond,
-            inputs=[msg, chatbot],
+            inputs=[msg, chatbot, session_id],
             outputs=[msg, chatbot]
         )
         
         clear_btn.click(
             clear_chat,
-            outputs=[chatbot, msg]
+            outputs=[chatbot, msg, session_id]
         )
     
     return demo
@@ -600,6 +677,10 @@ if __name__ == "__main__":
     print("🕒 新增功能：快速时间选择器")
     print("🌐 访问地址：http://localhost:7860")
     
+    # 启用队列：最多 GRADIO_CONCURRENCY 个对话并发执行，超出的排队等待
+    demo.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_MAX_QUEUE)
+    print(f"⚙️  并发上限：{GRADIO_CONCURRENCY}，队列长度：{GRADIO_MAX_QUEUE}")
+    
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
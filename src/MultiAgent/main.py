@@ -7,71 +7,31 @@ from langgraph.types import Command
 from langgraph.graph import StateGraph, START, END, MessagesState
 from langgraph.prebuilt import create_react_agent 
 from dotenv import load_dotenv
-from langchain_mcp_adapters.client import MultiServerMCPClient
 import os
-from langchain_openai import ChatOpenAI
 import json
-import asyncio
-from langchain_core.tools import StructuredTool
-
-def create_sync_tool_wrapper(async_tool):
-    """创建同步工具包装器，将异步 MCP 工具转换为同步工具"""
-    
-    def sync_func(**kwargs):
-        """同步包装函数，使用 asyncio.run 调用异步工具"""
-        try:
-            # 调用异步工具的 coroutine 函数
-            result = asyncio.run(async_tool.coroutine(**kwargs))
-            return result
-        except Exception as e:
-            print(f"🔍 [DEBUG] 同步包装器执行异常: {e}")
-            raise e
-    
-    # 创建新的同步 StructuredTool
-    sync_tool = StructuredTool.from_function(
-        func=sync_func,
-        name=async_tool.name,
-        description=async_tool.description,
-        args_schema=async_tool.args_schema,
-        return_direct=getattr(async_tool, 'return_direct', False)
-    )
-    
-    print(f"🔍 [DEBUG] 创建同步工具包装器: {async_tool.name}")
-    return sync_tool
-
-def convert_async_tools_to_sync(async_tools):
-    """将异步工具列表转换为同步工具列表"""
-    sync_tools = []
-    for tool in async_tools:
-        if hasattr(tool, 'coroutine') and tool.coroutine is not None:
-            # 这是一个异步工具，需要包装
-            sync_tool = create_sync_tool_wrapper(tool)
-            sync_tools.append(sync_tool)
-            print(f"🔍 [DEBUG] 转换异步工具: {tool.name} -> 同步工具")
-        else:
-            # 这已经是同步工具，直接使用
-            sync_tools.append(tool)
-            print(f"🔍 [DEBUG] 保持同步工具: {tool.name}")
-    
-    return sync_tools
-#配置加载
-def get_deepseek_model(temperature=0.3):
-    """
-    配置并返回 DeepSeek 模型实例
-    
-    Returns:
-        ChatOpenAI: 配置好的 DeepSeek 模型实例
-    """
-    model = ChatOpenAI(
-        model="deepseek-chat",
-        api_key="sk-7ce2292c26e546f78aaff58c4bf55fac",
-        base_url="https://api.deepseek.com",
-        temperature=temperature,
-        # model_kwargs={"response_format": None} 
-    )
-    return model
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.model_config import get_deepseek_model
+# 添加mcp目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcp'))
+from client.mcp_client_manager import get_mcp_manager
+from decision_cache import DecisionCache, conversation_text, make_embedder, normalize_text
+from context_window import build_context
 
+# MCP会话与专家Agent由管理器全局复用，节点执行时不再重复建连、编译
+mcp_manager = get_mcp_manager()
+# 路由决策缓存：时间、域名等具体取值替换为占位符后匹配，因此只缓存路由标签（next），
+# 理由中带有原请求的具体取值，命中时不复用，改用下面的通用理由
+decision_cache = DecisionCache(embed=make_embedder())
+CACHED_REASONS = {
+    "domain": "沿用相似请求的路由决策：转交域名信息专家处理。",
+    "deeplog": "沿用相似请求的路由决策：转交日志检索专家处理。",
+    "supervisor": "沿用相似请求的验证决策：任务尚未完成，继续处理。",
+    "__end__": "沿用相似请求的验证决策：任务已完成。",
+}
 
+#配置加载（模型实例由 get_deepseek_model 按参数缓存，共享HTTP连接池）
+load_dotenv()
 
 
 class OverallState(TypedDict):
@@ -105,51 +65,89 @@ class ValidatorDecision(BaseModel):
         ...,
         description="用一句话说明任务完成或未完成的核心事实。"
     )
-def supervisor_node(state: OverallState) -> Command[Literal["domain", "deeplog"]]:
-    
-    llm = get_deepseek_model(temperature=0.4)
-    
-    # --- 关键修改：在 Prompt 中明确指定 JSON Schema ---
-    # 我们将 Pydantic 模型的 JSON Schema 直接嵌入到 Prompt 中
-    supervisor_system_prompt = f'''
-    你是一个工作流调度器，负责将用户任务分配给合适的专家节点。
+
+
+def _render_schema(model) -> str:
+    """在导入时把 JSON Schema 渲染为固定的字节串（键排序），保证提示词前缀逐字节稳定，便于命中服务商的前缀缓存"""
+    return json.dumps(model.model_json_schema(), ensure_ascii=False, sort_keys=True)
+
+
+# 静态提示词在导入时生成一次；调用时系统提示词在前，动态的对话历史在后
+SUPERVISOR_SCHEMA = _render_schema(SupervisorDecision)
+VALIDATOR_SCHEMA = _render_schema(ValidatorDecision)
+
+SUPERVISOR_SYSTEM_PROMPT = f'''
+你是一个工作流调度器，负责将用户任务分配给合适的专家节点。
  
-    **你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
-    ```json
-    {SupervisorDecision.model_json_schema()}
-    ```
+**你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
+```json
+{SUPERVISOR_SCHEMA}
+```
  
-    **各节点职责**:
-    - `domain`: 处理域名元数据(注册状态、管理者)相关的查询请求。
-    - `deeplog`: 查询某时间段的指标数据。（如查询集群CPU、网络指标）
-    
-    **路由规则**:
-    1.  检查对话历史，找出尚未完成的用户子任务。
-    2.  根据子任务类型，从上述节点中选择一个进行调度。
-            -   如果存在域名查询子任务，则选择 `domain`。
-            -   如果域名任务已完成，但存在指标数据查询子任务，则选择 `deeplog`。
+**各节点职责**:
+- `domain`: 处理域名元数据(注册状态、管理者)相关的查询请求。
+- `deeplog`: 查询某时间段的指标数据。（如查询集群CPU、网络指标）
+
+**路由规则**:
+1.  检查对话历史，找出尚未完成的用户子任务。
+2.  根据子任务类型，从上述节点中选择一个进行调度。
+        -   如果存在域名查询子任务，则选择 `domain`。
+        -   如果域名任务已完成，但存在指标数据查询子任务，则选择 `deeplog`。
+
+**输出要求**:
+- 你的**完整输出**必须是一个可以被 Python 的 `json.loads()` 解析的 JSON 对象。
+- 不要在JSON对象前后添加任何解释性文字、代码块标记（如 ```json）或任何其他内容。
+
+**输出示例**:
+{{"next": "domain", "reason": "用户请求查询域名信息。"}}
+'''
+
+VALIDATOR_SYSTEM_PROMPT = f'''
+你是一个工作流程验证器，你的唯一职责是判断用户的原始任务是否已经完全完成。
+ 
+**你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
+```json
+{VALIDATOR_SCHEMA}
+```
+ 
+**判断规则**：
+1.  仔细识别用户最初的、完整的请求。
+2.  检查对话历史，确认所有请求的子任务是否都已由相关专家执行并返回了结果。
+3.  如果所有子任务都有明确的执行记录和结果输出，则任务完成（"__end__"）。
+4.  如果仍有任何子任务未被处理或处理失败，则任务未完成（"supervisor"）。
+
+**输出示例**:
+{{"next": "__end__", "reason": "所有任务均完成。"}}
+'''
+
+
+def supervisor_node(state: OverallState) -> Command[Literal["domain", "deeplog"]]:
     
-    **输出要求**:
-    - 你的**完整输出**必须是一个可以被 Python 的 `json.loads()` 解析的 JSON 对象。
-    - 不要在JSON对象前后添加任何解释性文字、代码块标记（如 ```json）或任何其他内容。
+    llm = get_deepseek_model(temperature=0.4)
     
-    **输出示例**:
-    {{"next": "domain", "reason": "用户请求查询域名信息。"}}
-    '''
     
+    # 对话历史按角色的 token 预算裁剪，过期的路由消息去掉，较早的消息折叠为摘要
     messages = [
-        {"role": "system", "content": supervisor_system_prompt}, 
-    ] + state["messages"] 
+        {"role": "system", "content": SUPERVISOR_SYSTEM_PROMPT}, 
+    ] + build_context(state["messages"], "supervisor")
  
     # --- 关键修改：恢复常规调用，不再使用 with_structured_output ---
-    response = llm.invoke(messages)
-    content = response.content.strip()
-    
-    print(f"🤖 [SUPERVISOR RAW] 模型原始输出:\n{response.content}\n" + "="*40)
+    cache_text = normalize_text(conversation_text(state["messages"]), mask=True)
+    cached = decision_cache.get("main.supervisor", cache_text)
+    if cached is not None:
+        print(f"🤖 [SUPERVISOR CACHE] 命中决策缓存: {cached}\n" + "="*40)
+        content = json.dumps({"next": cached, "reason": CACHED_REASONS[cached]}, ensure_ascii=False)
+    else:
+        response = llm.invoke(messages)
+        content = response.content.strip()
+        print(f"🤖 [SUPERVISOR RAW] 模型原始输出:\n{response.content}\n" + "="*40)
     # --- 关键修改：使用 Pydantic 进行安全解析和验证 ---
     try:
         # Pydantic 的 model_validate_json 会解析字符串并进行校验
         decision = SupervisorDecision.model_validate_json(content)
+        # 只在调用大模型得到的决策时写入；命中时不写回，条目按 DECISION_CACHE_TTL 正常过期
+        if cached is None:
+            decision_cache.set("main.supervisor", cache_text, decision.next)
         
         goto = decision.next
         reason = decision.reason
@@ -180,36 +178,26 @@ def validator_node(state: OverallState) -> Command[Literal["supervisor", "__end_
  
     llm = get_deepseek_model(temperature=0.4)
     
-    # --- 关键修改：在 Prompt 中明确指定 JSON Schema ---
-    validator_system_prompt = f'''
-    你是一个工作流程验证器，你的唯一职责是判断用户的原始任务是否已经完全完成。
- 
-    **你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
-    ```json
-    {ValidatorDecision.model_json_schema()}
-    ```
- 
-    **判断规则**：
-    1.  仔细识别用户最初的、完整的请求。
-    2.  检查对话历史，确认所有请求的子任务是否都已由相关专家执行并返回了结果。
-    3.  如果所有子任务都有明确的执行记录和结果输出，则任务完成（"__end__"）。
-    4.  如果仍有任何子任务未被处理或处理失败，则任务未完成（"supervisor"）。
-    
-    **输出示例**:
-    {{"next": "__end__", "reason": "所有任务均完成。"}}
-    '''
-    
     messages = [
-        {"role": "system", "content": validator_system_prompt}
-    ] + state["messages"]
+        {"role": "system", "content": VALIDATOR_SYSTEM_PROMPT}
+    ] + build_context(state["messages"], "validator")
  
     # --- 关键修改：恢复常规调用 ---
-    response = llm.invoke(messages)
-    content = response.content.strip()
-    print(f"🤖 [VALIDATOR RAW] 模型原始输出:\n{response.content}\n" + "="*40)
+    cache_text = normalize_text(conversation_text(state["messages"]), mask=True)
+    cached = decision_cache.get("main.validator", cache_text)
+    if cached is not None:
+        print(f"🤖 [VALIDATOR CACHE] 命中决策缓存: {cached}\n" + "="*40)
+        content = json.dumps({"next": cached, "reason": CACHED_REASONS[cached]}, ensure_ascii=False)
+    else:
+        response = llm.invoke(messages)
+        content = response.content.strip()
+        print(f"🤖 [VALIDATOR RAW] 模型原始输出:\n{response.content}\n" + "="*40)
     # --- 关键修改：使用 Pydantic 进行安全解析和验证 ---
     try:
         decision = ValidatorDecision.model_validate_json(content)
+        # 只在调用大模型得到的决策时写入；命中时不写回，条目按 DECISION_CACHE_TTL 正常过期
+        if cached is None:
+            decision_cache.set("main.validator", cache_text, decision.next)
         
         goto = decision.next
         reason = decision.reason
@@ -291,47 +279,54 @@ class DomainExecutionResult(BaseModel):
         ...,
         description="对工具执行结果的总结思考与趋势分析"
     )
-    
+
+
+DOMAIN_RESULT_SCHEMA = _render_schema(DomainExecutionResult)
+
+# 工具调用完成后指导 Agent 进行最终总结的提示词
+DOMAIN_SUMMARY_PROMPT = f"""
+你已经执行了工具调用。现在，请根据你的完整思考过程和工具返回的结果，生成一个最终的JSON摘要。
+
+**你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
+```json
+{DOMAIN_RESULT_SCHEMA}
+```
+
+**输出要求**:
+- 你的**完整输出**必须是一个可以被 Python 的 `json.loads()` 解析的 JSON 对象。
+- 不要在JSON对象前后添加任何解释性文字、代码块标记（如 ```json）或任何其他内容。
+ 
+**输出示例**:
+{{
+    "tool_name": "domain_register_info",
+    "tool_result": "域名 example.com 的注册状态为：已注册",
+    "summary": "已成功确认域名 example.com 处于已注册状态。"
+}}
+"""
+
+# 本地工具的域名Agent，首次调用时编译一次
+_domain_agent = None
+
+
 def domain_node(state: OverallState) -> Command[Literal["__end__"]]:
+    global _domain_agent
     
-    llm = get_deepseek_model(0.1)
-    
-    # --- 【修改】新的 Prompt，包含 JSON Schema 指导 ---
-    # 这个 Prompt 会在 Agent 调用完工具后，指导其如何进行最终总结
-    final_summary_prompt = f"""
-    你已经执行了工具调用。现在，请根据你的完整思考过程和工具返回的结果，生成一个最终的JSON摘要。
-    
-    **你的唯一职责是返回一个符合以下JSON Schema的有效JSON对象**：
-    ```json
-    {DomainExecutionResult.model_json_schema()}
-    ```
-    
-    **输出要求**:
-    - 你的**完整输出**必须是一个可以被 Python 的 `json.loads()` 解析的 JSON 对象。
-    - 不要在JSON对象前后添加任何解释性文字、代码块标记（如 ```json）或任何其他内容。
- 
-    **输出示例**:
-    {{
-        "tool_name": "domain_register_info",
-        "tool_result": "域名 example.com 的注册状态为：已注册",
-        "summary": "已成功确认域名 example.com 处于已注册状态。"
-    }}
-    """
  
     state_with_prompt = state.copy()
     state_with_prompt["messages"] = [
-        AIMessage(content=final_summary_prompt, name="system")  # <-- 将精细化的 Prompt 作为系统消息
-    ] + state["messages"]
+        AIMessage(content=DOMAIN_SUMMARY_PROMPT, name="system")  # <-- 将精细化的 Prompt 作为系统消息
+    ] + build_context(state["messages"], "expert")
     
     # --- 【修改】使用标准的 LLM 创建 Agent ---
     # 不再使用 with_structured_output
-    domain_agent = create_react_agent(
-        llm,  
-        tools=[domain_user_info, domain_register_info],
-        # debug=True  # 保留 debug 以便观察 Agent 行为
-    )
+    if _domain_agent is None:
+        _domain_agent = create_react_agent(
+            get_deepseek_model(0.1),  
+            tools=[domain_user_info, domain_register_info],
+            # debug=True  # 保留 debug 以便观察 Agent 行为
+        )
     
-    result = domain_agent.invoke(state_with_prompt)
+    result = _domain_agent.invoke(state_with_prompt)
     
     print(f"🛠️ [DOMAIN RAW] Agent 最终输出:\n{result['messages'][-1].content}\n" + "="*40)
     # --- 【修改】使用 Pydantic 进行安全解析和验证 ---
@@ -378,26 +373,9 @@ def deeplog_node(state: OverallState) -> Command[Literal["__end__"]]:
     
     llm = get_deepseek_model(0.6)
  
-    print("🔍 [DEBUG] 创建 MCP 客户端...")
-    client = MultiServerMCPClient(
-        {
-            "monitor-service": {
-                "url": "http://127.0.0.1:10027/sse",
-                "transport": "sse",
-            }
-        }
-    )
-    print("🔍 [DEBUG] 获取 MCP 工具...")
-    async_tools = asyncio.run(client.get_tools())
-    print("🔍 [DEBUG] 转换异步工具为同步工具...")
-    sync_tools = convert_async_tools_to_sync(async_tools)
- 
-    deeplog_agent = create_react_agent(
-        llm,
-        tools=sync_tools,
-    )
+    deeplog_agent = mcp_manager.create_agent("monitor-service", llm)
  
-    result = deeplog_agent.invoke(state)
+    result = deeplog_agent.invoke({"messages": build_context(state["messages"], "expert")})
     print('-'*50)
     print(state["messages"])
     
@@ -7,99 +7,50 @@ from langgraph.types import Command
 from langgraph.graph import StateGraph, START, END, MessagesState
 from langgraph.prebuilt import create_react_agent 
 from dotenv import load_dotenv
-from langchain_mcp_adapters.client import MultiServerMCPClient
 import os
-from langchain_openai import ChatOpenAI
 import json
-import asyncio
-from langchain_core.tools import StructuredTool
-
-def create_sync_tool_wrapper(async_tool):
-    """创建同步工具包装器，将异步 MCP 工具转换为同步工具"""
-    
-    def sync_func(**kwargs):
-        """同步包装函数，使用 asyncio.run 调用异步工具"""
-        try:
-            # 调用异步工具的 coroutine 函数
-            result = asyncio.run(async_tool.coroutine(**kwargs))
-            return result
-        except Exception as e:
-            print(f"🔍 [DEBUG] 同步包装器执行异常: {e}")
-            raise e
-    
-    # 创建新的同步 StructuredTool
-    sync_tool = StructuredTool.from_function(
-        func=sync_func,
-        name=async_tool.name,
-        description=async_tool.description,
-        args_schema=async_tool.args_schema,
-        return_direct=getattr(async_tool, 'return_direct', False)
-    )
-    
-    print(f"🔍 [DEBUG] 创建同步工具包装器: {async_tool.name}")
-    return sync_tool
-
-def convert_async_tools_to_sync(async_tools):
-    """将异步工具列表转换为同步工具列表"""
-    sync_tools = []
-    for tool in async_tools:
-        if hasattr(tool, 'coroutine') and tool.coroutine is not None:
-            # 这是一个异步工具，需要包装
-            sync_tool = create_sync_tool_wrapper(tool)
-            sync_tools.append(sync_tool)
-            print(f"🔍 [DEBUG] 转换异步工具: {tool.name} -> 同步工具")
-        else:
-            # 这已经是同步工具，直接使用
-            sync_tools.append(tool)
-            print(f"🔍 [DEBUG] 保持同步工具: {tool.name}")
-    
-    return sync_tools
-#配置加载
-def get_deepseek_model(temperature=0.3):
-    """
-    配置并返回 DeepSeek 模型实例
-    
-    Returns:
-        ChatOpenAI: 配置好的 DeepSeek 模型实例
-    """
-    model = ChatOpenAI(
-        model="deepseek-chat",
-        api_key="sk-7ce2292c26e546f78aaff58c4bf55fac",
-        base_url="https://api.deepseek.com",
-        temperature=temperature,
-        # model_kwargs={"response_format": None} 
-    )
-    return model
+from ts_analytics import analyze_frame, format_findings, parse_monitor_payload
+from context_window import build_context
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.model_config import get_deepseek_model
+# 添加mcp目录到路径
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mcp'))
+from client.mcp_client_manager import get_mcp_manager
 
+# MCP会话与工具由管理器全局复用，节点执行时不再重复建连
+mcp_manager = get_mcp_manager()
 
+#配置加载（模型实例由 get_deepseek_model 按参数缓存，共享HTTP连接池）
+load_dotenv()
 
 
 class OverallState(TypedDict):
     messages: Annotated[list, "LangGraph standard messages"]
     
     deeplog_node_tool_results: str  #存储工具调用原始结果
+    deeplog_findings: dict  # 本地分析程序计算出的结论（突刺、趋势、变点、预测）
     deeplog_analysis_result: str  # 用于存储模型的最终分析结果
 
 
 
-def deeplog_node(state: OverallState) ->Command:
-    
-    system_prompt = """
-    你是一个时序数据分析专家，专门负责对历史日志的时序数据执行以下三件事：
-        1. **徒增突降点警告**：分析时序数据中的异常波动，识别并报告以下情况：
-        - 突然的峰值（徒增）、突然的谷值（突降）
-        - 超出正常范围的数据点
-        - 请提供异常点的时间戳、数值和异常程度
-
-        2. **趋势分析**：对时序数据的整体趋势进行分析：
-        - 判断是上升、下降还是平稳趋势
-        - 分析趋势的强度和持续性
-        - 识别趋势变化的拐点
+FETCH_PROMPT = """
+    你负责为时序数据分析获取监控数据：从用户的问题中抽取集群名称、开始时间、结束时间，调用监控工具查询数据。
+    只调用工具，不要自行分析数据。
+"""
+
+ANALYSIS_PROMPT = """
+    你是一个时序数据分析专家。监控时序已经由本地分析程序完成计算，你会收到计算出的结论
+    （统计值、突刺点、滚动统计、趋势斜率、变点和线性外推预测），请基于这些结论完成以下三件事：
+        1. **徒增突降点警告**：报告结论中的突刺点（徒增/突降）的时间戳、数值和异常程度，以及波动最大的时段
+
+        2. **趋势分析**：
+        - 根据趋势方向、斜率和R²说明是上升、下降还是平稳趋势，以及趋势的强度
+        - 根据变点说明趋势变化的拐点
         - 提供趋势变化的可能原因分析
 
-        3. **走势预测**：基于历史数据预测未来走势：
-        - 预测未来一段时间（如下1小时、3小时）的可能变化
-        - 提供预测的置信区间
+        3. **走势预测**：
+        - 根据线性外推预测说明未来的可能变化和置信区间
         - 指出需要关注的风险点
         - 给出基于预测的运维建议
 
@@ -107,67 +58,62 @@ def deeplog_node(state: OverallState) ->Command:
         - 使用结构化格式呈现分析结果
         - 对每种分析都提供清晰的结论和建议
         - 如果有异常，优先报告并给出处理建议
-        - 预测时要说明假设条件和局限性
+        - 预测时要说明假设条件（线性外推）和局限性
+        - 只使用结论中给出的数值，不要编造数据
 
-        请确保你的分析基于提供的时序数据，并给出专业的运维洞察。
-    """
+        请给出专业的运维洞察。
+"""
+
+
+def deeplog_node(state: OverallState) ->Command:
     
     llm = get_deepseek_model(0.5)
  
-    print("🔍 [DEBUG] 创建 MCP 客户端...")
-    client = MultiServerMCPClient(
-        {
-            "monitor-service": {
-                "url": "http://127.0.0.1:10027/sse",
-                "transport": "sse",
-            }
-        }
-    )
-    print("🔍 [DEBUG] 获取 MCP 工具...")
-    async_tools = asyncio.run(client.get_tools())
-    print("🔍 [DEBUG] 转换异步工具为同步工具...")
-    sync_tools = convert_async_tools_to_sync(async_tools)
+    sync_tools = mcp_manager.get_sync_tools("monitor-service")
+    tools_by_name = {tool.name: tool for tool in sync_tools}
     
-    messages_with_system = [SystemMessage(content=system_prompt)] + state["messages"]
-    
-    deeplog_agent = create_react_agent(
-        llm,
-        tools=sync_tools,
+    # 1. 大模型只负责抽取参数并调用工具，不阅读原始数据
+    tool_call_message = llm.bind_tools(sync_tools).invoke(
+        [SystemMessage(content=FETCH_PROMPT)] + build_context(state["messages"], "expert")
     )
- 
-    result = deeplog_agent.invoke({"messages": messages_with_system})
-
-    print(f"🛠️ [DEEPLOG RAW] Agent 最终输出:\n{result['messages'][-1].content}\n" + "="*40)
- 
- 
-    # 提取模型的最终回答
-    final_analysis = None
-    for message in reversed(result["messages"]):
-        if isinstance(message, AIMessage) and not isinstance(message, ToolMessage):
-            final_analysis = message.content
-            break
+    if not tool_call_message.tool_calls:
+        raise ValueError("Agent 没有成功调用任何工具或未找到工具结果。")
+    tool_call = tool_call_message.tool_calls[0]
+    print(f"🛠️ [DEEPLOG TOOL] 调用工具: {tool_call['name']} 参数: {tool_call['args']}")
+    raw_tool_result = tools_by_name[tool_call["name"]].invoke(tool_call).content
+    
+    # 2. 本地向量化分析
+    frame = parse_monitor_payload(raw_tool_result)
+    if frame is None:
+        # 无法识别的数据格式，退回由大模型直接阅读原始数据
+        print("⚠️ [DEEPLOG ANALYSIS] 工具结果中没有可识别的时序数据，交由模型直接分析")
+        findings = {}
+        analysis_input = f"原始监控数据:\n{raw_tool_result}"
+    else:
+        findings = analyze_frame(frame)
+        analysis_input = f"分析结论:\n{format_findings(findings)}"
+        print(f"📐 [DEEPLOG ANALYSIS] 本地分析完成: {len(frame.names)} 条序列, {len(frame)} 个时间点")
+    
+    # 3. 大模型只对结论组织语言
+    question = state["messages"][-1].content if state["messages"] else ""
+    result = llm.invoke([
+        SystemMessage(content=ANALYSIS_PROMPT),
+        HumanMessage(content=f"用户问题: {question}\n\n{analysis_input}"),
+    ])
+    final_analysis = result.content
     
     if final_analysis:
         print(f"📊 [DEEPLOG ANALYSIS] 模型分析结果:\n{final_analysis}\n" + "="*40)
     else:
         print("⚠️ [DEEPLOG ANALYSIS] 未找到模型的分析结果")
         final_analysis = "未生成分析结果"
-        
-    # --- 更健壮地提取原始工具结果 ---
-    raw_tool_result = None
-    # 从消息历史中倒序查找，确保找到的是最后一次工具调用的结果
-    for message in reversed(result["messages"]):
-        if isinstance(message, ToolMessage):
-            raw_tool_result = message.content
-            break  # 找到后立即退出循环
- 
-    if not raw_tool_result:
-        raise ValueError("Agent 没有成功调用任何工具或未找到工具结果。")
     
     return Command(
             update={
                 # 原始工具结果字符串存入一个独立的字段
                 "deeplog_node_tool_results": raw_tool_result,
+                # 本地分析结论
+                "deeplog_findings": findings,
                 # 模型的最终分析结果也存入state
                 "deeplog_analysis_result": final_analysis
             },
@@ -0,0 +1,397 @@
+"""
+监控时序的本地分析模块
+将监控工具返回的图表数据（x_data + series_data）一次性解析为 NumPy 数组，
+用向量化计算完成突刺检测、滚动统计、趋势斜率、变点检测与简单预测，
+大模型只需要根据这里给出的结论组织语言，不再逐点阅读原始数据
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# 突刺判定阈值：残差超过 SPIKE_THRESHOLD 倍稳健标准差
+SPIKE_THRESHOLD = 4.0
+# 变点判定阈值：前后两段均值之差超过 CHANGE_THRESHOLD 倍噪声标准差
+CHANGE_THRESHOLD = 3.0
+# 每条序列最多报告的突刺/变点个数
+MAX_FINDINGS = 5
+# 预测时间点（秒）：默认预测未来 10 分钟和 1 小时
+FORECAST_HORIZONS = (600, 3600)
+
+# MAD 转换为正态分布标准差的系数
+_MAD_SCALE = 1.4826
+
+
+class SeriesFrame:
+    """列式存储的多条时序：共享时间轴 times（秒级时间戳），values 每行一条序列，缺失值为 NaN"""
+
+    def __init__(self, times: np.ndarray, names: List[str], values: np.ndarray,
+                 title: str = "", unit: str = ""):
+        self.times = times
+        self.names = names
+        self.values = values
+        self.title = title
+        self.unit = unit
+
+    def __len__(self):
+        return len(self.times)
+
+
+def _load_json(raw: Any) -> Any:
+    """工具结果可能是字典、JSON 字符串，或 ["{...}", null] 这种内容+附件的列表"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return None
+    if isinstance(raw, list):
+        for item in raw:
+            loaded = _load_json(item) if isinstance(item, (str, dict)) else None
+            if isinstance(loaded, dict):
+                return loaded
+        return None
+    return raw
+
+
+def _find_chart(obj: Any) -> Optional[Dict[str, Any]]:
+    """查找包含 x_data 与 series_data 的图表结构"""
+    if isinstance(obj, dict):
+        if "x_data" in obj and "series_data" in obj:
+            return obj
+        for value in obj.values():
+            found = _find_chart(value)
+            if found is not None:
+                return found
+    elif isinstance(obj, list):
+        for item in obj:
+            found = _find_chart(item)
+            if found is not None:
+                return found
+    return None
+
+
+def _parse_times(x_data: List[Any]) -> np.ndarray:
+    """
+    时间轴转换为秒数：支持 "YYYY-MM-DD HH:MM:SS" 字符串与秒/毫秒时间戳
+
+    统一按本地时间的“墙上时间”计秒（不含时区），格式化时原样还原为本地时间字符串
+    """
+    try:
+        return np.array(x_data, dtype="datetime64[s]").astype(np.float64)
+    except (TypeError, ValueError):
+        pass
+    try:
+        times = np.array(x_data, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([
+            datetime.strptime(str(x), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+            for x in x_data
+        ])
+    times = np.where(times > 1e11, times / 1000, times)
+    # 时间戳转换为本地墙上时间
+    first = datetime.fromtimestamp(times[0])
+    return times + (first.replace(tzinfo=timezone.utc).timestamp() - first.timestamp())
+
+
+def _to_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_monitor_payload(raw: Any) -> Optional[SeriesFrame]:
+    """
+    解析监控工具结果为 SeriesFrame
+
+    Args:
+        raw: npa_analysis_prometheus_core 的返回值（字典、JSON 字符串或 ToolMessage 的 content）
+
+    Returns:
+        SeriesFrame；没有可识别的图表数据时返回None
+    """
+    chart = _find_chart(_load_json(raw))
+    if chart is None or not chart.get("x_data"):
+        return None
+
+    times = _parse_times(chart["x_data"])
+    names, rows = [], []
+    for item in chart.get("series_data") or []:
+        row = np.full(len(times), np.nan)
+        values = item.get("value") or []
+        count = min(len(values), len(times))
+        row[:count] = [_to_float(v) for v in values[:count]]
+        names.append(str(item.get("name")))
+        rows.append(row)
+    if not rows:
+        return None
+
+    # 按时间排序，保证后续的差分、滚动窗口语义正确
+    order = np.argsort(times, kind="stable")
+    values = np.vstack(rows)[:, order]
+    return SeriesFrame(times[order], names, values, chart.get("title", ""), chart.get("unit", ""))
+
+
+def _format_time(ts: float) -> str:
+    return str(np.datetime64(int(round(float(ts))), "s")).replace("T", " ")
+
+
+def _robust_std(x: np.ndarray) -> float:
+    """基于 MAD 的稳健标准差"""
+    return float(_MAD_SCALE * np.median(np.abs(x - np.median(x))))
+
+
+def _noise_std(x: np.ndarray) -> float:
+    """由一阶差分估计的噪声标准差，不受趋势与均值漂移影响"""
+    if len(x) < 3:
+        return float(np.std(x))
+    sigma = _robust_std(np.diff(x)) / np.sqrt(2)
+    return sigma if sigma > 0 else float(np.std(np.diff(x))) / np.sqrt(2)
+
+
+def rolling_median(x: np.ndarray, window: int) -> np.ndarray:
+    """居中的滚动中位数，两端用边缘值填充"""
+    if len(x) < window:
+        return np.full(len(x), np.median(x))
+    half = window // 2
+    padded = np.pad(x, (half, window - 1 - half), mode="edge")
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+
+def rolling_stats(x: np.ndarray, window: int) -> Dict[str, Any]:
+    """
+    滚动均值/标准差（基于累加和，O(n)）
+
+    Returns:
+        各窗口均值的最小/最大值，以及波动最大的窗口（标准差最大）的位置
+    """
+    if len(x) < window:
+        return {}
+    csum = np.cumsum(np.insert(x, 0, 0.0))
+    csq = np.cumsum(np.insert(x * x, 0, 0.0))
+    mean = (csum[window:] - csum[:-window]) / window
+    var = np.maximum((csq[window:] - csq[:-window]) / window - mean * mean, 0.0)
+    std = np.sqrt(var)
+    busiest = int(np.argmax(std))
+    return {
+        "window": window,
+        "mean_min": float(mean.min()),
+        "mean_max": float(mean.max()),
+        "std_max": float(std[busiest]),
+        "most_volatile_start": busiest,
+        "most_volatile_end": busiest + window - 1,
+    }
+
+
+def detect_spikes(x: np.ndarray, window: int, threshold: float = SPIKE_THRESHOLD) -> List[Tuple[int, float]]:
+    """
+    突刺检测：相对滚动中位数的残差超过 threshold 倍稳健标准差的点
+
+    Returns:
+        [(下标, 偏离倍数)]，偏离倍数带符号（正为徒增，负为突降），按偏离程度取前 MAX_FINDINGS 个
+    """
+    residual = x - rolling_median(x, window)
+    sigma = _robust_std(residual)
+    if sigma == 0:
+        sigma = float(np.std(residual))
+    if sigma == 0:
+        return []
+    score = residual / sigma
+    index = np.flatnonzero(np.abs(score) >= threshold)
+    top = index[np.argsort(-np.abs(score[index]), kind="stable")][:MAX_FINDINGS]
+    return [(int(i), float(score[i])) for i in np.sort(top)]
+
+
+def linear_trend(t: np.ndarray, x: np.ndarray) -> Dict[str, float]:
+    """最小二乘线性拟合：斜率（每分钟）、截距与 R²"""
+    t0 = t - t[0]
+    slope, intercept = np.polyfit(t0, x, 1)
+    fitted = slope * t0 + intercept
+    ss_res = float(np.sum((x - fitted) ** 2))
+    ss_tot = float(np.sum((x - x.mean()) ** 2))
+    return {
+        "slope_per_min": float(slope * 60),
+        "intercept": float(intercept),
+        "r2": 1 - ss_res / ss_tot if ss_tot > 0 else 0.0,
+        "residual_std": float(np.sqrt(ss_res / max(len(x) - 2, 1))),
+    }
+
+
+def _best_split(x: np.ndarray, min_size: int) -> Tuple[Optional[int], float]:
+    """均值漂移的最佳切分点（向量化计算所有切分位置）：返回 (切分下标, 前后均值差)"""
+    n = len(x)
+    if n < 2 * min_size:
+        return None, 0.0
+    csum = np.cumsum(x)
+    k = np.arange(min_size, n - min_size + 1)
+    left = csum[k - 1] / k
+    right = (csum[-1] - csum[k - 1]) / (n - k)
+    gain = k * (n - k) / n * (left - right) ** 2
+    best = int(np.argmax(gain))
+    return int(k[best]), float(right[best] - left[best])
+
+
+def change_points(x: np.ndarray, min_size: int, threshold: float = CHANGE_THRESHOLD) -> List[Dict[str, float]]:
+    """
+    二分切分法检测均值变点
+
+    均值变化需同时超过 threshold 倍噪声标准差与序列本身的稳健标准差，
+    避免把正常范围内的起伏报告为拐点
+
+    Returns:
+        [{"index": 变点下标, "before": 前一段均值, "after": 后一段均值}]，按时间顺序，最多 MAX_FINDINGS 个
+    """
+    min_shift = max(threshold * _noise_std(x), _robust_std(x))
+    if min_shift == 0:
+        return []
+    found = []
+    segments = [(0, len(x))]
+    while segments and len(found) < MAX_FINDINGS:
+        start, end = segments.pop(0)
+        split, shift = _best_split(x[start:end], min_size)
+        if split is None or abs(shift) < min_shift:
+            continue
+        found.append(start + split)
+        segments.extend([(start, start + split), (start + split, end)])
+
+    bounds = [0] + sorted(found) + [len(x)]
+    means = [float(x[lo:hi].mean()) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    return [
+        {"index": index, "before": means[n], "after": means[n + 1]}
+        for n, index in enumerate(sorted(found))
+    ]
+
+
+def forecast(t: np.ndarray, x: np.ndarray, horizons=FORECAST_HORIZONS) -> List[Dict[str, float]]:
+    """
+    线性外推预测，给出 95% 预测区间
+
+    Args:
+        horizons: 距最后一个点的秒数
+    """
+    t0 = t - t[0]
+    n = len(x)
+    slope, intercept = np.polyfit(t0, x, 1)
+    residual = x - (slope * t0 + intercept)
+    s = float(np.sqrt(np.sum(residual ** 2) / max(n - 2, 1)))
+    sxx = float(np.sum((t0 - t0.mean()) ** 2)) or 1.0
+    future = t0[-1] + np.asarray(horizons, dtype=np.float64)
+    predicted = slope * future + intercept
+    margin = 1.96 * s * np.sqrt(1 + 1 / n + (future - t0.mean()) ** 2 / sxx)
+    return [
+        {"horizon_min": h / 60, "value": float(p), "lower": float(p - m), "upper": float(p + m)}
+        for h, p, m in zip(horizons, predicted, margin)
+    ]
+
+
+def _trend_label(slope_per_min: float, r2: float, x: np.ndarray, duration_min: float) -> str:
+    """窗口内的总变化量相对均值不足 5% 或拟合度很低时视为平稳"""
+    scale = abs(float(np.mean(x))) or 1.0
+    if r2 < 0.3 or abs(slope_per_min * duration_min) / scale < 0.05:
+        return "平稳"
+    return "上升" if slope_per_min > 0 else "下降"
+
+
+def analyze_series(t: np.ndarray, x: np.ndarray) -> Dict[str, Any]:
+    """对单条序列计算统计值、突刺、滚动统计、趋势、变点与预测（忽略缺失点）"""
+    valid = ~np.isnan(x)
+    t, x = t[valid], x[valid]
+    if len(x) < 3:
+        return {"points": int(len(x))}
+
+    window = max(5, min(61, len(x) // 20) | 1)
+    duration_min = float(t[-1] - t[0]) / 60
+    trend = linear_trend(t, x)
+    rolling = rolling_stats(x, window)
+    if rolling:
+        rolling["most_volatile_start"] = _format_time(t[rolling["most_volatile_start"]])
+        rolling["most_volatile_end"] = _format_time(t[rolling["most_volatile_end"]])
+
+    return {
+        "points": int(len(x)),
+        "start": _format_time(t[0]),
+        "end": _format_time(t[-1]),
+        "stats": {
+            "min": float(x.min()),
+            "max": float(x.max()),
+            "mean": float(x.mean()),
+            "std": float(x.std()),
+            "p95": float(np.percentile(x, 95)),
+            "last": float(x[-1]),
+            "max_at": _format_time(t[int(np.argmax(x))]),
+            "min_at": _format_time(t[int(np.argmin(x))]),
+        },
+        "spikes": [
+            {"time": _format_time(t[i]), "value": float(x[i]), "score": score,
+             "kind": "徒增" if score > 0 else "突降"}
+            for i, score in detect_spikes(x, window)
+        ],
+        "rolling": rolling,
+        "trend": {**trend, "direction": _trend_label(trend["slope_per_min"], trend["r2"], x, duration_min)},
+        "change_points": [
+            {"time": _format_time(t[point["index"]]), "before": point["before"], "after": point["after"]}
+            for point in change_points(x, max(3, window // 2))
+        ],
+        "forecast": forecast(t, x),
+    }
+
+
+def analyze_frame(frame: SeriesFrame) -> Dict[str, Any]:
+    """分析 SeriesFrame 中的所有序列"""
+    return {
+        "title": frame.title,
+        "unit": frame.unit,
+        "series": {name: analyze_series(frame.times, row) for name, row in zip(frame.names, frame.values)},
+    }
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.2f}"
+
+
+def format_findings(findings: Dict[str, Any]) -> str:
+    """将分析结论格式化为供大模型阅读的中文文本"""
+    unit = findings.get("unit") or ""
+    lines = [f"指标: {findings.get('title') or '未知'}（单位: {unit or '无'}）"]
+    for name, result in findings["series"].items():
+        lines.append(f"\n## 序列 {name}")
+        if "stats" not in result:
+            lines.append(f"- 有效数据点不足（{result['points']} 个），无法分析")
+            continue
+        s = result["stats"]
+        lines.append(f"- 时间范围: {result['start']} ~ {result['end']}，共 {result['points']} 个点")
+        lines.append(
+            f"- 统计: 最小 {_fmt(s['min'])}（{s['min_at']}），最大 {_fmt(s['max'])}（{s['max_at']}），"
+            f"均值 {_fmt(s['mean'])}，标准差 {_fmt(s['std'])}，P95 {_fmt(s['p95'])}，最新 {_fmt(s['last'])}"
+        )
+        if result["spikes"]:
+            lines.append("- 突刺点:")
+            for spike in result["spikes"]:
+                lines.append(f"  - {spike['time']} {spike['kind']}，数值 {_fmt(spike['value'])}，偏离 {_fmt(abs(spike['score']))} 倍标准差")
+        else:
+            lines.append("- 突刺点: 无")
+        trend = result["trend"]
+        lines.append(
+            f"- 趋势: {trend['direction']}，斜率 {trend['slope_per_min']:+.4f}/分钟，R² {_fmt(trend['r2'])}"
+        )
+        if result["rolling"]:
+            r = result["rolling"]
+            lines.append(
+                f"- 滚动统计（窗口 {r['window']} 点）: 均值范围 {_fmt(r['mean_min'])} ~ {_fmt(r['mean_max'])}，"
+                f"波动最大时段 {r['most_volatile_start']} ~ {r['most_volatile_end']}（标准差 {_fmt(r['std_max'])}）"
+            )
+        if result["change_points"]:
+            lines.append("- 变点（拐点）:")
+            for point in result["change_points"]:
+                lines.append(f"  - {point['time']} 均值由 {_fmt(point['before'])} 变为 {_fmt(point['after'])}")
+        else:
+            lines.append("- 变点（拐点）: 无")
+        lines.append("- 线性外推预测（95% 区间）:")
+        for item in result["forecast"]:
+            lines.append(
+                f"  - {item['horizon_min']:.0f} 分钟后: {_fmt(item['value'])}（{_fmt(item['lower'])} ~ {_fmt(item['upper'])}）"
+            )
+    return "\n".join(lines)
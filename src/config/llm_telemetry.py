@@ -0,0 +1,104 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+def _cached_tokens(response: LLMResult) -> Optional[tuple]:
+    """
+    从模型返回中提取 (输入 token 数, 命中前缀缓存的 token 数)
+
+    优先使用 langchain 统一的 usage_metadata（input_token_details.cache_read），
+    否则读取接口原始的 token_usage：DeepSeek 为 prompt_cache_hit_tokens，OpenAI 为 prompt_tokens_details.cached_tokens
+    """
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                details = usage.get("input_token_details") or {}
+                if "cache_read" in details:
+                    return usage.get("input_tokens", 0), details.get("cache_read") or 0
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if not usage:
+        return None
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    if "prompt_cache_hit_tokens" in usage:
+        return prompt_tokens, usage.get("prompt_cache_hit_tokens") or 0
+    details = usage.get("prompt_tokens_details") or {}
+    return prompt_tokens, details.get("cached_tokens") or 0
+
+
+class PromptCacheTelemetry(BaseCallbackHandler):
+    """
+    按图节点统计服务商前缀缓存（prompt caching）的命中情况
+
+    挂在模型实例上（见 model_config.get_chat_model），自动覆盖节点内的直接调用、结构化输出与 ReAct Agent；
+    节点名取自 LangGraph 注入的 metadata["langgraph_node"]，不在图中执行的调用记为 "unknown"；
+    未返回 usage 的调用单独计数（no_usage_calls），不参与命中率计算
+    """
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any):
+        node = (metadata or {}).get("langgraph_node") or "unknown"
+        with self._lock:
+            self._runs[run_id] = (node, time.perf_counter())
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            node, started = self._runs.pop(run_id, ("unknown", None))
+        usage = _cached_tokens(response)
+        elapsed = time.perf_counter() - started if started is not None else 0.0
+        with self._lock:
+            counters = self._stats.setdefault(
+                node, {"calls": 0, "no_usage_calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "latency": 0.0}
+            )
+            counters["calls"] += 1
+            counters["latency"] += elapsed
+            if usage is not None:
+                counters["prompt_tokens"] += usage[0]
+                counters["cached_tokens"] += usage[1]
+            else:
+                counters["no_usage_calls"] += 1
+        if usage is not None:
+            print(f"🔍 [DEBUG] 前缀缓存[{node}]: 命中 {usage[1]}/{usage[0]} tokens，耗时 {elapsed:.2f}s")
+        else:
+            print(f"🔍 [DEBUG] 前缀缓存[{node}]: 模型未返回 usage，不计入命中率，耗时 {elapsed:.2f}s")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回各节点的调用次数、未返回 usage 的调用次数、输入 token 数、缓存命中 token 数、命中率与平均耗时
+
+        命中率只按返回了 usage 的调用计算，没有这类调用时为None（而不是0）
+        """
+        with self._lock:
+            result = {}
+            for node, counters in self._stats.items():
+                prompt_tokens = counters["prompt_tokens"]
+                result[node] = {
+                    "calls": counters["calls"],
+                    "no_usage_calls": counters["no_usage_calls"],
+                    "prompt_tokens": prompt_tokens,
+                    "cached_tokens": counters["cached_tokens"],
+                    "hit_rate": counters["cached_tokens"] / prompt_tokens if prompt_tokens else None,
+                    "avg_latency": counters["latency"] / counters["calls"] if counters["calls"] else 0.0,
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+# 全局实例，所有通过 get_chat_model 创建的模型共享
+prompt_cache_telemetry = PromptCacheTelemetry()
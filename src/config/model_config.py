@@ -1,35 +1,99 @@
+import hashlib
 import os
+import threading
+from typing import Dict, Tuple
+
+import httpx
 from langchain_openai import ChatOpenAI
 
+from config.llm_telemetry import prompt_cache_telemetry
+
+# 每个模型服务商共享的连接池大小与请求超时（秒）
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "20"))
+LLM_POOL_KEEPALIVE = int(os.getenv("LLM_POOL_KEEPALIVE", "10"))
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", "120"))
+
+# 模型实例缓存：(模型名, 温度, 接口地址, API Key 指纹) -> ChatOpenAI
+_models: Dict[tuple, ChatOpenAI] = {}
+# 每个服务商（接口地址）一组共享的 HTTP 客户端：(同步客户端, 异步客户端)
+_http_clients: Dict[str, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+_lock = threading.Lock()
+
+
+def _provider_clients(base_url: str) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    获取服务商共享的 keep-alive HTTP 客户端（首次调用时创建）
+
+    同一服务商的所有模型实例复用同一个连接池，避免重复建连与 TLS 握手。
+    异步客户端的连接绑定在首次使用它的事件循环上，应在同一个事件循环中使用。
+    """
+    clients = _http_clients.get(base_url)
+    if clients is None:
+        limits = httpx.Limits(max_connections=LLM_POOL_MAXSIZE, max_keepalive_connections=LLM_POOL_KEEPALIVE)
+        clients = (
+            httpx.Client(limits=limits, timeout=LLM_HTTP_TIMEOUT),
+            httpx.AsyncClient(limits=limits, timeout=LLM_HTTP_TIMEOUT),
+        )
+        _http_clients[base_url] = clients
+    return clients
+
+
+def get_chat_model(model: str, api_key: str, base_url: str, temperature: float) -> ChatOpenAI:
+    """
+    按 (模型名, 温度, 接口地址, API Key) 缓存的模型工厂
+
+    相同参数的调用返回同一个 ChatOpenAI 实例，不同 API Key 得到不同实例（缓存键中只保存 Key 的哈希）；
+    同一服务商的实例共享 HTTP 连接池；
+    所有实例挂载 prompt_cache_telemetry，按节点记录服务商前缀缓存命中的 token 数
+
+    Returns:
+        ChatOpenAI: 配置好的模型实例
+    """
+    key = (model, temperature, base_url, hashlib.sha256(str(api_key or "").encode("utf-8")).hexdigest())
+    with _lock:
+        instance = _models.get(key)
+        if instance is None:
+            http_client, http_async_client = _provider_clients(base_url)
+            instance = ChatOpenAI(
+                model=model,
+                api_key=api_key,
+                base_url=base_url,
+                temperature=temperature,
+                http_client=http_client,
+                http_async_client=http_async_client,
+                # 流式调用默认不返回 usage，打开后前缀缓存统计才能覆盖 astream 路径
+                stream_usage=True,
+                callbacks=[prompt_cache_telemetry],
+            )
+            _models[key] = instance
+        return instance
+
 
 def get_deepseek_model(temperature=0.2):
     """
     配置并返回 DeepSeek 模型实例
-    
+
     Returns:
         ChatOpenAI: 配置好的 DeepSeek 模型实例
     """
-    model = ChatOpenAI(
+    return get_chat_model(
         model=os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
         api_key=os.getenv("DEEPSEEK_API_KEY"),
         base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
         temperature=temperature,
-        # model_kwargs={"response_format": None} 
     )
-    return model
 
 
 def get_glm_model(temperature=0.4):
     """
     配置并返回 GLM-4.6 模型实例
-    
+
     Returns:
         ChatOpenAI: 配置好的 GLM-4.6 模型实例
     """
-    model = ChatOpenAI(
+    return get_chat_model(
         model="glm-4.6",
         api_key="5664839384444eb5a1bfdb6c9f7269b3.iBSzYXqjTBqTqZzm",
         base_url="https://open.bigmodel.cn/api/coding/paas/v4",
         temperature=temperature,
     )
-    return model
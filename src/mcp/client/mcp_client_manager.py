@@ -6,9 +6,13 @@ MCP客户端管理模块
 import json
 import os
 import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
 from typing import Dict, List, Optional, Any
 from langchain_mcp_adapters.client import MultiServerMCPClient
-from langchain_core.tools import StructuredTool
+from langchain_mcp_adapters.tools import load_mcp_tools
+from langchain_core.tools import StructuredTool, ToolException
 from langgraph.prebuilt import create_react_agent
 
 
@@ -25,8 +29,24 @@ class MCPClientManager:
         self.config_path = config_path or self._get_default_config_path()
         self.config = self._load_config()
         self._clients: Dict[str, MultiServerMCPClient] = {}
-        self._agents: Dict[str, Any] = {}  # 缓存Agent实例
-        self._tools_cache: Dict[str, List[StructuredTool]] = {}  # 缓存工具
+        # Agent注册表：(服务器, 模型, 提示词) -> {"fingerprint", "agent", "model", "prompt"}
+        self._agents: Dict[tuple, Dict[str, Any]] = {}
+        # 每个服务器最近一次创建的Agent对应的注册表键，供 get_cached_agent 使用
+        self._server_agents: Dict[str, tuple] = {}
+        self._agent_lock = threading.Lock()
+        # 缓存工具：server_name -> (工具列表指纹, 同步工具列表)
+        self._tools_cache: Dict[str, Any] = {}
+        
+        # 后台常驻事件循环：所有MCP会话都在这个循环里建立并长期保持
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+        # 每个服务器一个常驻会话：server_name -> (关闭事件, 工具加载结果的Future, 常驻任务的Future)
+        self._sessions: Dict[str, Any] = {}
+        self._session_lock = threading.Lock()
+        self.call_timeout = self.config.get("settings", {}).get("connection_timeout", 30)
+        # 单次工具调用的等待时间，长时间窗口的日志查询需要比建连更长的超时
+        self.tool_timeout = self.config.get("settings", {}).get("tool_timeout", self.call_timeout)
         
     def _get_default_config_path(self) -> str:
         """获取默认配置文件路径"""
@@ -47,22 +67,156 @@ class MCPClientManager:
             print(f"❌ [ERROR] 配置文件格式错误: {e}")
             raise
             
-    def create_sync_tool_wrapper(self, async_tool):
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """启动（如果尚未启动）后台事件循环线程并返回该循环"""
+        with self._loop_lock:
+            if self._loop is not None and self._loop.is_running():
+                return self._loop
+            
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+            
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(started.set)
+                loop.run_forever()
+            
+            thread = threading.Thread(target=run_loop, name="mcp-event-loop", daemon=True)
+            thread.start()
+            started.wait()
+            
+            self._loop = loop
+            self._loop_thread = thread
+            print("🔍 [DEBUG] MCP 后台事件循环已启动")
+            return loop
+            
+    def run_coroutine(self, coro, timeout: Optional[float] = None):
+        """
+        在后台事件循环中执行协程并同步等待结果
+        
+        Args:
+            coro: 要执行的协程
+            timeout: 等待超时时间（秒），为None时使用配置中的connection_timeout
+            
+        Returns:
+            协程的返回值
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout=timeout or self.call_timeout)
+        except BaseException:
+            future.cancel()
+            raise
+            
+    async def _session_worker(self, server_name: str, ready: Future, closed: asyncio.Event):
+        """
+        持有指定服务器MCP会话的常驻任务
+        
+        会话的建立与关闭必须在同一个任务内完成（SSE传输内部使用anyio任务组），
+        因此由该任务打开会话、加载工具，然后一直等待关闭信号。
+        """
+        client = self.create_client(server_name)
+        try:
+            async with client.session(server_name) as session:
+                tools = await load_mcp_tools(session)
+                ready.set_result(tools)
+                print(f"🔍 [DEBUG] {server_name} MCP 会话已建立")
+                await closed.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            print(f"🔍 [DEBUG] {server_name} MCP 会话已断开: {e!r}")
+        finally:
+            if not ready.done():
+                ready.set_exception(ConnectionError(f"{server_name} MCP 会话未能建立"))
+            with self._session_lock:
+                entry = self._sessions.get(server_name)
+                if entry is not None and entry[0] is closed:
+                    self._sessions.pop(server_name, None)
+                    
+    def _get_session_tools(self, server_name: str):
+        """获取（必要时建立）指定服务器的常驻会话，返回绑定该会话的异步工具"""
+        with self._session_lock:
+            entry = self._sessions.get(server_name)
+            if entry is None:
+                loop = self._ensure_loop()
+                ready: Future = Future()
+                closed = asyncio.Event()
+                worker = asyncio.run_coroutine_threadsafe(self._session_worker(server_name, ready, closed), loop)
+                entry = (closed, ready, worker)
+                self._sessions[server_name] = entry
+        
+        try:
+            return entry[1].result(timeout=self.call_timeout)
+        except BaseException:
+            self._close_session(server_name)
+            raise
+            
+    def _close_session(self, server_name: str):
+        """通知常驻任务关闭指定服务器的会话"""
+        with self._session_lock:
+            entry = self._sessions.pop(server_name, None)
+        if entry is not None and self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(entry[0].set)
+            
+    def create_sync_tool_wrapper(self, async_tool, server_name: Optional[str] = None):
         """创建同步工具包装器，将异步 MCP 工具转换为同步工具"""
         
         def sync_func(**kwargs):
-            """同步包装函数，使用 asyncio.run 调用异步工具"""
+            """同步包装函数，将协程提交到后台事件循环，复用常驻的MCP会话"""
             try:
+                target = async_tool
+                if server_name:
+                    # 按名称取当前会话上的工具，会话断开重连后已创建的Agent依然可用
+                    session_tools = {t.name: t for t in self._get_session_tools(server_name)}
+                    target = session_tools.get(async_tool.name, async_tool)
                 # 调用异步工具的 coroutine 函数
-                result = asyncio.run(async_tool.coroutine(**kwargs))
+                result = self.run_coroutine(target.coroutine(**kwargs), timeout=self.tool_timeout)
                 return result
+            except ToolException:
+                # 工具自身返回的错误，会话仍然可用
+                raise
             except Exception as e:
                 print(f"🔍 [DEBUG] 同步包装器执行异常: {e}")
+                # 会话可能已断开，关闭后下次调用时重新建立连接
+                if server_name:
+                    self._close_session(server_name)
+                raise e
+                
+        async def async_func(**kwargs):
+            """异步包装函数，供 ainvoke 使用：在后台事件循环执行，调用方事件循环只等待结果"""
+            loop = self._ensure_loop()
+            return await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(_call_on_session(kwargs), loop)
+            )
+            
+        async def _call_on_session(kwargs):
+            target = async_tool
+            if server_name:
+                entry = self._sessions.get(server_name)
+                if entry is not None and entry[1].done() and entry[1].exception() is None:
+                    session_tools = entry[1].result()
+                else:
+                    # 会话尚未建立：在线程池中等待，避免阻塞后台事件循环
+                    session_tools = await asyncio.get_running_loop().run_in_executor(
+                        None, self._get_session_tools, server_name
+                    )
+                target = {t.name: t for t in session_tools}.get(async_tool.name, async_tool)
+            try:
+                return await asyncio.wait_for(target.coroutine(**kwargs), self.tool_timeout)
+            except ToolException:
+                raise
+            except Exception as e:
+                print(f"🔍 [DEBUG] 异步包装器执行异常: {e}")
+                if server_name:
+                    self._close_session(server_name)
                 raise e
         
-        # 创建新的同步 StructuredTool
+        # 创建新的 StructuredTool，同时支持 invoke（同步）与 ainvoke（异步）
         sync_tool = StructuredTool.from_function(
             func=sync_func,
+            coroutine=async_func,
             name=async_tool.name,
             description=async_tool.description,
             args_schema=async_tool.args_schema,
@@ -72,13 +226,13 @@ class MCPClientManager:
         print(f"🔍 [DEBUG] 创建同步工具包装器: {async_tool.name}")
         return sync_tool
 
-    def convert_async_tools_to_sync(self, async_tools):
+    def convert_async_tools_to_sync(self, async_tools, server_name: Optional[str] = None):
         """将异步工具列表转换为同步工具列表"""
         sync_tools = []
         for tool in async_tools:
             if hasattr(tool, 'coroutine') and tool.coroutine is not None:
                 # 这是一个异步工具，需要包装
-                sync_tool = self.create_sync_tool_wrapper(tool)
+                sync_tool = self.create_sync_tool_wrapper(tool, server_name)
                 sync_tools.append(sync_tool)
                 print(f"🔍 [DEBUG] 转换异步工具: {tool.name} -> 同步工具")
             else:
@@ -117,6 +271,44 @@ class MCPClientManager:
         self._clients[server_name] = client
         return client
         
+    @staticmethod
+    def tools_fingerprint(tools) -> str:
+        """工具列表指纹：由工具名称、描述与参数结构计算，服务端工具变化时指纹随之变化"""
+        items = []
+        for tool in sorted(tools, key=lambda t: t.name):
+            schema = tool.args_schema
+            if schema is not None and not isinstance(schema, dict):
+                schema = schema.model_json_schema() if hasattr(schema, "model_json_schema") else schema.schema()
+            items.append([tool.name, tool.description or "", schema])
+        payload = json.dumps(items, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        
+    def _current_fingerprint(self, server_name: str) -> Optional[str]:
+        """当前会话工具列表的指纹；会话尚未建立或已断开时返回None（不阻塞）"""
+        entry = self._sessions.get(server_name)
+        if entry is None or not entry[1].done() or entry[1].exception() is not None:
+            return None
+        return self.tools_fingerprint(entry[1].result())
+        
+    def _fingerprinted_tools(self, server_name: str):
+        """返回 (工具列表指纹, 同步工具列表)；会话重连后工具列表变化（指纹不同）时重新转换工具"""
+        async_tools = self._get_session_tools(server_name)
+        fingerprint = self.tools_fingerprint(async_tools)
+        
+        # 检查缓存
+        cached = self._tools_cache.get(server_name)
+        if cached is not None and cached[0] == fingerprint:
+            print(f"🔍 [DEBUG] 使用缓存的 {server_name} 工具")
+            return cached
+            
+        print(f"🔍 [DEBUG] 转换 {server_name} MCP 工具...")
+        # 按名称排序：工具定义是请求前缀的一部分，顺序固定才能命中服务商的前缀缓存
+        sync_tools = self.convert_async_tools_to_sync(sorted(async_tools, key=lambda t: t.name), server_name)
+        
+        # 缓存工具
+        self._tools_cache[server_name] = (fingerprint, sync_tools)
+        return fingerprint, sync_tools
+        
     def get_sync_tools(self, server_name: str) -> List[StructuredTool]:
         """
         获取指定服务器的同步工具列表
@@ -127,53 +319,78 @@ class MCPClientManager:
         Returns:
             同步工具列表
         """
-        # 检查缓存
-        if server_name in self._tools_cache:
-            print(f"🔍 [DEBUG] 使用缓存的 {server_name} 工具")
-            return self._tools_cache[server_name]
-            
-        client = self.create_client(server_name)
+        return self._fingerprinted_tools(server_name)[1]
         
-        print(f"🔍 [DEBUG] 获取 {server_name} MCP 工具...")
-        async_tools = asyncio.run(client.get_tools())
-        sync_tools = self.convert_async_tools_to_sync(async_tools)
+    @staticmethod
+    def _model_key(model) -> tuple:
+        """模型的注册表键：同一类型、模型名、温度与接口地址的模型实例视为同一个模型"""
+        name = getattr(model, "model_name", None) or getattr(model, "model", None)
+        if name is None:
+            return (id(model),)
+        return (
+            type(model).__name__,
+            name,
+            getattr(model, "temperature", None),
+            str(getattr(model, "openai_api_base", None) or getattr(model, "base_url", None) or ""),
+        )
         
-        # 缓存工具
-        self._tools_cache[server_name] = sync_tools
-        return sync_tools
+    def _agent_key(self, server_name: str, model, system_prompt: Optional[str]) -> tuple:
+        prompt_key = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest() if system_prompt else None
+        return (server_name, self._model_key(model), prompt_key)
         
     def create_agent(self, server_name: str, model, system_prompt: str = None) -> Any:
         """
-        创建并缓存指定服务器的Agent
+        获取（必要时编译）指定服务器、模型与提示词的 React Agent
+        
+        Agent 按 (服务器, 模型, 提示词) 只编译一次并在各次节点调用间复用；
+        服务端工具列表变化时（工具指纹不同）重新编译
         
         Args:
             server_name: 服务器名称
             model: 语言模型实例
-            system_prompt: 系统提示词
+            system_prompt: 系统提示词，为None时由调用方在消息中自行携带
             
         Returns:
-            创建的Agent实例
+            Agent实例
         """
-        # 检查缓存
-        if server_name in self._agents:
-            print(f"🔍 [DEBUG] 使用缓存的 {server_name} Agent")
-            return self._agents[server_name]
-            
-        sync_tools = self.get_sync_tools(server_name)
-        
-        print(f"🔍 [DEBUG] 创建 {server_name} React Agent...")
-        agent = create_react_agent(
-            model=model,
-            tools=sync_tools,
-        )
+        key = self._agent_key(server_name, model, system_prompt)
+        fingerprint = self._current_fingerprint(server_name)
+        with self._agent_lock:
+            entry = self._agents.get(key)
+            if entry is not None and (fingerprint is None or entry["fingerprint"] == fingerprint):
+                self._server_agents[server_name] = key
+                print(f"🔍 [DEBUG] 使用缓存的 {server_name} Agent")
+                return entry["agent"]
+                
+        fingerprint, sync_tools = self._fingerprinted_tools(server_name)
         
-        # 缓存Agent
-        self._agents[server_name] = agent
-        return agent
+        with self._agent_lock:
+            entry = self._agents.get(key)
+            if entry is not None and entry["fingerprint"] == fingerprint:
+                return entry["agent"]
+            print(f"🔍 [DEBUG] 创建 {server_name} React Agent...")
+            kwargs = {"prompt": system_prompt} if system_prompt else {}
+            agent = create_react_agent(
+                model=model,
+                tools=sync_tools,
+                **kwargs,
+            )
+            
+            # 缓存Agent
+            self._agents[key] = {
+                "fingerprint": fingerprint,
+                "agent": agent,
+                "model": model,
+                "prompt": system_prompt,
+            }
+            self._server_agents[server_name] = key
+            return agent
         
     def get_cached_agent(self, server_name: str) -> Optional[Any]:
         """
-        获取缓存的Agent实例
+        获取该服务器最近一次创建的Agent实例
+        
+        会话已重连且工具列表发生变化时，用原来的模型与提示词重新编译
         
         Args:
             server_name: 服务器名称
@@ -181,7 +398,15 @@ class MCPClientManager:
         Returns:
             缓存的Agent实例，如果不存在返回None
         """
-        return self._agents.get(server_name)
+        key = self._server_agents.get(server_name)
+        entry = self._agents.get(key) if key else None
+        if entry is None:
+            return None
+        fingerprint = self._current_fingerprint(server_name)
+        if fingerprint is not None and fingerprint != entry["fingerprint"]:
+            print(f"🔍 [DEBUG] {server_name} 工具列表已变化，重新编译 Agent")
+            return self.create_agent(server_name, entry["model"], entry["prompt"])
+        return entry["agent"]
         
     def clear_cache(self, server_name: str = None):
         """
@@ -191,23 +416,56 @@ class MCPClientManager:
             server_name: 指定服务器名称，为None时清除所有缓存
         """
         if server_name:
-            self._agents.pop(server_name, None)
+            self._close_session(server_name)
+            with self._agent_lock:
+                for key in [k for k in self._agents if k[0] == server_name]:
+                    self._agents.pop(key, None)
+                self._server_agents.pop(server_name, None)
             self._tools_cache.pop(server_name, None)
             self._clients.pop(server_name, None)
             print(f"🔍 [DEBUG] 清除 {server_name} 缓存")
         else:
-            self._agents.clear()
+            for name in list(self._sessions):
+                self._close_session(name)
+            with self._agent_lock:
+                self._agents.clear()
+                self._server_agents.clear()
             self._tools_cache.clear()
             self._clients.clear()
             print("🔍 [DEBUG] 清除所有缓存")
             
+    async def _close_sessions(self, entries):
+        """在后台事件循环中通知常驻任务关闭会话，并等待各会话的 __aexit__ 执行完毕"""
+        for closed, _, _ in entries:
+            closed.set()
+        await asyncio.gather(*(asyncio.wrap_future(worker) for _, _, worker in entries), return_exceptions=True)
+        
+    def shutdown(self):
+        """关闭所有MCP会话（等待会话正常退出）并停止后台事件循环"""
+        with self._session_lock:
+            entries = list(self._sessions.values())
+            self._sessions.clear()
+        if entries and self._loop is not None and self._loop.is_running():
+            try:
+                self.run_coroutine(self._close_sessions(entries))
+            except Exception as e:
+                print(f"🔍 [DEBUG] 等待 MCP 会话关闭超时或失败: {e!r}")
+        self.clear_cache()
+        with self._loop_lock:
+            if self._loop is not None and self._loop.is_running():
+                self._loop.call_soon_threadsafe(self._loop.stop)
+            if self._loop_thread is not None:
+                self._loop_thread.join(timeout=5)
+            self._loop = None
+            self._loop_thread = None
+            
     def get_server_info(self) -> Dict[str, Any]:
         """获取所有服务器配置信息"""
         return self.config["servers"]
         
     def is_agent_cached(self, server_name: str) -> bool:
         """检查Agent是否已缓存"""
-        return server_name in self._agents
+        return server_name in self._server_agents
 
 
 # 全局单例实例
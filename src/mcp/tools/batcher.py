@@ -0,0 +1,90 @@
+"""
+按键的微批处理（micro-batching）
+短时间窗口内到达的单键查询被收集起来，由一次批量调用统一获取结果，再分发给各调用方；
+窗口内重复的键以及已发出、尚未返回的键只查询一次
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class MicroBatcher:
+    """收集窗口期内的查询键，合并为一次 fetch_many 调用"""
+
+    def __init__(
+        self,
+        fetch_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        window: float = 0.02,
+        max_batch: int = 50,
+    ):
+        """
+        Args:
+            fetch_many: 批量获取函数，输入键列表，返回 {键: 结果}；缺失的键结果为None，抛出异常时整批失败
+            window: 收集窗口（秒），窗口内第一个键到达时开始计时
+            max_batch: 单批最大键数，达到后立即发送
+        """
+        self.fetch_many = fetch_many
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        # 已发出批量调用、尚未返回的键，期间到达的相同键直接等待该结果
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {"calls": 0, "shared": 0, "batches": 0, "keys": 0}
+
+    async def load(self, key: Hashable) -> Any:
+        """查询单个键，等待所在批次完成后返回该键的结果"""
+        self._stats["calls"] += 1
+        future = self._pending.get(key) or self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        else:
+            self._stats["shared"] += 1
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: List[Hashable]) -> Dict[Hashable, Any]:
+        """查询多个键（同一批次），返回 {键: 结果}"""
+        results = await asyncio.gather(*(self.load(key) for key in keys))
+        return dict(zip(keys, results))
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._inflight.update(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        self._stats["batches"] += 1
+        self._stats["keys"] += len(batch)
+        try:
+            results = await self.fetch_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for key, future in batch.items():
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        """返回调用次数、合并次数、批次数与平均批大小"""
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "avg_batch_size": self._stats["keys"] / batches if batches else 0.0,
+        }
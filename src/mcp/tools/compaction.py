@@ -0,0 +1,264 @@
+"""
+大结果集压缩
+工具结果在交给大模型之前，把逐点时序压缩为降采样序列 + 统计值（min/max/avg/p95）+ 突刺点，
+分组结果只保留前N组，其余组合并为汇总，减少 ToolMessage 的 token 数
+"""
+
+import math
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from timeseries import find_time_key, point_timestamp
+
+# 压缩后每条序列最多保留的点数
+COMPACT_MAX_POINTS = int(os.getenv("COMPACT_MAX_POINTS", "60"))
+# 分组结果保留的组数
+COMPACT_TOP_N = int(os.getenv("COMPACT_TOP_N", "10"))
+# 突刺判定阈值：偏离中位数超过 SPIKE_THRESHOLD 倍 MAD（中位数绝对偏差）
+SPIKE_THRESHOLD = float(os.getenv("COMPACT_SPIKE_THRESHOLD", "5"))
+# 每条序列最多报告的突刺点数
+SPIKE_LIMIT = 5
+# 分组结果中的通用指标字段，未指定指标时按这些字段排序
+METRIC_KEYS = ("count", "value", "doc_count", "total", "sum")
+
+
+def _number(value: Any) -> Optional[float]:
+    """转换为数值，无法转换（或为NaN）时返回None；支持数值字符串"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    elif isinstance(value, str):
+        try:
+            number = float(value.strip())
+        except ValueError:
+            return None
+    else:
+        return None
+    return None if math.isnan(number) else number
+
+
+def _round(value: float) -> float:
+    return round(value, 4)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """线性插值的分位数，sorted_values 需已排序且非空"""
+    position = (len(sorted_values) - 1) * q
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(values: List[Any]) -> Dict[str, Any]:
+    """计算序列的 count/min/max/avg/p95/first/last（忽略非数值点）"""
+    numbers = [n for n in (_number(v) for v in values) if n is not None]
+    if not numbers:
+        return {"count": 0}
+    ordered = sorted(numbers)
+    return {
+        "count": len(numbers),
+        "min": _round(ordered[0]),
+        "max": _round(ordered[-1]),
+        "avg": _round(sum(numbers) / len(numbers)),
+        "p95": _round(_percentile(ordered, 0.95)),
+        "first": _round(numbers[0]),
+        "last": _round(numbers[-1]),
+    }
+
+
+def find_spikes(values: List[Any], times: Optional[List[Any]] = None,
+                threshold: float = SPIKE_THRESHOLD, limit: int = SPIKE_LIMIT) -> List[Dict[str, Any]]:
+    """
+    查找突刺点：偏离中位数超过 threshold 倍 MAD 的点，按偏离程度取前 limit 个
+
+    Returns:
+        [{"time": ..., "value": ..., "score": 偏离倍数}]，按时间顺序
+    """
+    points = [(i, n) for i, n in enumerate(_number(v) for v in values) if n is not None]
+    if len(points) < 3:
+        return []
+    ordered = sorted(n for _, n in points)
+    median = _percentile(ordered, 0.5)
+    mad = _percentile(sorted(abs(n - median) for _, n in points), 0.5)
+    if mad == 0:
+        # 大部分点相同时用平均绝对偏差代替，仍为0说明序列恒定
+        mad = sum(abs(n - median) for _, n in points) / len(points)
+        if mad == 0:
+            return []
+    scored = [(abs(n - median) / mad, i, n) for i, n in points]
+    spikes = sorted((s for s in scored if s[0] >= threshold), reverse=True)[:limit]
+    return [
+        {"time": times[i] if times and i < len(times) else i, "value": _round(n), "score": _round(score)}
+        for score, i, n in sorted(spikes, key=lambda s: s[1])
+    ]
+
+
+def downsample(values: List[Any], times: Optional[List[Any]] = None,
+               max_points: int = COMPACT_MAX_POINTS) -> Dict[str, List[Any]]:
+    """
+    按等长分桶降采样，每个桶取平均值，时间取桶的第一个点
+
+    Returns:
+        {"time": [...], "value": [...]}，点数不超过 max_points
+    """
+    times = list(times) if times is not None else list(range(len(values)))
+    if len(values) <= max_points:
+        return {"time": times, "value": [_round(n) if n is not None else None for n in (_number(v) for v in values)]}
+    bucket = math.ceil(len(values) / max_points)
+    sampled_times, sampled_values = [], []
+    for start in range(0, len(values), bucket):
+        numbers = [n for n in (_number(v) for v in values[start:start + bucket]) if n is not None]
+        sampled_times.append(times[start] if start < len(times) else start)
+        sampled_values.append(_round(sum(numbers) / len(numbers)) if numbers else None)
+    return {"time": sampled_times, "value": sampled_values}
+
+
+def compact_series(values: List[Any], times: Optional[List[Any]] = None,
+                   max_points: int = COMPACT_MAX_POINTS) -> Dict[str, Any]:
+    """单条序列的压缩结果：统计值、突刺点与降采样序列"""
+    return {
+        "stats": summarize(values),
+        "spikes": find_spikes(values, times),
+        "sampled": downsample(values, times, max_points),
+    }
+
+
+def _shared_axis(series: Dict[str, Dict[str, Any]]) -> Optional[List[Any]]:
+    """
+    多条序列共用一条降采样时间轴时，把时间轴从各序列中移出，只保留各序列的值数组
+
+    Returns:
+        共用的时间轴；各序列的时间轴不一致时返回None，序列保持原样
+    """
+    axes = [item["sampled"]["time"] for item in series.values()]
+    if not axes or any(axis != axes[0] for axis in axes):
+        return None
+    for item in series.values():
+        item["sampled"] = item["sampled"]["value"]
+    return _compress_axis(axes[0])
+
+
+def _compress_axis(axis: List[Any]) -> Any:
+    """等间隔的时间轴只给出起点、间隔与点数：{"start", "step_seconds", "points"}；否则原样返回"""
+    if len(axis) < 3:
+        return axis
+    stamps = [point_timestamp(t) for t in axis]
+    if any(stamp is None for stamp in stamps):
+        return axis
+    steps = {stamps[i + 1] - stamps[i] for i in range(len(stamps) - 1)}
+    if len(steps) != 1 or next(iter(steps)) <= 0:
+        return axis
+    step = next(iter(steps))
+    return {"start": axis[0], "step_seconds": int(step) if step == int(step) else step, "points": len(axis)}
+
+
+def compact_chart(chart: Dict[str, Any], max_points: int = COMPACT_MAX_POINTS,
+                  top_n: int = COMPACT_TOP_N) -> Dict[str, Any]:
+    """
+    压缩 NPA 图表结构的数据（x_data + series_data[{name, value}]）
+
+    序列按平均值降序排列，只保留前 top_n 条的明细，其余序列只给出名称与统计值；
+    降采样后的时间轴只输出一次（sampled_time，等间隔时只给出起点与间隔），各序列的 sampled 为与之对齐的值数组
+    """
+    times = chart.get("x_data") or []
+    series = []
+    for item in chart.get("series_data") or []:
+        values = item.get("value") or []
+        series.append({"name": item.get("name"), **compact_series(values, times, max_points)})
+    series.sort(key=lambda s: s["stats"].get("avg", float("-inf")), reverse=True)
+    top = series[:top_n]
+
+    compacted = {k: v for k, v in chart.items() if k not in ("x_data", "series_data", "legend_data")}
+    compacted.update({
+        "time_range": {"start": times[0], "end": times[-1], "points": len(times)} if times else None,
+        "series_count": len(series),
+        "sampled_time": _shared_axis({index: item for index, item in enumerate(top)}),
+        "series": top,
+    })
+    if len(series) > top_n:
+        compacted["other_series"] = [{"name": s["name"], "stats": s["stats"]} for s in series[top_n:]]
+    return compacted
+
+
+def _numeric_fields(items: List[Dict[str, Any]], exclude: Optional[str] = None) -> List[str]:
+    """所有元素中都能转换为数值的字段"""
+    fields = [k for k in items[0] if k != exclude]
+    return [k for k in fields if all(_number(item.get(k)) is not None for item in items)]
+
+
+def _compact_points(items: List[Dict[str, Any]], time_key: str, max_points: int) -> Dict[str, Any]:
+    """带时间字段的点列表：每个数值字段压缩为一条序列，降采样时间轴只输出一次"""
+    times = [item[time_key] for item in items]
+    fields = _numeric_fields(items, exclude=time_key)
+    series = {field: compact_series([item[field] for item in items], times, max_points) for field in fields}
+    return {
+        "points": len(items),
+        "time_range": {"start": times[0], "end": times[-1]},
+        "sampled_time": _shared_axis(series),
+        "series": series,
+    }
+
+
+def _rank_field(fields: List[str], metrics: Sequence[str]) -> Optional[str]:
+    """排序用的指标字段：优先请求的指标（resource），其次 count/value 等通用指标字段，最后取第一个数值字段"""
+    for field in list(metrics) + list(METRIC_KEYS):
+        if field in fields:
+            return field
+    return fields[0] if fields else None
+
+
+def _compact_groups(items: List[Dict[str, Any]], max_points: int, top_n: int,
+                    metrics: Sequence[str], dimensions: Sequence[str]) -> Any:
+    """
+    分组列表：按指标字段降序保留前 top_n 组，其余组的指标字段求和汇总
+
+    分组维度字段（groupBy 的字段，如 http_code）即使是数值也不参与排序与求和；
+    汇总中的组数放在 groups 字段，不会被名为 count 的指标覆盖
+    """
+    fields = [f for f in _numeric_fields(items) if f not in dimensions]
+    rank = _rank_field(fields, metrics)
+    ordered = sorted(items, key=lambda item: _number(item[rank]), reverse=True) if rank else items
+    rest = ordered[top_n:]
+    return {
+        "groups": len(items),
+        "ranked_by": rank,
+        "top": [compact_tree(item, max_points, top_n, metrics, dimensions) for item in ordered[:top_n]],
+        "others": {"groups": len(rest), **{f: _round(sum(_number(item[f]) for item in rest)) for f in fields}},
+    }
+
+
+def compact_tree(obj: Any, max_points: int = COMPACT_MAX_POINTS, top_n: int = COMPACT_TOP_N,
+                 metrics: Sequence[str] = (), dimensions: Sequence[str] = ()) -> Any:
+    """
+    递归压缩任意结构的查询结果（用于结构不固定的 deeplog 响应）
+
+    - 带时间字段的点列表：压缩为各数值字段的统计值、突刺与降采样序列
+    - 字典列表（分组结果）：按指标字段保留前 top_n 组
+    - 数值列表：按单条序列压缩
+    - 其他结构原样递归
+
+    Args:
+        metrics: 查询的指标字段（resource），分组按其排序
+        dimensions: 分组维度字段（groupBy），不参与排序与求和
+    """
+    if isinstance(obj, dict):
+        if "x_data" in obj and "series_data" in obj:
+            return compact_chart(obj, max_points, top_n)
+        return {k: compact_tree(v, max_points, top_n, metrics, dimensions) for k, v in obj.items()}
+    if isinstance(obj, list):
+        if not obj:
+            return obj
+        time_key = find_time_key(obj)
+        if time_key is not None:
+            return _compact_points(obj, time_key, max_points)
+        if all(isinstance(item, dict) for item in obj):
+            if len(obj) <= top_n:
+                return [compact_tree(item, max_points, top_n, metrics, dimensions) for item in obj]
+            return _compact_groups(obj, max_points, top_n, metrics, dimensions)
+        if len(obj) > max_points and all(_number(item) is not None for item in obj):
+            return compact_series(obj, max_points=max_points)
+        return obj
+    return obj
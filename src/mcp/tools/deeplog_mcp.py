@@ -1,14 +1,30 @@
 import time
-import requests
+import asyncio
+import httpx
 from datetime import datetime
 import json
 import hashlib
 from typing import List, Dict, Optional, Any, Union
 from fastmcp import FastMCP
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from query_cache import TTLCache, make_cache_key, ttl_for_time_range
+import http_pool
+from query_cache import TIME_FORMAT, interval_seconds, parse_time
+from timeseries import CHUNK_CONCURRENCY, SeriesStore, UnmergeableResponses, merge_responses, split_time_range
+from singleflight import SingleFlight
+from compaction import compact_tree
 
 # 创建MCP服务器实例
 mcp = FastMCP("deep_log 日志数据查询服务", port=10026)
 
+# 查询结果缓存：键为规范化后的查询参数，历史时间窗口使用长TTL
+query_cache = TTLCache(maxsize=1024)
+# 增量查询的时序点缓存：同一序列重复查询时只查询新增的尾部
+series_store = SeriesStore()
+# 相同参数的并发查询只向上游发送一次
+inflight = SingleFlight()
+
 # 配置参数
 CONFIG_deeplog_api = {
     'appCode': 'JC_PIDLB',
@@ -38,12 +54,13 @@ def get_np_auth_headers(app_code: str, token: str) -> dict:
     return headers
 
 @mcp.tool
-def query_log_info_sum(
+async def query_log_info_sum(
     multiresource: List[str],
     timeRange: Dict[str, str],
     match: List[Dict],
     interval: str,
-    bizName: str = "lbha"
+    bizName: str = "lbha",
+    incremental: bool = False
 ) -> dict:
     """
     查询Deeplog平台的日志数据,简单求和统计
@@ -53,7 +70,8 @@ def query_log_info_sum(
         bizName: 必填,业务/数据源名称,选填("lbha","nginx","nginx4")默认"lbha"
         multiresource: 必填,字符串列表,可填(count求和表示访问量、bin字段求和表示请求带宽、bout表示响应带宽)
         timeRange: 必填,起止时间(例如从2023年1月1日0点0分0秒到2023年1月2日10点10分10秒{"start": "2023-01-01 00:00:00", "end": "2023-01-02 10:00:00"})
-        interval: 必填,时序间隔,为空时取该时间段的总体聚合值,粒度有(10s、5m、1s、1h四种单位,例如:1s、2s、1m、4h)时间范围越大填的粒度越大
+        interval: 必填,时序间隔,为空时取该时间段的总体聚合值,粒度有(10s、5m、1s、1h四种单位,例如:1s、2s、1m、4h)时间范围越大填的粒度越大(长时间范围会自动切分并行查询)
+        incremental: 选填,默认false。查询"最近N分钟/小时"这类截止到当前时间、会被反复查询的窗口时填true,只查询上次之后新增的数据(interval不能为空)
         match: 必的,匹配条件对象列表。
         match块中定义了查询过滤条件,模块中参数均为选填项,字段间关系均为AND,对OR的关系暂时不做处理
             match格式示例:
@@ -113,17 +131,95 @@ def query_log_info_sum(
         }
     }
     
+    if incremental and interval_seconds(interval):
+        return await _search_sum_incremental(params)
+    return await _search_sum_chunked(params)
+
+
+async def _search_sum_incremental(params: dict) -> dict:
+    """增量查询：复用已缓存的时序点，只向上游查询新的尾部"""
+    start = parse_time(params["timeRange"].get("start", ""))
+    end = parse_time(params["timeRange"].get("end", ""))
+    if start is None or end is None or end <= start:
+        return await _search_sum_chunked(params)
+    
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    series_key = make_cache_key("query_log_info_sum_series", {
+        key: params[key] for key in ("bizName", "multiresource", "match", "interval")
+    })
+    tail_start = series_store.plan(series_key, start_ts, end_ts, interval_seconds(params["interval"]))
+    fetch_start = start_ts if tail_start is None else tail_start
+    
+    response = None
+    if fetch_start < end_ts:
+        fetch_range = {
+            "start": datetime.fromtimestamp(fetch_start).strftime(TIME_FORMAT),
+            "end": params["timeRange"]["end"],
+        }
+        print(f"增量查询: {fetch_range}")
+        response = await _search_sum_chunked({**params, "timeRange": fetch_range})
+        if not isinstance(response, dict) or response.get("code") != 0:
+            return response
+    
+    # 不支持增量合并（无时序点、含聚合值、结构变化）：本次已是完整窗口时直接返回，否则补一次完整查询
+    if not series_store.update(series_key, response, fetch_start, end_ts):
+        if response is not None and fetch_start <= start_ts:
+            return response
+        return await _search_sum_chunked(params)
+    return series_store.build(series_key, start_ts, end_ts)
+
+
+async def _search_sum_chunked(params: dict) -> dict:
+    """长时间窗口的时序查询切分为对齐的子窗口并行查询，再合并时序结果；结果无法按时间合并时改为不切分查询"""
+    timeRange, interval = params["timeRange"], params["interval"]
+    chunks = split_time_range(timeRange, interval)
+    if len(chunks) <= 1:
+        return await _search_sum(params)
+    
+    print(f"时间窗口切分为 {len(chunks)} 个子窗口并行查询")
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+    
+    async def search_chunk(chunk):
+        async with semaphore:
+            return await _search_sum({**params, "timeRange": chunk})
+    
+    responses = await asyncio.gather(*(search_chunk(chunk) for chunk in chunks))
+    # 任一子窗口失败则返回该错误，避免给出不完整的合并结果
+    for chunk_response in responses:
+        if not isinstance(chunk_response, dict) or chunk_response.get("code") != 0:
+            return chunk_response
+    try:
+        return merge_responses(responses)
+    except UnmergeableResponses as e:
+        print(f"子窗口结果无法合并（{e}），改为不切分查询")
+        return await _search_sum(params)
+
+
+async def _search_sum(params: dict) -> dict:
+    """调用 deeplog-api 执行一次 sum 查询（带缓存）"""
+    cache_key = make_cache_key("query_log_info_sum", params)
+    hit, cached = query_cache.get(cache_key)
+    if hit:
+        print(f"命中缓存: {cache_key}")
+        return cached
+    return await inflight.do(cache_key, lambda: _fetch_sum(params, cache_key))
+
+
+async def _fetch_sum(params: dict, cache_key: str) -> dict:
+    """向 deeplog-api 发送 sum 查询，成功结果写入缓存"""
     headers = get_np_auth_headers(CONFIG_deeplog_api['appCode'], CONFIG_deeplog_api['token'])
     url = f"{CONFIG_deeplog_api['api_url']}v1/search"
     
     try:
-        response = requests.post(url, headers=headers, json=params, timeout=30)
+        response = await http_pool.request("deeplog-api", "POST", url, headers=headers, json=params, timeout=30)
         print(f"响应状态码: {response.status_code}")
         
         raw_data = response.json()
+        if response.status_code == 200 and raw_data.get("code") == 0:
+            query_cache.set(cache_key, raw_data, ttl_for_time_range(params["timeRange"]))
         return raw_data
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         error_info = {
             "code": -1,
             "message": f"请求失败: {str(e)}",
@@ -136,7 +232,7 @@ def query_log_info_sum(
 
 
 @mcp.tool
-def query_log_info_group(
+async def query_log_info_group(
     groupBy:List[str],
     resource: List[str],
     timeRange: Dict[str, str],
@@ -144,7 +240,7 @@ def query_log_info_group(
     interval: str,
     algorithm: Dict[str, Any],
     bizName: str = "lbha",
-    
+    compact: bool = False,
 ) -> dict:
     """
     
@@ -190,6 +286,7 @@ def query_log_info_group(
                 数组间关系为OR,数组内关系为AND,同字段数据内数组关系为OR
         
         groupBy,必填，字符串列表。定义数据如何展示,按照指标分组(可按照:srv_ip后端服务器ip、vip、host、url、http_code分组)。
+        compact: 选填,默认False。时间范围大或分组多时填True,只返回前N组、降采样后的时序以及min/max/avg/p95统计值和突刺点,而不是全部数据点
         
         这只是案例,需要根据用户的问题进行替换
         
@@ -252,21 +349,37 @@ def query_log_info_group(
     }
     }
     
+    cache_key = make_cache_key("query_log_info_group", params)
+    hit, result = query_cache.get(cache_key)
+    if hit:
+        print(f"命中缓存: {cache_key}")
+    else:
+        result = await inflight.do(cache_key, lambda: _fetch_group(params, cache_key))
+    if compact and "result" in result:
+        # 缓存中保存完整结果，压缩只作用于返回给大模型的内容
+        return {**result, "compact": True, "result": compact_tree(result["result"], metrics=resource, dimensions=groupBy)}
+    return result
+
+
+async def _fetch_group(params: dict, cache_key: str) -> dict:
+    """向 deeplog-ck 发送 group 查询，成功结果写入缓存"""
     headers = get_np_auth_headers(CONFIG_deeplog_ck['appCode'], CONFIG_deeplog_ck['token'])
     url = CONFIG_deeplog_ck['api_url']
     
     try:
-        response = requests.post(url, headers=headers, json=params, timeout=30)
+        response = await http_pool.request("deeplog-ck", "POST", url, headers=headers, json=params, timeout=30)
         print(f"响应状态码: {response.status_code}")
         raw_data = response.json()
         if raw_data["code"]==0:
-            return {
+            result = {
                 "info":"接口调用成功，并返回了结果",
                 "result":raw_data
             }
+            query_cache.set(cache_key, result, ttl_for_time_range(params["timeRange"]))
+            return result
         return raw_data
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         error_info = {
             "code": -1,
             "message": f"请求失败: {str(e)}",
@@ -276,6 +389,18 @@ def query_log_info_group(
             error_info["response_text"] = e.response.text
             error_info["status_code"] = e.response.status_code
         return error_info
+
+
+@mcp.custom_route("/metrics/cache", methods=["GET"])
+async def cache_metrics(request: Request) -> JSONResponse:
+    """查询缓存的命中/未命中统计（不作为MCP工具暴露给大模型）"""
+    return JSONResponse({
+        "query_cache": query_cache.stats(),
+        "series_store": series_store.stats(),
+        "singleflight": inflight.stats(),
+    })
+
+
 # 使用示例
 if __name__ == "__main__":
     # 运行MCP服务器
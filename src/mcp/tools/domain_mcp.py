@@ -1,11 +1,19 @@
 
 from fastmcp import FastMCP
+import asyncio
 import hashlib
-import requests
+import httpx
+import os
 import time
 import json
 from langchain_core.tools import tool
-from typing import List, Dict
+from typing import List, Dict, Optional
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+import http_pool
+from batcher import MicroBatcher
+from query_cache import TTLCache, make_cache_key
+from singleflight import SingleFlight
 # 创建MCP服务器实例
 mcp = FastMCP("Domain Info Service", port=10025)
 
@@ -17,6 +25,36 @@ DEFAULT_CONFIG = {
     'api_url': 'http://api-np.jd.local/V1/Dns/domainsInfo'
 }
 
+# 域名信息（负责人、项目等）很少变化，缓存时间较长；域名状态缓存时间较短
+DOMAIN_INFO_TTL = int(os.getenv("DOMAIN_INFO_TTL", "600"))
+DOMAIN_STATUS_TTL = int(os.getenv("DOMAIN_STATUS_TTL", "60"))
+# 单域名查询的合并窗口（毫秒）与单批最大域名数
+BATCH_WINDOW_MS = int(os.getenv("DOMAIN_BATCH_WINDOW_MS", "20"))
+BATCH_MAX = int(os.getenv("DOMAIN_BATCH_MAX", "50"))
+# domainsInfo 响应记录中表示域名的字段
+DOMAIN_KEYS = ("domain", "domainName", "domain_name", "name", "host")
+# domainsInfo 响应无法按域名拆分后，该鉴权参数下跳过批处理、直接整批查询的时长（秒）
+UNSPLITTABLE_TTL = int(os.getenv("DOMAIN_UNSPLITTABLE_TTL", "600"))
+# 接口外层结构中表示成功的业务码
+SUCCESS_CODES = (0, 200, "0", "200")
+
+# 按域名缓存的域名信息与域名状态
+domain_cache = TTLCache(maxsize=2048, default_ttl=DOMAIN_INFO_TTL)
+# 按 (类型, erp, businessId) 区分的批处理器
+_batchers: Dict[tuple, MicroBatcher] = {}
+# 响应无法按域名拆分的 (erp, businessId)，TTL 内不再走批处理
+_unsplittable = TTLCache(maxsize=64, default_ttl=UNSPLITTABLE_TTL)
+# 相同参数的并发查询只向上游发送一次
+inflight = SingleFlight()
+
+
+class DomainApiError(Exception):
+    """域名接口返回非200状态码或业务错误"""
+
+    def __init__(self, message: str, details: str = ""):
+        super().__init__(message)
+        self.details = details
+
 #也可以使用@tool的方式声明工具，为函数起别名，LLM通过名字再找到函数，且工具调用结果直接返回，大语言模型不做思考总结 
 def generate_signature(erp: str, businessId: str, timestamp: str) -> str:
     """生成请求签名"""
@@ -35,7 +73,7 @@ def build_headers(appCode: str, erp: str, timestamp: str, sign: str) -> dict:
     }
 
 @mcp.tool()
-def query_domains_info(domains: list, erp: str = None, businessId: str = None) -> dict:
+async def query_domains_info(domains: list, erp: str = None, businessId: str = None) -> dict:
     """
     查询一个或多个域名的完整详细信息，包括DNS记录、负责人、项目信息等。
     
@@ -70,36 +108,182 @@ def query_domains_info(domains: list, erp: str = None, businessId: str = None) -
         if businessId:
             config['businessId'] = businessId
         
-        # 生成时间戳和签名
-        timestamp = str(int(time.time()))
-        sign = generate_signature(config['erp'], config['businessId'], timestamp)
-        # 构造请求头
-        headers = build_headers(config['appCode'], config['erp'], timestamp, sign)
-        # 构造请求体
-        post_data = {"domains": domains}
-        # 执行请求
-        response = requests.post(config['api_url'], headers=headers, json=post_data)
-        if response.status_code == 200:
-            return {
-                "success": True,
-                "data": response.json(),
-                "timestamp": timestamp,
-                "domains_count": len(domains)
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"请求失败，状态码: {response.status_code}",
-                "details": response.text
-            }
-            
+        unsplittable, _ = _unsplittable.get(_auth_key(config))
+        if not unsplittable:
+            names = _normalize_domains(domains)
+            entries, missing = {}, []
+            for name in names:
+                hit, entry = domain_cache.get(_domain_key("info", name, config))
+                if hit:
+                    entries[name] = entry
+                else:
+                    missing.append(name)
+            if missing:
+                print(f"📦 域名信息缓存未命中: {missing}")
+                entries.update(await _get_batcher("info", config).load_many(missing))
+            if all(entries.get(name) is not None for name in names):
+                return {
+                    "success": True,
+                    "data": _assemble_info(entries, names, missing),
+                    "timestamp": str(int(time.time())),
+                    "domains_count": len(domains),
+                    "cached_count": len(names) - len(missing)
+                }
+
+        # 响应无法按域名拆分时（UNSPLITTABLE_TTL 内不再尝试批处理），整批查询
+        key = make_cache_key("query_domains_info", {
+            "domains": sorted(domains), "erp": config['erp'], "businessId": config['businessId']
+        })
+        return await inflight.do(key, lambda: _fetch_domains_info(domains, config))
+
+    except DomainApiError as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "details": e.details
+        }
     except Exception as e:
         return {
             "success": False,
             "error": f"执行异常: {str(e)}"
         }
+
+async def _fetch_domains_info(domains: list, config: dict) -> dict:
+    """向 domainsInfo 接口查询域名信息"""
+    # 生成时间戳和签名
+    timestamp = str(int(time.time()))
+    sign = generate_signature(config['erp'], config['businessId'], timestamp)
+    # 构造请求头
+    headers = build_headers(config['appCode'], config['erp'], timestamp, sign)
+    # 构造请求体
+    post_data = {"domains": domains}
+    # 执行请求
+    response = await http_pool.request("np-api", "POST", config['api_url'], headers=headers, json=post_data)
+    if response.status_code == 200:
+        return {
+            "success": True,
+            "data": response.json(),
+            "timestamp": timestamp,
+            "domains_count": len(domains)
+        }
+    return {
+        "success": False,
+        "error": f"请求失败，状态码: {response.status_code}",
+        "details": response.text
+    }
+
+def _normalize_domains(domains: list) -> List[str]:
+    """去除首尾空白、转为小写并去重（保持顺序）"""
+    names = []
+    for domain in domains:
+        name = str(domain).strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def _auth_key(config: dict) -> str:
+    return f"{config['erp']}:{config['businessId']}"
+
+def _domain_key(kind: str, domain: str, config: dict) -> str:
+    return f"{kind}:{config['erp']}:{config['businessId']}:{domain}"
+
+def _get_batcher(kind: str, config: dict) -> MicroBatcher:
+    """获取指定类型与鉴权参数的批处理器，同一批内的域名共用一次上游调用"""
+    key = (kind, config['erp'], config['businessId'])
+    batcher = _batchers.get(key)
+    if batcher is None:
+        fetch = _fetch_info_batch if kind == "info" else _fetch_status_batch
+        batcher = MicroBatcher(lambda names: fetch(names, config), BATCH_WINDOW_MS / 1000, BATCH_MAX)
+        _batchers[key] = batcher
+    return batcher
+
+def _record_domain(record) -> Optional[str]:
+    if isinstance(record, dict):
+        for key in DOMAIN_KEYS:
+            if isinstance(record.get(key), str):
+                return record[key].strip().lower()
+    return None
+
+def _split_domain_records(payload, names: List[str]) -> Optional[tuple]:
+    """
+    将 domainsInfo 响应按域名拆分，返回 ({域名: 记录}, 记录的组织方式 list/dict)，响应中没有的域名记录为None
+
+    支持 data 为记录列表（记录中带域名字段）或以域名为键的字典两种结构，无法识别时返回None
+    """
+    records = payload.get("data") if isinstance(payload, dict) else None
+    split = dict.fromkeys(names)
+    if isinstance(records, dict) and records and all(str(k).strip().lower() in split for k in records):
+        for key, record in records.items():
+            split[str(key).strip().lower()] = record
+        return split, "dict"
+    if isinstance(records, list):
+        for record in records:
+            name = _record_domain(record)
+            if name not in split:
+                return None
+            split[name] = record
+        return split, "list"
+    return None
+
+def _assemble_info(entries: Dict[str, dict], names: List[str], fetched: List[str]):
+    """
+    由按域名缓存的记录组装与 domainsInfo 相同结构的响应
+
+    外层结构与记录的组织方式取自本次请求实际查询到的响应，全部命中缓存时取自第一条缓存记录所在的响应
+    """
+    base = entries[fetched[0]] if fetched else entries[names[0]] if names else {"envelope": {}, "layout": "list"}
+    records = [(name, entries[name]["record"]) for name in names if entries[name]["record"] is not None]
+    if base["layout"] == "dict":
+        data = dict(records)
+    else:
+        data = [record for _, record in records]
+    return {**base["envelope"], "data": data}
+
+async def _fetch_info_batch(names: List[str], config: dict) -> Dict[str, Optional[dict]]:
+    """
+    一次 POST 查询一批域名的信息，按域名拆分后写入缓存
+
+    返回 {域名: {"record", "envelope", "layout"}}；响应无法拆分时返回空字典，本批调用方各自回退到整批查询，
+    并在 UNSPLITTABLE_TTL 内跳过批处理；业务错误时抛出 DomainApiError，不写缓存
+    """
+    timestamp = str(int(time.time()))
+    sign = generate_signature(config['erp'], config['businessId'], timestamp)
+    headers = build_headers(config['appCode'], config['erp'], timestamp, sign)
+    response = await http_pool.request("np-api", "POST", config['api_url'], headers=headers, json={"domains": names})
+    if response.status_code != 200:
+        raise DomainApiError(f"请求失败，状态码: {response.status_code}", response.text)
+
+    payload = response.json()
+    # 业务错误（签名错误、无权限等）的响应 data 往往为空，不能当作"域名不存在"写入缓存
+    if not isinstance(payload, dict) or payload.get("success") is False or payload.get("code", 0) not in SUCCESS_CODES:
+        raise DomainApiError("domainsInfo 返回业务错误", json.dumps(payload, ensure_ascii=False))
+    split = _split_domain_records(payload, names)
+    if split is None:
+        print(f"⚠️ domainsInfo 响应无法按域名拆分，{UNSPLITTABLE_TTL}s 内该鉴权参数改为整批查询: {names}")
+        _unsplittable.set(_auth_key(config), True)
+        return {}
+    records, layout = split
+    envelope = {k: v for k, v in payload.items() if k != "data"}
+    entries = {}
+    for name, record in records.items():
+        entries[name] = {"record": record, "envelope": envelope, "layout": layout}
+        domain_cache.set(_domain_key("info", name, config), entries[name], DOMAIN_INFO_TTL)
+    return entries
+
+async def _fetch_status_batch(names: List[str], config: dict) -> Dict[str, dict]:
+    """domainCheck 只支持单个域名，一批域名并行查询，成功结果写入缓存"""
+    results = await asyncio.gather(*(_fetch_domain_status(name, config) for name in names), return_exceptions=True)
+    statuses = {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            result = {"success": False, "error": f"执行异常: {str(result)}"}
+        elif result.get("success"):
+            domain_cache.set(_domain_key("status", name, config), result, DOMAIN_STATUS_TTL)
+        statuses[name] = result
+    return statuses
+
 @mcp.tool()
-def check_domain_status(domain: str, erp: str = None, businessId: str = None) -> dict:
+async def check_domain_status(domain: str, erp: str = None, businessId: str = None) -> dict:
     """
     检测域名状态，判断域名是否空闲可用。
     
@@ -133,7 +317,10 @@ def check_domain_status(domain: str, erp: str = None, businessId: str = None) ->
     """
     print(f"🔍 检查域名状态: {domain}")
     print(f"📝 参数: domain={domain}, erp={erp}, businessId={businessId}")
-    
+    return await _check_domain_status(domain, erp, businessId)
+
+async def _check_domain_status(domain: str, erp: str = None, businessId: str = None) -> dict:
+    """单个域名状态查询：先查缓存，未命中时交给批处理器与同一窗口内的其他域名一起查询"""
     try:
         # 使用传入参数或默认配置
         config = DEFAULT_CONFIG.copy()
@@ -142,47 +329,11 @@ def check_domain_status(domain: str, erp: str = None, businessId: str = None) ->
         if businessId:
             config['businessId'] = businessId
         
-        # 生成时间戳和签名
-        timestamp = str(int(time.time()))
-        sign = generate_signature(config['erp'], config['businessId'], timestamp)
-        
-        # 构造请求头
-        headers = build_headers(config['appCode'], config['erp'], timestamp, sign)
-        
-        # 构造请求URL（GET请求）
-        api_url = "http://api-np.jd.local/V1/Dns/domainCheck"
-        params = {"domain": domain}
-        
-        # 执行GET请求
-        response = requests.get(api_url, headers=headers, params=params)
-        
-        if response.status_code == 200:
-            result = response.json()
-            
-            # 解析状态信息
-            status_code = result.get('data', {}).get('status', 0)
-            status_msg = result.get('data', {}).get('msg', '未知状态')
-            
-            # 判断域名是否可用（状态码-1表示可用）
-            is_available = (status_code == -1)
-            
-            return {
-                "success": True,
-                "data": {
-                    "domain": domain,
-                    "status": status_code,
-                    "msg": status_msg,
-                    "is_available": is_available,
-                    "status_description": get_status_description(status_code)
-                },
-                "timestamp": timestamp
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"请求失败，状态码: {response.status_code}",
-                "details": response.text
-            }
+        name = domain.strip().lower()
+        hit, cached = domain_cache.get(_domain_key("status", name, config))
+        if hit:
+            return cached
+        return await _get_batcher("status", config).load(name)
             
     except Exception as e:
         return {
@@ -190,6 +341,74 @@ def check_domain_status(domain: str, erp: str = None, businessId: str = None) ->
             "error": f"执行异常: {str(e)}"
         }
 
+async def _fetch_domain_status(domain: str, config: dict) -> dict:
+    """向 domainCheck 接口查询域名状态"""
+    # 生成时间戳和签名
+    timestamp = str(int(time.time()))
+    sign = generate_signature(config['erp'], config['businessId'], timestamp)
+
+    # 构造请求头
+    headers = build_headers(config['appCode'], config['erp'], timestamp, sign)
+
+    # 构造请求URL（GET请求）
+    api_url = "http://api-np.jd.local/V1/Dns/domainCheck"
+    params = {"domain": domain}
+
+    # 执行GET请求
+    response = await http_pool.request("np-api", "GET", api_url, headers=headers, params=params)
+
+    if response.status_code == 200:
+        result = response.json()
+
+        # 解析状态信息
+        status_code = result.get('data', {}).get('status', 0)
+        status_msg = result.get('data', {}).get('msg', '未知状态')
+
+        # 判断域名是否可用（状态码-1表示可用）
+        is_available = (status_code == -1)
+
+        return {
+            "success": True,
+            "data": {
+                "domain": domain,
+                "status": status_code,
+                "msg": status_msg,
+                "is_available": is_available,
+                "status_description": get_status_description(status_code)
+            },
+            "timestamp": timestamp
+        }
+    else:
+        return {
+            "success": False,
+            "error": f"请求失败，状态码: {response.status_code}",
+            "details": response.text
+        }
+
+@mcp.tool()
+async def check_domains_status(domains: list, erp: str = None, businessId: str = None) -> dict:
+    """
+    批量检测多个域名的状态，判断域名是否空闲可用。需要检查多个域名时优先使用本工具，而不是逐个调用 check_domain_status。
+    
+    Args:
+        domains: 要检查的域名列表，例如 ['a.jd.com', 'b.jd.local']
+        erp: 操作者的ERP账号，用于权限验证。如果不提供，使用系统默认值。
+        businessId: 业务标识符，用于区分不同的业务系统。如果不提供，使用系统默认值。
+        
+    Returns:
+        返回 {"success": ..., "results": {域名: check_domain_status 的结果}, "domains_count": ...}
+        
+    示例调用：
+    >>> check_domains_status(['test.jd.com', 'new-domain.jd.local'])
+    """
+    print(f"🔍 批量检查域名状态: {domains}")
+    results = await asyncio.gather(*(_check_domain_status(domain, erp, businessId) for domain in domains))
+    return {
+        "success": all(result.get("success") for result in results),
+        "results": dict(zip(domains, results)),
+        "domains_count": len(domains)
+    }
+
 def get_status_description(status_code: int) -> str:
     """获取状态码的详细描述"""
     status_descriptions = {
@@ -202,6 +421,17 @@ def get_status_description(status_code: int) -> str:
     return status_descriptions.get(status_code, "未知状态码")
 
 
+@mcp.custom_route("/metrics/cache", methods=["GET"])
+async def cache_metrics(request: Request) -> JSONResponse:
+    """域名缓存与批处理统计（不作为MCP工具暴露给大模型）"""
+    return JSONResponse({
+        "domain_cache": domain_cache.stats(),
+        "batchers": {f"{kind}:{erp}": batcher.stats() for (kind, erp, _), batcher in _batchers.items()},
+        "singleflight": inflight.stats(),
+        "unsplittable": _unsplittable.stats()["size"],
+    })
+
+
 if __name__ == "__main__":
     print("🚀 启动域名查询 MCP 服务...")
     print("📡 传输方式: SSE")
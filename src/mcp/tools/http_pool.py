@@ -0,0 +1,76 @@
+"""
+MCP工具服务端共享的异步HTTP连接池
+每个上游服务一个 httpx.AsyncClient（keep-alive，按主机限制连接数），并用信号量限制对每个上游的并发请求数，
+慢查询只占用一个并发名额，不会阻塞事件循环上的其他会话
+"""
+
+import asyncio
+import os
+from typing import Dict
+
+import httpx
+
+# 每个上游保持的最大连接数
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+# 空闲时保留的 keep-alive 连接数
+POOL_KEEPALIVE = int(os.getenv("HTTP_POOL_KEEPALIVE", "10"))
+# 默认请求超时（秒）
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# 每个上游同时在途的最大请求数
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "8"))
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_limits: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_client(name: str = "default") -> httpx.AsyncClient:
+    """
+    获取指定上游的共享 AsyncClient（首次调用时创建）
+
+    Args:
+        name: 上游服务名称，不同上游使用独立的连接池
+
+    Returns:
+        配置好连接池的 httpx.AsyncClient
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=POOL_MAXSIZE,
+                max_keepalive_connections=POOL_KEEPALIVE,
+            ),
+        )
+        _clients[name] = client
+    return client
+
+
+def upstream_limit(name: str = "default") -> asyncio.Semaphore:
+    """获取指定上游的并发信号量"""
+    semaphore = _limits.get(name)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY)
+        _limits[name] = semaphore
+    return semaphore
+
+
+async def request(name: str, method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    在上游并发限制内发送请求
+
+    Args:
+        name: 上游服务名称
+        method: HTTP方法
+        url: 请求地址
+        **kwargs: 透传给 httpx 的参数（headers、json、params、timeout等）
+    """
+    async with upstream_limit(name):
+        return await get_client(name).request(method, url, **kwargs)
+
+
+async def close_clients():
+    """关闭所有共享 AsyncClient"""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
@@ -1,17 +1,23 @@
 
 from fastmcp import FastMCP
 import hashlib
-import requests
+import httpx
 import time
 import json
 from langchain_core.tools import tool
 from typing import List, Dict
 import logging
+import http_pool
+from singleflight import SingleFlight
+from compaction import compact_chart
 # 创建MCP服务器实例
 mcp = FastMCP("Monitor Service", port=10027)
 
+# 相同参数的并发查询只向上游发送一次
+inflight = SingleFlight()
+
 #鉴权
-def npa_summary_data(postdata, apiurl,method="POST"):
+async def npa_summary_data(postdata, apiurl,method="POST"):
     user = "xiehanqi.jackson"
     ctime = str(int(time.time()))
     new_key = f"{user}|{ctime}"
@@ -22,22 +28,23 @@ def npa_summary_data(postdata, apiurl,method="POST"):
     headers = {'auth-api': api_header_val, 'auth-user': user, 'Content-Type': "application/json", 'User-Agent': user_agent}
     try:
         if method=="POST":
-            response = requests.post(url, json=postdata, headers=headers)
+            response = await http_pool.request("npa", "POST", url, json=postdata, headers=headers)
         if method=="GET":
-            response = requests.get(url, params=postdata, headers=headers)
+            response = await http_pool.request("npa", "GET", url, params=postdata, headers=headers)
         response.raise_for_status()
         # logging.info(f"code:{response.status_code}, response:{response.text}")
         return response.json()
-    except requests.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         # logging.error(f"API request error: {e}")
         return {}
 
 
 @mcp.tool
-def npa_analysis_prometheus_core(
+async def npa_analysis_prometheus_core(
     groupname: str,
     begin_time: str,
-    end_time: str
+    end_time: str,
+    compact: bool = False
 ) -> dict:
     """
         工具功能:查询指定时间段内集群的CPU指标数据
@@ -47,6 +54,7 @@ def npa_analysis_prometheus_core(
             groupname: 集群名称(如：ga-lan-jdns1、lf-lan-jdns、ozhl-lan-jdns，通常为用2个-连接的字符串)
             begin_time: 开始时间(格式： "YYYY-MM-DD HH:MM:SS"，例如 "2025-10-04 14:00:00")
             end_time: 结束时间 （格式： "YYYY-MM-DD HH:MM:SS"，例如 "2025-10-04 14:30:00"）
+            compact: 是否压缩结果（默认False）。时间范围较大时填True，只返回降采样后的序列以及min/max/avg/p95统计值和突刺点
         
         案例:
         (1)查集群login-test-001在2023-08-01 00:00:00到2023-08-01 00:10:00的CPU指标数据
@@ -72,13 +80,17 @@ def npa_analysis_prometheus_core(
             "end_time":end_time
         }
     apiurl= "/prod-api/api/v2/analysis/prometheus/core?format=json"
-    result = npa_summary_data(postdata,apiurl)
+    key = f"prometheus_core:{groupname}|{begin_time}|{end_time}"
+    result = await inflight.do(key, lambda: npa_summary_data(postdata,apiurl))
     cpu_result = {
         "code":result['code'],
         "data":result['data'][0]
     #     # "unit_char":result['data'][0]["unit"],
     #     # "unit":"使用率"
     }
+    if compact and isinstance(cpu_result["data"], dict):
+        cpu_result["data"] = compact_chart(cpu_result["data"])
+        cpu_result["compact"] = True
     return cpu_result
 
 
@@ -0,0 +1,156 @@
+"""
+MCP工具服务端的查询结果缓存
+提供带TTL与LRU淘汰的内存缓存，以及查询参数的规范化（同一查询不同写法得到相同的缓存键）
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 时间窗口结束时间早于 (当前时间 - SETTLE_SECONDS) 视为历史数据，聚合结果不再变化
+SETTLE_SECONDS = int(os.getenv("QUERY_CACHE_SETTLE_SECONDS", "300"))
+HISTORICAL_TTL = int(os.getenv("QUERY_CACHE_HISTORICAL_TTL", "86400"))
+RECENT_TTL = int(os.getenv("QUERY_CACHE_RECENT_TTL", "30"))
+
+_INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class TTLCache:
+    """线程安全的 TTL + LRU 缓存，记录命中/未命中/淘汰次数"""
+
+    def __init__(self, maxsize: int = 512, default_ttl: float = RECENT_TTL):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        读取缓存
+
+        Returns:
+            (是否命中, 缓存值)
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return False, None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中率等统计信息"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+def parse_time(value: str) -> Optional[datetime]:
+    """解析 "YYYY-MM-DD HH:MM:SS" 格式的时间，失败时返回None"""
+    try:
+        return datetime.strptime(value.strip(), TIME_FORMAT)
+    except (AttributeError, ValueError):
+        return None
+
+
+def interval_seconds(interval: str) -> Optional[int]:
+    """将 10s、5m、1h 这类时序间隔转换为秒数，无法解析（或为空）时返回None"""
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd])\s*", str(interval or "").lower())
+    if not match:
+        return None
+    return int(match.group(1)) * _INTERVAL_UNITS[match.group(2)]
+
+
+def _canonicalize(value: Any, in_match: bool = False) -> Any:
+    if isinstance(value, dict):
+        return {str(k).strip(): _canonicalize(v, in_match) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        items = [_canonicalize(v, in_match) for v in value]
+        # match 条件中同字段的取值为 OR 关系，顺序无关
+        if in_match and all(not isinstance(v, (dict, list)) for v in items):
+            return sorted(items, key=lambda v: json.dumps(v, ensure_ascii=False))
+        return items
+    if isinstance(value, str):
+        text = value.strip()
+        # "1000" 与 1000 视为同一个阈值
+        if in_match and re.fullmatch(r"-?\d+(\.\d+)?", text):
+            return float(text)
+        return text
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def canonicalize_query(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    规范化查询参数：字典按键排序、match 内取值排序、时间与时序间隔统一格式
+    """
+    canonical = {}
+    for key, value in params.items():
+        if key == "match":
+            canonical[key] = _canonicalize(value, in_match=True)
+        elif key == "timeRange" and isinstance(value, dict):
+            canonical[key] = {
+                k: (parse_time(v).strftime(TIME_FORMAT) if parse_time(v) else str(v).strip())
+                for k, v in sorted(value.items())
+            }
+        elif key == "interval":
+            seconds = interval_seconds(value)
+            canonical[key] = f"{seconds}s" if seconds is not None else str(value or "").strip()
+        else:
+            canonical[key] = _canonicalize(value)
+    return dict(sorted(canonical.items()))
+
+
+def make_cache_key(namespace: str, params: Dict[str, Any]) -> str:
+    """由命名空间（工具名）和规范化后的参数生成缓存键"""
+    payload = json.dumps(canonicalize_query(params), ensure_ascii=False, sort_keys=True)
+    return f"{namespace}:{hashlib.sha1(payload.encode('utf-8')).hexdigest()}"
+
+
+def ttl_for_time_range(time_range: Dict[str, str]) -> float:
+    """
+    根据查询时间窗口决定缓存时间：完全落在过去的窗口使用长TTL，包含最近数据的窗口使用短TTL
+    """
+    end = parse_time((time_range or {}).get("end", ""))
+    if end is not None and end.timestamp() <= time.time() - SETTLE_SECONDS:
+        return HISTORICAL_TTL
+    return RECENT_TTL
@@ -0,0 +1,39 @@
+"""
+上游请求合并（single-flight）
+同一时刻参数相同的多个请求只向上游发送一次，所有并发调用方共享同一个结果
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """按键合并并发中的相同请求"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行 fn 并返回结果；若相同 key 的请求正在进行中，则等待并复用其结果
+
+        上游请求在独立的任务中执行，某个调用方被取消不会影响其他等待同一结果的调用方。
+
+        Args:
+            key: 请求键（通常为规范化参数生成的缓存键）
+            fn: 无参协程函数，真正发起上游请求
+        """
+        self._stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._stats["shared"] += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回调用次数、合并次数与当前在途请求数"""
+        return {**self._stats, "inflight": len(self._inflight)}
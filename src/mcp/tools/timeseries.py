@@ -0,0 +1,338 @@
+"""
+deeplog 时序查询的时间窗口切分、结果合并与增量查询缓存
+长时间窗口按对齐的子窗口切分后并行查询，再把各子窗口的时序结果合并为一个响应；
+重复查询同一序列时只查询新增的尾部数据
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from query_cache import SETTLE_SECONDS, TIME_FORMAT, interval_seconds, parse_time
+
+# 每个子窗口最多包含的时序点数
+CHUNK_MAX_POINTS = int(os.getenv("DEEPLOG_CHUNK_MAX_POINTS", "360"))
+# 子窗口最短时长（秒），短于该时长的查询不切分
+CHUNK_MIN_SECONDS = int(os.getenv("DEEPLOG_CHUNK_MIN_SECONDS", "3600"))
+# 子窗口并发查询数
+CHUNK_CONCURRENCY = int(os.getenv("DEEPLOG_CHUNK_CONCURRENCY", "4"))
+
+# 时序点中表示时间的字段名
+TIME_KEYS = ("time", "timestamp", "ts", "date", "key_as_string", "key", "x")
+# 响应中的元信息字段，合并时取第一个子窗口的值
+META_KEYS = ("code", "msg", "message", "status", "success", "info")
+
+
+class UnmergeableResponses(ValueError):
+    """子窗口响应中有无法按时间合并的内容（时序点之外的数值、无法识别的列表），调用方应改为不切分查询"""
+
+
+def _format(ts: float) -> str:
+    return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+
+
+def chunk_seconds(interval: str) -> int:
+    """子窗口时长：CHUNK_MAX_POINTS 个时序点，且为时序间隔的整数倍"""
+    step = interval_seconds(interval) or 0
+    size = max(CHUNK_MIN_SECONDS, step * CHUNK_MAX_POINTS)
+    if step:
+        size = (size // step) * step
+    return size
+
+
+def split_time_range(time_range: Dict[str, str], interval: str) -> List[Dict[str, str]]:
+    """
+    将时间窗口切分为对齐的子窗口
+
+    子窗口边界对齐到子窗口时长的整数倍，同一时段在不同查询中得到相同的子窗口，
+    从而可以命中查询缓存。窗口不足一个子窗口时原样返回；
+    没有时序间隔（整个窗口一个聚合值）时各子窗口的结果无法合并，也原样返回。
+
+    Returns:
+        子窗口列表，每项为 {"start": ..., "end": ...}
+    """
+    if not interval_seconds(interval):
+        return [time_range]
+    start = parse_time((time_range or {}).get("start", ""))
+    end = parse_time((time_range or {}).get("end", ""))
+    if start is None or end is None or end <= start:
+        return [time_range]
+
+    size = chunk_seconds(interval)
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    if end_ts - start_ts <= size:
+        return [time_range]
+
+    chunks = []
+    cursor = start_ts
+    boundary = (int(start_ts) // size + 1) * size
+    while cursor < end_ts:
+        chunk_end = min(boundary, end_ts)
+        chunks.append({"start": _format(cursor), "end": _format(chunk_end)})
+        cursor = chunk_end
+        boundary += size
+    return chunks
+
+
+def find_time_key(items: List[Any]) -> Optional[str]:
+    """列表中的元素都是带时间字段的字典时，返回该时间字段名"""
+    if not items or not all(isinstance(item, dict) for item in items):
+        return None
+    for key in TIME_KEYS:
+        if all(key in item for item in items):
+            return key
+    return None
+
+
+def _sort_key(value: Any):
+    return (type(value).__name__, value)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def merge_values(values: List[Any]) -> Any:
+    """
+    合并多个子窗口中同一位置的值
+
+    - 字典：取所有子窗口键的并集，按键递归合并
+    - 带时间字段的点列表：拼接，按时间去重（后面子窗口的值覆盖前面的）并排序
+    - 数值（时序点之外的聚合值）、无法识别为时序点的列表：不猜测语义，抛出 UnmergeableResponses；
+      不含数值且各子窗口相同的列表除外
+    - 其他标量（字符串等元数据）：取第一个子窗口的值
+
+    Args:
+        values: 各子窗口中该位置的值（按时间顺序）
+    """
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+
+    if all(isinstance(v, dict) for v in values):
+        merged = {}
+        for value in values:
+            for field in value:
+                if field not in merged:
+                    merged[field] = merge_values([v.get(field) for v in values])
+        return merged
+
+    if all(isinstance(v, list) for v in values):
+        items = [item for value in values for item in value]
+        time_key = find_time_key(items)
+        if time_key is None:
+            if all(v == values[0] for v in values) and not has_aggregates(values[0], []):
+                return values[0]
+            raise UnmergeableResponses("子窗口响应中有无法识别为时序点的列表")
+        by_time = {}
+        for item in items:
+            by_time[item[time_key]] = item
+        return [by_time[t] for t in sorted(by_time, key=_sort_key)]
+
+    if any(_is_number(v) for v in values):
+        raise UnmergeableResponses("子窗口响应中有时序点之外的数值")
+    return values[0]
+
+
+def merge_responses(responses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并各子窗口的响应：取所有响应顶层键的并集，元信息取第一个带该字段的响应，其余字段按 merge_values 合并
+
+    Raises:
+        UnmergeableResponses: 响应中有无法按时间合并的内容
+    """
+    if len(responses) == 1:
+        return responses[0]
+    merged = {}
+    for response in responses:
+        for key in response:
+            if key in merged:
+                continue
+            if key in META_KEYS:
+                merged[key] = response[key]
+            else:
+                merged[key] = merge_values([r.get(key) for r in responses])
+    return merged
+
+
+def find_series_paths(obj: Any, path: tuple = ()) -> List[tuple]:
+    """查找响应中所有带时间字段的点列表，返回各自的路径（键/下标组成的元组），不进入点列表内部"""
+    if isinstance(obj, list):
+        if find_time_key(obj) is not None:
+            return [path]
+        return [found for index, item in enumerate(obj) for found in find_series_paths(item, path + (index,))]
+    if isinstance(obj, dict):
+        return [found for key, value in obj.items() for found in find_series_paths(value, path + (key,))]
+    return []
+
+
+def has_aggregates(obj: Any, series_paths: List[tuple], path: tuple = ()) -> bool:
+    """点列表之外是否还有数值字段（元信息字段除外），这类聚合值无法由缓存的时序点重建"""
+    if path in series_paths:
+        return False
+    if isinstance(obj, dict):
+        return any(
+            has_aggregates(value, series_paths, path + (key,))
+            for key, value in obj.items() if not (path == () and key in META_KEYS)
+        )
+    if isinstance(obj, list):
+        return any(has_aggregates(item, series_paths, path + (index,)) for index, item in enumerate(obj))
+    return _is_number(obj)
+
+
+def _get_path(obj: Any, path: tuple) -> Any:
+    for part in path:
+        obj = obj[part]
+    return obj
+
+
+def _replace_path(obj: Any, path: tuple, value: Any) -> Any:
+    """返回替换了指定路径上的值的副本，沿途的字典/列表均复制，不修改原对象"""
+    if not path:
+        return value
+    head, rest = path[0], path[1:]
+    copied = dict(obj) if isinstance(obj, dict) else list(obj)
+    copied[head] = _replace_path(obj[head], rest, value)
+    return copied
+
+
+def point_timestamp(value: Any) -> Optional[float]:
+    """将时序点的时间字段转换为时间戳（支持秒/毫秒时间戳与 "YYYY-MM-DD HH:MM:SS" 字符串）"""
+    if isinstance(value, str):
+        parsed = parse_time(value)
+        if parsed is not None:
+            return parsed.timestamp()
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value / 1000 if value > 1e11 else float(value)
+    return None
+
+
+class SeriesStore:
+    """
+    增量（tail）查询的时序点缓存
+
+    按序列（业务、指标、过滤条件、时序间隔）保存已经查询过的时序点及其覆盖的时间范围，
+    重复查询“最近N分钟”这类窗口时，只需要查询上次最后一个点之后的新数据
+    """
+
+    def __init__(self, maxsize: int = 128, max_points: int = 20000):
+        self.maxsize = maxsize
+        self.max_points = max_points
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "cached_points_served": 0}
+
+    def plan(self, key: str, start_ts: float, end_ts: float, step: int) -> Optional[float]:
+        """
+        计算需要向上游查询的起始时间
+
+        Returns:
+            尾部查询的起始时间戳（>= end_ts 表示无需查询）；缓存无法覆盖窗口开头时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (entry["start"] <= start_ts <= entry["end"]):
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            # 最后一个桶可能不完整，最近 SETTLE_SECONDS 内的数据也可能延迟到达，都重新查询
+            tail_start = min(entry["end"] - step, time.time() - SETTLE_SECONDS)
+            tail_start = (int(tail_start) // step) * step
+            return max(tail_start, start_ts)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _index_points(self, items: List[Dict[str, Any]]) -> Optional[Dict[float, Any]]:
+        time_key = find_time_key(items)
+        points = {}
+        for item in items:
+            ts = point_timestamp(item[time_key])
+            if ts is None:
+                return None
+            points[ts] = item
+        return points
+
+    def update(self, key: str, response: Optional[Dict[str, Any]], start_ts: float, end_ts: float) -> bool:
+        """
+        将新查询到的时序点合并进缓存
+
+        响应中的每条时序（如多资源结果中的 bin/bout/count）分别按路径缓存；点列表之外的数值字段
+        （聚合值）无法由缓存的时序点重建，遇到时不做增量。
+
+        Returns:
+            不支持增量查询时返回False（没有可识别的时序点列表、含聚合值、时序结构与缓存不一致），
+            此时已丢弃该序列的缓存，调用方应做一次完整查询
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if response is None:
+                return entry is not None
+
+            paths = find_series_paths(response)
+            if not paths or has_aggregates(response, paths):
+                self._entries.pop(key, None)
+                return False
+            series = {}
+            for path in paths:
+                points = self._index_points(_get_path(response, path))
+                if points is None:
+                    self._entries.pop(key, None)
+                    return False
+                series[path] = points
+
+            if entry is not None and entry["start"] <= start_ts <= entry["end"]:
+                if set(entry["series"]) != set(series):
+                    # 时序结构变化，尾部结果无法与缓存拼接
+                    self._entries.pop(key, None)
+                    return False
+                # 重新查询的时间段以新结果为准
+                for path, points in series.items():
+                    kept = {ts: item for ts, item in entry["series"][path].items() if ts < start_ts}
+                    kept.update(points)
+                    entry["series"][path] = kept
+                entry["end"] = max(entry["end"], end_ts)
+            else:
+                entry = {"start": start_ts, "end": end_ts, "series": series}
+                self._entries[key] = entry
+            entry["template"] = response
+
+            # 超出点数上限时丢弃最早的点（各条时序使用同一个起点）
+            timestamps = sorted({ts for points in entry["series"].values() for ts in points})
+            if len(timestamps) > self.max_points:
+                entry["start"] = timestamps[-self.max_points]
+                entry["series"] = {
+                    path: {ts: item for ts, item in points.items() if ts >= entry["start"]}
+                    for path, points in entry["series"].items()
+                }
+
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return True
+
+    def build(self, key: str, start_ts: float, end_ts: float) -> Dict[str, Any]:
+        """用缓存的时序点组装 [start_ts, end_ts) 窗口的响应，每条时序都替换为完整窗口的点"""
+        with self._lock:
+            entry = self._entries[key]
+            result = entry["template"]
+            for path, points in entry["series"].items():
+                window = [points[ts] for ts in sorted(points) if start_ts <= ts < end_ts]
+                self._stats["cached_points_served"] += len(window)
+                result = _replace_path(result, path, window)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "series": len(self._entries)}